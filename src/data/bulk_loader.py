@@ -0,0 +1,194 @@
+import asyncio
+import functools
+import logging
+import os
+import random
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import urllib3
+from data import ohlc_cache
+from data.config import chart_url, ohlc_max_age
+from logic import instrumentation
+
+# Bulk warming of the local OHLC store: many tickers are loaded concurrently through a bounded pool of worker
+# threads sharing a bounded pool of keep-alive connections. Transient failures (timeouts, 429s & 5xx) are retried
+# with exponential backoff, waited out on the event loop so they don't hold a worker. Every ticker gets a status row,
+# failures included, instead of failing the whole run or being swallowed.
+
+status_columns = ['Ticker', 'Status', 'Bars', 'Last Date', 'Attempts', 'Seconds', 'Error']
+retry_statuses = {429, 500, 502, 503, 504}
+user_agent = 'Mozilla/5.0 (compatible; strategy-tester)'
+
+logger = logging.getLogger(__name__)
+
+
+class FetchError(Exception):
+
+    def __init__(self, ticker, status, reason=''):
+        super().__init__(f'{ticker}: HTTP {status} {reason}'.strip())
+        self.status = status
+
+
+# Connection pool of fetch_chart when none is given (ie: single fetches outside of a bulk load)
+default_pool = urllib3.PoolManager(headers={'User-Agent': user_agent})
+
+
+# Daily bars & ticker details from the chart endpoint, in fetch_yfinance's format (prices adjusted for splits
+# & dividends, Dividends & Stock Splits columns, naive exchange dates). Same signature as fetch_yfinance.
+def fetch_chart(ticker, start=None, period='max', pool=None, base_url=chart_url, timeout=30):
+    fields = {'interval': '1d', 'events': 'div,splits', 'includeAdjustedClose': 'true'}
+    if start is None:
+        fields['range'] = period
+    else:
+        fields['period1'] = int(pd.Timestamp(start).timestamp())
+        fields['period2'] = int(time.time())
+
+    response = (pool or default_pool).request('GET', f"{base_url}/{urllib.parse.quote(ticker, safe='')}",
+                                              fields=fields, timeout=timeout, retries=False)
+    if response.status != 200:
+        raise FetchError(ticker, response.status, response.reason or '')
+    chart = response.json()['chart']
+    if chart.get('error') or not chart.get('result'):
+        raise ValueError(f'No price history found for {ticker}')
+    return chart_history(chart['result'][0])
+
+
+def chart_history(result):
+    meta = result['meta']
+    timezone = meta.get('exchangeTimezoneName', 'UTC')
+
+    def exchange_dates(timestamps):
+        return pd.to_datetime(timestamps, unit='s', utc=True).tz_convert(timezone).tz_localize(None).normalize()
+
+    quote = result['indicators']['quote'][0] if result.get('timestamp') else {}
+    history = pd.DataFrame({column: quote.get(column.lower(), []) for column in ohlc_cache.price_columns + ['Volume']},
+                           index=exchange_dates(result.get('timestamp', [])), dtype=float)
+    adjusted_close = result['indicators'].get('adjclose', [{}])[0].get('adjclose') if len(history) else None
+    if adjusted_close is not None:
+        # Same back adjustment as yfinance's auto_adjust: every price of a bar scaled by its adjusted/raw close
+        ratio = np.asarray(adjusted_close, dtype=float) / history['Close'].to_numpy()
+        history[ohlc_cache.price_columns] = history[ohlc_cache.price_columns].mul(ratio, axis=0)
+
+    history['Dividends'] = 0.0
+    history['Stock Splits'] = 0.0
+    events = result.get('events', {})
+    for column, records, value in [('Dividends', events.get('dividends', {}), lambda event: event['amount']),
+                                   ('Stock Splits', events.get('splits', {}),
+                                    lambda event: event['numerator'] / event['denominator'])]:
+        for event in records.values():
+            date = exchange_dates([event['date']])[0]
+            if date in history.index:
+                history.loc[date, column] = value(event)
+
+    history = history.dropna(subset=['Close'])  # Bars without trades (ie: half days) come back as nulls
+    history = history.loc[~history.index.duplicated(keep='last')]  # The live bar can repeat the last session
+    history['Volume'] = history['Volume'].fillna(0).astype('int64')
+    history.index.name = 'Date'
+    info = {'currency': meta.get('currency'), 'exchange': meta.get('exchangeName'),
+            'quoteType': meta.get('instrumentType'), 'timezone': timezone,
+            'lastPrice': meta.get('regularMarketPrice')}
+    return history, info
+
+
+# Timeouts, dropped connections, rate limits & server errors are worth another attempt, unknown tickers aren't
+def retryable(error):
+    if isinstance(error, FetchError):
+        return error.status in retry_statuses
+    return isinstance(error, (urllib3.exceptions.HTTPError, ConnectionError, TimeoutError))
+
+
+# Loads (or refreshes) one ticker into the store, within a worker thread. compact=True also writes the
+# memory-mappable files of load_price_history, so app sessions open the ticker without rewriting them.
+# timeframes: timeframes whose cached bars (ohlc_cache.load_bars) are brought up to date as well.
+# adjusted=True also brings its corporate action adjusted bars (ohlc_cache.load_adjusted) up to date.
+def store_ticker(ticker, fetch, cache_dir, max_age, compact, timeframes=(), adjusted=False):
+    history, _ = ohlc_cache.load_history(ticker, fetch=fetch, cache_dir=cache_dir, max_age=max_age, fallback=False)
+    path = ohlc_cache.cache_path(ticker, cache_dir)
+    if compact:
+        if not all(os.path.exists(ohlc_cache.compact_path(ticker, cache_dir, float32)) and
+                   os.path.getmtime(ohlc_cache.compact_path(ticker, cache_dir, float32)) >= os.path.getmtime(path)
+                   for float32 in [False, True]):
+            ohlc_cache.write_compact(ticker, history, cache_dir)
+    for timeframe in timeframes:
+        bars_path = ohlc_cache.bars_path(ticker, timeframe, cache_dir)
+        if not os.path.exists(bars_path) or os.path.getmtime(bars_path) < os.path.getmtime(path):
+            ohlc_cache.write_bars(ticker, history, timeframe, cache_dir)
+    adjusted_path = ohlc_cache.adjusted_path(ticker, cache_dir)
+    if adjusted and (not os.path.exists(adjusted_path) or os.path.getmtime(adjusted_path) < os.path.getmtime(path)):
+        ohlc_cache.write_adjusted(ticker, history, cache_dir)
+    return history
+
+
+async def load_ticker(loop, executor, ticker, fetch, cache_dir, max_age, compact, retries, backoff, timeframes=(),
+                      adjusted=False):
+    started = time.perf_counter()
+    fetches = []  # start of every fetch, to tell downloads from updates & cache hits
+
+    def counted_fetch(symbol, start=None):
+        fetches.append(start)
+        return fetch(symbol, start=start)
+
+    history, error, attempt = None, None, 0
+    while history is None:
+        attempt += 1
+        try:
+            history = await loop.run_in_executor(executor, store_ticker, ticker, counted_fetch, cache_dir, max_age,
+                                                 compact, timeframes, adjusted)
+        except Exception as exc:
+            error = exc
+            if attempt > retries or not retryable(exc):
+                logger.warning('Loading %s failed after %s attempt(s): %s', ticker, attempt, exc)
+                break
+            delay = backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)  # Jittered, so retries don't line up
+            logger.info('Loading %s failed (%s), retrying in %.1fs', ticker, exc, delay)
+            await asyncio.sleep(delay)
+
+    if history is None:
+        status = 'failed'
+    elif not fetches:
+        status = 'cached'
+    else:
+        status = 'downloaded' if None in fetches else 'updated'
+    return {'Ticker': ticker, 'Status': status, 'Bars': 0 if history is None else len(history),
+            'Last Date': None if history is None or history.empty else history.index[-1],
+            'Attempts': attempt, 'Seconds': time.perf_counter() - started,
+            'Error': None if history is not None else repr(error)}
+
+
+# Loads every ticker into the local store with at most workers fetches (& connections) in flight.
+# fetch: fetch function as in ohlc_cache.load_history, fetch_chart on a pool of workers connections by default.
+# Returns one status_columns row per ticker: Status is downloaded (full history), updated (bars since the last
+# cached date), cached (still fresh within max_age) or failed, with the last Error after retries.
+async def load_all(tickers, fetch=None, cache_dir=None, max_age=ohlc_max_age, workers=16, retries=3, backoff=1.0,
+                   compact=True, base_url=chart_url, timeout=30, timeframes=(), adjusted=False):
+
+    tickers = list(dict.fromkeys(ticker.upper() for ticker in tickers))
+    pool = None
+    if fetch is None:
+        pool = urllib3.PoolManager(maxsize=workers, block=True, headers={'User-Agent': user_agent})
+        fetch = functools.partial(fetch_chart, pool=pool, base_url=base_url, timeout=timeout)
+
+    loop = asyncio.get_running_loop()
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk_loader') as executor:
+            rows = await asyncio.gather(*[load_ticker(loop, executor, ticker, fetch, cache_dir, max_age, compact,
+                                                      retries, backoff, timeframes, adjusted) for ticker in tickers])
+    finally:
+        if pool is not None:
+            pool.clear()
+    return pd.DataFrame(rows, columns=status_columns)
+
+
+# Blocking version of load_all, for scripts & the CLI
+def bulk_load(tickers, fetch=None, cache_dir=None, max_age=ohlc_max_age, workers=16, retries=3, backoff=1.0,
+              compact=True, base_url=chart_url, timeout=30, timeframes=(), adjusted=False):
+
+    with instrumentation.span('bulk_load') as record:
+        statuses = asyncio.run(load_all(tickers, fetch=fetch, cache_dir=cache_dir, max_age=max_age, workers=workers,
+                                        retries=retries, backoff=backoff, compact=compact, base_url=base_url,
+                                        timeout=timeout, timeframes=timeframes, adjusted=adjusted))
+        record.update(statuses['Status'].value_counts().to_dict())
+    return statuses
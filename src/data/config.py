@@ -1,7 +1,23 @@
-import streamlit as st
+import os
+
 app_defaults = {
     "display_candlestick": True , 
     "allow_fractional": True , 
     "sell_all": False , 
     "markers_bool": False ,
+    "float32_prices": False ,
+    "max_plot_points": 2000 ,
+    "debug_panel": False ,
 }
+
+# Local OHLC store (one Parquet file per ticker) & how long a cached ticker is served before refreshing
+ohlc_cache_dir = os.environ.get('OHLC_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'strategy_tester'))
+ohlc_max_age = 12 * 60 * 60
+# Wait before retrying a refresh that failed (ie: offline), serving the cached bars meanwhile
+ohlc_retry_after = 15 * 60
+
+# Daily chart endpoint of bulk_loader's fetches (ie: a local stub server when testing)
+chart_url = os.environ.get('CHART_URL', 'https://query2.finance.yahoo.com/v8/finance/chart')
+
+# Port serving the Prometheus metrics of the pipeline stages (unset = not served)
+metrics_port = os.environ.get('METRICS_PORT')
@@ -1,21 +1,64 @@
+import logging
+import pandas as pd
 import streamlit as st 
-import yfinance as yf
 import logic.trade_logic as trade_logic
-import pandas as pd 
+from logic import indicators
+from logic.instrumentation import timed
+from logic.price_history import PriceHistory
+from data import ohlc_cache
+from data.config import ohlc_max_age
 
+logger = logging.getLogger(__name__)
+
+
+def history_rows(result):
+    return {'bars': 0 if result[0] is None else len(result[0])}
+
+
+# Full histories come from the local OHLC store, which only fetches the bars missing since the last visit.
+# Timed outside of the cache, so the load_ticker stage includes cache hits.
+@timed('load_ticker', count=history_rows)
 @st.cache_data
 def load_ticker(ticker, timeframe='max'):
-    ticker_obj = yf.Ticker(ticker)
     try:
-        ticker_data = ticker_obj.history(period=timeframe)
-        ticker_data.index = pd.to_datetime(ticker_data.index).tz_localize(None)
-        details = ticker_obj.fast_info
-        return ticker_data, dict(details)
+        if timeframe == 'max':
+            return ohlc_cache.load_history(ticker)
+        return ohlc_cache.fetch_yfinance(ticker, period=timeframe)
     except:
+        logger.warning('No history loaded for %s', ticker, exc_info=True)
         return None, None
 
 
-@st.cache_data
-def get_trades(strategy, asset_data, long_bool, gap=0, spans=(None), scaling=1, start=None):
+# Compact OHLC history memory-mapped from the local store. Cached as a shared resource, so sessions
+# viewing the same ticker use the same arrays instead of each holding a copy of the full DataFrame.
+@timed('load_price_history', count=history_rows)
+@st.cache_resource(ttl=ohlc_max_age)
+def load_price_history(ticker, float32=False):
+    try:
+        return ohlc_cache.load_price_history(ticker, float32=float32)
+    except:
+        logger.warning('No history loaded for %s', ticker, exc_info=True)
+        return None, None
+
+
+# Corporate action adjusted history of a ticker as a PriceHistory for the trade logic, along with its per share
+# Dividends (by ex-date) & details. The adjustment is cached in the local store, so reruns never recompute it.
+@timed('load_adjusted_history', count=history_rows)
+@st.cache_resource(ttl=ohlc_max_age)
+def load_adjusted_history(ticker, float32=False):
+    try:
+        adjusted, info = ohlc_cache.load_adjusted(ticker)
+    except:
+        logger.warning('No adjusted history loaded for %s', ticker, exc_info=True)
+        return None, None, None
+    return PriceHistory.from_frame(adjusted, float32=float32, name=ticker), adjusted['Dividends'], info
+
+
+# Histories are hashed by their content fingerprint (memoized for PriceHistory) rather than by streamlit's hashing
+@st.cache_data(hash_funcs={pd.DataFrame: lambda frame: indicators.history_fingerprint(frame, PriceHistory.columns),
+                           PriceHistory: PriceHistory.fingerprint})
+def get_trades(strategy, asset_data, long_bool, gap=0, spans=(None), scaling=1, start=None, calendar_gap=False,
+               timeframe=None):
     return trade_logic.get_trades(strategy=strategy, long_bool=long_bool, asset_data=asset_data, gap=gap,
-                                  spans=spans, scaling=scaling, start=start)
\ No newline at end of file
+                                  spans=spans, scaling=scaling, start=start, calendar_gap=calendar_gap,
+                                  timeframe=timeframe)
@@ -0,0 +1,209 @@
+import json
+import os
+import time
+import pandas as pd
+from data.config import ohlc_cache_dir, ohlc_max_age, ohlc_retry_after
+from logic import adjustments, timeframes
+from logic.instrumentation import timed
+from logic.price_history import PriceHistory
+
+price_columns = ['Open', 'High', 'Low', 'Close']
+
+
+# Default fetch function. Returns the daily bars from start onwards (full period when start is None)
+# along with the ticker details. Any callable with the same signature can stand in for it.
+@timed('fetch_yfinance', count=lambda result: {'bars': len(result[0])})
+def fetch_yfinance(ticker, start=None, period='max'):
+    import yfinance as yf  # Only needed once something is downloaded
+
+    ticker_obj = yf.Ticker(ticker)
+    history = ticker_obj.history(period=period) if start is None else ticker_obj.history(start=start)
+    history.index = pd.to_datetime(history.index).tz_localize(None)
+    return history, dict(ticker_obj.fast_info)
+
+
+def cache_path(ticker, cache_dir=None, suffix='.parquet'):
+    return os.path.join(cache_dir or ohlc_cache_dir, f"{ticker.upper().replace(os.sep, '_')}{suffix}")
+
+
+def compact_path(ticker, cache_dir=None, float32=False):
+    return cache_path(ticker, cache_dir, suffix='.f32.arrow' if float32 else '.f64.arrow')
+
+
+# Loads a ticker's daily history & details from the local store. Stale entries only fetch the bars
+# from the last cached date onwards; the full history is only downloaded for unseen tickers & when those bars
+# hold a split or dividend (see restates_history).
+# fallback=False raises failed refreshes instead of serving the cached bars (ie: to retry them), which are
+# otherwise served without another refresh for retry_after seconds (at most max_age).
+@timed('store_load_history', count=lambda result: {'bars': len(result[0])})
+def load_history(ticker, fetch=fetch_yfinance, cache_dir=None, max_age=ohlc_max_age, fallback=True,
+                 retry_after=ohlc_retry_after):
+    path = cache_path(ticker, cache_dir)
+    info_path = os.path.splitext(path)[0] + '.json'
+
+    if not os.path.exists(path):
+        history, info = fetch(ticker, start=None)
+        if history is None or history.empty:
+            raise ValueError(f'No price history found for {ticker}')
+        write_history(path, history, info_path, info)
+        return history, info
+
+    history = pd.read_parquet(path)
+    info = read_info(info_path)
+    if time.time() - os.path.getmtime(path) < max_age:
+        return history, info
+
+    try:
+        fresh, fresh_info = fetch(ticker, start=history.index[-1])
+        restated = restates_history(fresh, history.index[-1])
+        if restated:
+            fresh, fresh_info = fetch(ticker, start=None)
+            if fresh is None or fresh.empty:
+                raise ValueError(f'No price history found for {ticker}')
+    except Exception:
+        if not fallback:
+            raise
+        # Serve the cached bars when the refresh fails (ie: offline), stale again once retry_after has passed
+        retry_at = time.time() - max_age + min(retry_after, max_age)
+        os.utime(path, (retry_at, retry_at))
+        return history, info
+
+    if fresh is None or fresh.empty:
+        os.utime(path)  # Nothing new upstream, restart the max_age window
+        return history, info
+
+    history = fresh if restated else merge_bars(history, fresh)
+    write_history(path, history, info_path, fresh_info or info)
+    return history, fresh_info or info
+
+
+# Memory-mapped OHLC view of a ticker's cached history (refreshed as in load_history) along with its details.
+# Sessions opening the same ticker share the mapped pages instead of holding their own DataFrame copies.
+@timed('store_load_price_history', count=lambda result: {'bars': len(result[0])})
+def load_price_history(ticker, float32=False, fetch=fetch_yfinance, cache_dir=None, max_age=ohlc_max_age):
+    path = cache_path(ticker, cache_dir)
+    compact = compact_path(ticker, cache_dir, float32)
+    fresh = os.path.exists(path) and time.time() - os.path.getmtime(path) < max_age
+    if fresh and os.path.exists(compact) and os.path.getmtime(compact) >= os.path.getmtime(path):
+        info = read_info(os.path.splitext(path)[0] + '.json')
+    else:
+        history, info = load_history(ticker, fetch=fetch, cache_dir=cache_dir, max_age=max_age)
+        write_compact(ticker, history, cache_dir)
+    return PriceHistory.from_arrow(compact, name=ticker.upper()), info
+
+
+def bars_path(ticker, timeframe, cache_dir=None):
+    return cache_path(ticker, cache_dir, suffix=f'.{timeframe}.parquet')
+
+
+# Bars of a ticker at timeframe (see timeframes), cached next to its daily bars. The daily history is loaded
+# (& refreshed) as in load_history; the cached bars are served while they're at least as recent as it, and are
+# otherwise brought up to date from the last cached bar onwards.
+@timed('store_load_bars', count=lambda result: {'bars': len(result[0])})
+def load_bars(ticker, timeframe, fetch=fetch_yfinance, cache_dir=None, max_age=ohlc_max_age):
+    history, info = load_history(ticker, fetch=fetch, cache_dir=cache_dir, max_age=max_age)
+    path = bars_path(ticker, timeframe, cache_dir)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(cache_path(ticker, cache_dir)):
+        return pd.read_parquet(path), info
+    return write_bars(ticker, history, timeframe, cache_dir), info
+
+
+# Updates (or builds) the cached bars of a ticker at timeframe from its daily history & returns them
+def write_bars(ticker, history, timeframe, cache_dir=None):
+    path = bars_path(ticker, timeframe, cache_dir)
+    cached = pd.read_parquet(path) if os.path.exists(path) else None
+    bars = timeframes.update_bars(cached, history, timeframe)
+    bars.to_parquet(path + f'.{os.getpid()}.tmp')
+    os.replace(path + f'.{os.getpid()}.tmp', path)
+    return bars
+
+
+def adjusted_path(ticker, cache_dir=None):
+    return cache_path(ticker, cache_dir, suffix='.adjusted.parquet')
+
+
+# Corporate action adjusted bars of a ticker (adjustments.adjust_history) along with its details, cached next to its
+# daily bars. The daily history is loaded (& refreshed) as in load_history; the adjustment is only recomputed
+# when the daily bars changed since it was cached, as a new dividend or split moves every earlier bar.
+@timed('store_load_adjusted', count=lambda result: {'bars': len(result[0])})
+def load_adjusted(ticker, fetch=fetch_yfinance, cache_dir=None, max_age=ohlc_max_age):
+    history, info = load_history(ticker, fetch=fetch, cache_dir=cache_dir, max_age=max_age)
+    path = adjusted_path(ticker, cache_dir)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(cache_path(ticker, cache_dir)):
+        return pd.read_parquet(path), info
+    return write_adjusted(ticker, history, cache_dir), info
+
+
+def write_adjusted(ticker, history, cache_dir=None):
+    path = adjusted_path(ticker, cache_dir)
+    adjusted = adjustments.adjust_history(history)
+    adjusted.to_parquet(path + f'.{os.getpid()}.tmp')
+    os.replace(path + f'.{os.getpid()}.tmp', path)
+    return adjusted
+
+
+# Daily history from a local file (.parquet, .csv or a compact .arrow file), or a ticker already in the local store.
+# Never downloads anything, so it works offline & in headless jobs.
+@timed('read_history', count=lambda result: {'bars': len(result)})
+def read_history(source, cache_dir=None):
+    if not os.path.exists(source):
+        path = cache_path(source, cache_dir)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'{source} is neither a file nor a ticker in {cache_dir or ohlc_cache_dir}')
+        source = path
+
+    name = os.path.basename(source).split('.')[0].upper()
+    if source.endswith('.arrow'):
+        return PriceHistory.from_arrow(source, name=name)
+    if source.endswith('.parquet'):
+        history = pd.read_parquet(source)
+    else:
+        history = pd.read_csv(source, index_col=0)
+        # Drop UTC offsets (ie: yfinance's -05:00) to keep exchange dates, same as fetch_yfinance's tz_localize(None)
+        history.index = pd.to_datetime(history.index.astype(str).str.replace(r'[+-]\d{2}:\d{2}$', '', regex=True))
+        history.index.name = 'Date'
+    history.name = name
+    return history
+
+
+# float64 & float32 Arrow files with only the dates & OHLC columns, memory-mappable by PriceHistory
+def write_compact(ticker, history, cache_dir=None):
+    for float32 in [False, True]:
+        path = compact_path(ticker, cache_dir, float32)
+        PriceHistory.from_frame(history, float32=float32).write_arrow(path + f'.{os.getpid()}.tmp')
+        os.replace(path + f'.{os.getpid()}.tmp', path)
+
+
+# True when fresh bars hold a split or dividend after the last cached date. The source back-adjusts every bar before
+# those for them, so the cached bars would no longer line up with the fresh ones (ie: a split as a fake crash).
+def restates_history(fresh, last_cached):
+    if fresh is None or fresh.empty:
+        return False
+    events = fresh.loc[fresh.index > last_cached, fresh.columns.intersection(['Dividends', 'Stock Splits'])]
+    return bool(events.fillna(0).to_numpy().any())
+
+
+# Fresh bars replace the cached ones from their first date onwards (the last cached bar may have been partial)
+def merge_bars(cached, fresh):
+    merged = pd.concat([cached.loc[cached.index < fresh.index[0]], fresh])
+    event_columns = merged.columns.difference(price_columns)  # Volume, Dividends, Stock Splits, ...
+    merged[event_columns] = merged[event_columns].fillna(0)
+    return merged
+
+
+def read_info(info_path):
+    if not os.path.exists(info_path):
+        return {}
+    with open(info_path) as info_file:
+        return json.load(info_file)
+
+
+# Writes to temporary files & swaps them in, so concurrent sessions never read a partial file
+def write_history(path, history, info_path, info):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    suffix = f'.{os.getpid()}.tmp'
+    history.to_parquet(path + suffix)
+    os.replace(path + suffix, path)
+    with open(info_path + suffix, 'w') as info_file:
+        json.dump(info, info_file, default=str)
+    os.replace(info_path + suffix, info_path)
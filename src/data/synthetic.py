@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+# Offline stand-in for yfinance histories: a seeded geometric random walk of daily (business day) bars,
+# with the same columns as Ticker.history() so it can go anywhere a downloaded history goes.
+def synthetic_history(n_bars, seed=None, start='1995-01-03', start_price=50.0, drift=0.0003, volatility=0.012,
+                      name='SYN'):
+
+    rng = np.random.default_rng(seed)
+    close = start_price * np.exp(np.cumsum(rng.normal(drift, volatility, n_bars)))
+    open_price = close * np.exp(rng.normal(0, volatility / 3, n_bars))
+    high = np.maximum(open_price, close) * np.exp(np.abs(rng.normal(0, volatility / 2, n_bars)))
+    low = np.minimum(open_price, close) * np.exp(-np.abs(rng.normal(0, volatility / 2, n_bars)))
+
+    history = pd.DataFrame({'Open': open_price,
+                            'High': high,
+                            'Low': low,
+                            'Close': close,
+                            'Volume': rng.integers(100000, 1000000, n_bars).astype(float),
+                            'Dividends': 0.0,
+                            'Stock Splits': 0.0},
+                           index=business_days(start, n_bars))
+    history.name = name
+    return history
+
+
+# n_bars weekdays from start. Built with numpy, as pandas' offsets overflow past ~290 years of bars.
+# Raises ValueError when they'd run past pd.Timestamp.max (ie: 100k bars need a start before ~1880).
+def business_days(start, n_bars):
+    first = np.datetime64(pd.Timestamp(start).date(), 'D')
+    days = np.arange(first, first + n_bars * 7 // 5 + 7)
+    days = days[np.is_busday(days)][:n_bars]
+    if len(days) and days[-1] > np.datetime64(pd.Timestamp.max.date(), 'D'):
+        raise ValueError(f'{n_bars} business days from {start} run past {pd.Timestamp.max.date()}, '
+                         f'start them earlier')
+    return pd.DatetimeIndex(days.astype('datetime64[ns]'), name='Date')
+
+
+# Random 0/1 decisions over a history's dates, with roughly density * len(index) ones
+def synthetic_decisions(index, density, seed=None):
+    rng = np.random.default_rng(seed)
+    return pd.Series((rng.random(len(index)) < density).astype(int), index=index)
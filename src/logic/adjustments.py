@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+from logic.price_history import price_frame
+
+# Corporate action adjustment of the daily bars. Both fetchers store prices back-adjusted by the source for splits &
+# dividends (a total return series, so the trading logic never sees the dividends themselves) along with the
+# Dividends (per share, in today's shares) & Stock Splits of every ex-date. adjust_history turns them into
+# split-adjusted prices as they traded (in today's shares) with the dividends paid on top, which the DCA report &
+# pnl_calc pay out or reinvest (DRIP). Every factor is a cumulative product or sum over the bars, there is no loop
+# over the corporate actions.
+
+adjusted_columns = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits', 'Total Return']
+price_columns = ['Open', 'High', 'Low', 'Close']
+
+
+# Factor of every bar's prices undoing the source's dividend back-adjustment. The source scales the bars before an
+# ex-date by 1 - dividend / previous close (unadjusted), which solved for the adjusted closes divides them by
+# 1 + the sum of dividend / previous adjusted close over the ex-dates after them: a reverse cumulative sum.
+# Every bar must be adjusted for all the dividends after it, as the local store keeps them by downloading the whole
+# history again on a new dividend (see ohlc_cache.load_history).
+def dividend_factor(dividends, close):
+    yields = np.zeros(len(close))
+    yields[:-1] = dividends[1:] / close[:-1]  # On the bar before each ex-date
+    return 1 + np.cumsum(yields[::-1])[::-1]
+
+
+# Factor of every bar's prices applying the splits the source left out of the bars before them (ie: bars cached
+# before the split, merged with bars fetched after it). A split was left out when the close before it is closer to
+# ratio x its close than to its close.
+def split_factor(splits, close):
+    ratio = np.where(splits > 0, splits, 1.0)
+    jump = np.ones(len(close))
+    jump[1:] = close[:-1] / close[1:]
+    missed = np.where((ratio != 1) & (np.abs(np.log(jump / ratio)) < np.abs(np.log(jump))), ratio, 1.0)
+    factor = np.ones(len(close))
+    factor[:-1] = np.cumprod(missed[::-1])[::-1][1:]  # Splits after each bar
+    return 1 / factor
+
+
+# Growth of a share whose dividends are reinvested at the ex-date close, by bar (1 before the first ex-date)
+def drip_factor(dividends, close):
+    return np.cumprod(1 + np.asarray(dividends, dtype=float) / np.asarray(close, dtype=float))
+
+
+# Split-adjusted bars (in today's shares) of history with its Dividends paid on top, along with Volume, the Stock
+# Splits & the Total Return (the close with dividends reinvested, from the first close).
+# source_adjusted=False takes history's prices as already free of dividend adjustments (ie: a raw .csv export).
+def adjust_history(history, source_adjusted=True):
+    history = price_frame(history)
+    close = history['Close'].to_numpy(dtype=float)
+    dividends = history['Dividends'].to_numpy(dtype=float) if 'Dividends' in history else np.zeros(len(close))
+    splits = history['Stock Splits'].to_numpy(dtype=float) if 'Stock Splits' in history else np.zeros(len(close))
+
+    splits_left = split_factor(splits, close)
+    factor = dividend_factor(dividends, close * splits_left) * splits_left if source_adjusted else splits_left
+    adjusted = pd.DataFrame({column: history[column].to_numpy(dtype=float) * factor for column in price_columns},
+                            index=history.index)
+    adjusted['Volume'] = history['Volume'].to_numpy() / splits_left if 'Volume' in history else 0.0
+    adjusted['Dividends'] = dividends
+    adjusted['Stock Splits'] = splits
+    adjusted['Total Return'] = adjusted['Close'].to_numpy() * drip_factor(dividends, adjusted['Close'].to_numpy())
+    adjusted.name = getattr(history, 'name', None)
+    return adjusted
+
+
+# Per share dividends of history (ie: adjust_history's) on the bars of dates, 0 without a dividend
+def dividends_on(dividends, dates):
+    return dividends.reindex(dates, fill_value=0.0).to_numpy(dtype=float)
+
+
+# Pays the dividends of the shares held before each ex-date into ledger columns (arrays by date, updated in place):
+# every row from an ex-date on receives them in its Cash Balance & RPNL, as execution.charge_commissions charges fees.
+# Returns the dividend income of every ex-date.
+def pay_dividends(dates, share_balance, cash_balance, rpnl, ex_dates, per_share):
+    held_row = dates.searchsorted(ex_dates) - 1  # Latest row before the ex-date
+    income = np.where(held_row >= 0, share_balance[held_row] * per_share, 0.0)
+    received = np.append(0.0, np.cumsum(income))[ex_dates.searchsorted(dates, side='right')]
+    cash_balance += received
+    rpnl += received
+    return income
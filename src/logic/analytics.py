@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+from logic import adjustments, ledger as trade_ledger
+from logic.price_history import price_frame
+
+# Risk & performance of a backtest from its daily mark-to-market equity. The equity curve comes from the ledger's
+# rows & the closes with a single forward fill (each bar takes the balances of its latest row), every metric is then
+# one pass over the curve, so they are cheap enough to compute for every combination of a sweep.
+
+metric_columns = ['CAGR', 'Total Return', 'Volatility', 'Sharpe', 'Sortino', 'Max Drawdown', 'Max Drawdown $',
+                  'Max Drawdown Days', 'Exposure', 'Win Rate', 'Turnover']
+
+day_ns = 86400 * 10 ** 9
+
+
+# Daily equity & share balance on the bars from start_pos to end_pos of a ledger whose rows are on bar positions
+# (sorted). ledger: TradeLedger, pnl_calc DataFrame or ledger_balances dict. The ledger funds buys out of its sells,
+# so equity is capital less the net cash spent so far, plus the shares held at the close. capital defaults to the
+# largest net cash spent at any time: the least the strategy needs to never run out of cash.
+def equity_curve(positions, ledger, close, start_pos=0, end_pos=None, capital=None):
+    end_pos = len(close) - 1 if end_pos is None else end_pos
+    share_diff = np.asarray(ledger['Share Diff'], dtype=float)
+    trade_value = np.asarray(ledger['Trade Value'], dtype=float)
+    spent = np.cumsum(np.where(share_diff > 0, trade_value, 0.0)) - np.asarray(ledger['Cash Balance'], dtype=float)
+    if capital is None:
+        capital = max(float(spent.max()), 0.0) if len(spent) else 0.0
+    n_bars = end_pos + 1 - start_pos
+    if len(spent) == 0:
+        return np.full(n_bars, float(capital)), np.zeros(n_bars)
+
+    # Row of each bar's latest trade: rows marked on their bars, then forward filled (-1 before the first row)
+    first, last = np.searchsorted(positions, [start_pos, end_pos], side='right')
+    latest = np.full(n_bars, -1)
+    latest[positions[first: last] - start_pos] = np.arange(first, last)
+    latest[0] = max(latest[0], first - 1)  # Carried in from the rows before start_pos
+    np.maximum.accumulate(latest, out=latest)
+
+    # Balances gathered with a trailing empty row, which the bars before the first row (-1) land on
+    shares = np.append(np.asarray(ledger['Share Balance'], dtype=float), 0.0)[latest]
+    equity = shares * close[start_pos: end_pos + 1]
+    equity -= np.append(spent, 0.0)[latest]
+    equity += capital
+    return equity, shares
+
+
+# CAGR, Total Return, Volatility, Sharpe, Sortino (annualized from the bars per year of dates) & the deepest
+# drawdown of an equity curve (as a fraction of its peak, in $ & the longest time below a peak in calendar days).
+# NaN where a metric is undefined (ie: a flat curve's Sharpe).
+def equity_metrics(equity, dates):
+    equity = np.asarray(equity, dtype=float)
+    n_bars = len(equity)
+    if n_bars < 2 or equity[0] <= 0:
+        return dict.fromkeys(metric_columns[:8], np.nan)
+
+    days = np.asarray(dates, dtype='datetime64[ns]').view(np.int64) / day_ns
+    years = (days[-1] - days[0]) / 365.25
+    periods = (n_bars - 1) / years if years > 0 else np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.diff(equity)
+        returns /= equity[:-1]
+        n_returns = len(returns)
+        mean = returns.sum() / n_returns
+        volatility = np.sqrt(max(returns @ returns - n_returns * mean ** 2, 0.0) / (n_returns - 1)) \
+            if n_returns > 1 else np.nan
+        losses = np.minimum(returns, 0.0)
+        downside = np.sqrt(losses @ losses / n_returns)
+        total_return = equity[-1] / equity[0] - 1
+        cagr = (equity[-1] / equity[0]) ** (1 / years) - 1 if years > 0 and equity[-1] > 0 else np.nan
+
+        peak = np.maximum.accumulate(equity)
+        drawdown = peak - equity
+        peaks = np.flatnonzero(drawdown == 0)  # Each spell below a peak lasts until the bar before the next one
+        underwater = days[np.append(peaks[1:] - 1, n_bars - 1)] - days[peaks]
+        return {'CAGR': cagr,
+                'Total Return': total_return,
+                'Volatility': volatility * np.sqrt(periods),
+                'Sharpe': mean / volatility * np.sqrt(periods) if volatility > 0 else np.nan,
+                'Sortino': mean / downside * np.sqrt(periods) if downside > 0 else np.nan,
+                'Max Drawdown': np.max(drawdown / peak),
+                'Max Drawdown $': np.max(drawdown),
+                'Max Drawdown Days': np.max(underwater)}
+
+
+# metric_columns of a ledger traded over the bars from start_pos to end_pos (see equity_curve), adding the share
+# of bars holding shares (Exposure), of sells realizing a profit (Win Rate) & the yearly traded value over the
+# average equity (Turnover)
+def ledger_metrics(positions, ledger, close, dates, start_pos=0, end_pos=None, capital=None):
+    end_pos = len(close) - 1 if end_pos is None else end_pos
+    dates = np.asarray(dates, dtype='datetime64[ns]')
+    equity, shares = equity_curve(positions, ledger, close, start_pos=start_pos, end_pos=end_pos, capital=capital)
+    metrics = equity_metrics(equity, dates[start_pos: end_pos + 1])
+
+    in_range = (positions >= start_pos) & (positions <= end_pos)
+    share_diff = np.asarray(ledger['Share Diff'], dtype=float)
+    trade_value = np.asarray(ledger['Trade Value'], dtype=float)
+    realized = np.diff(np.asarray(ledger['RPNL'], dtype=float), prepend=0.0)
+    sells = in_range & (share_diff < 0) & (trade_value != 0)
+    years = (dates[end_pos] - dates[start_pos]) / np.timedelta64(1, 'D') / 365.25 if len(equity) else 0
+    metrics['Exposure'] = np.count_nonzero(shares > 0) / len(equity) if len(equity) else np.nan
+    metrics['Win Rate'] = np.count_nonzero(realized[sells] > 0) / np.count_nonzero(sells) if sells.any() else np.nan
+    metrics['Turnover'] = np.abs(trade_value[in_range]).sum() / equity.mean() / years \
+        if years > 0 and equity.mean() > 0 else np.nan
+    return metrics
+
+
+# metric_columns of process_pnl_table's result (TradeLedger or DataFrame) on history from start_date onwards.
+# dividends & drip: as given to pnl_calc. Paid dividends are in the ledger's balances; reinvested ones grow the
+# shares held between its rows, so those bars are marked on the dividend reinvested closes.
+def trade_metrics(pnl_table, history, start_date=None, capital=None, dividends=None, drip=False):
+    history = price_frame(history)
+    dates = pnl_table.dates if isinstance(pnl_table, trade_ledger.TradeLedger) else pd.DatetimeIndex(pnl_table.index)
+    start_pos = 0 if start_date is None else history.index.searchsorted(pd.to_datetime(start_date))
+    positions = history.index.get_indexer(dates)
+    known = positions >= 0  # The placeholder row of a ledger without buys isn't a bar
+    ledger = {column: np.asarray(pnl_table[column], dtype=float)[known]
+              for column in ['Share Diff', 'Share Balance', 'Cash Balance', 'Trade Value', 'RPNL']}
+    close = history['Close'].to_numpy(dtype=float)
+    if dividends is not None and drip:
+        growth = adjustments.drip_factor(adjustments.dividends_on(dividends, history.index), close)
+        close = close * growth
+        ledger['Share Balance'] /= growth[positions[known]]
+    return ledger_metrics(positions[known], ledger, close, history.index, start_pos=start_pos, capital=capital)
@@ -0,0 +1,182 @@
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from logic import analytics, signals, sweep
+
+# Batch backtests of one strategy over many tickers & parameter sets, spread over a process pool.
+# Usage (from src/): python -m logic.batch VOO QQQ --buy-strategy "On SMA" --param buy_ma_span_one=10,25,50
+
+ohlc_columns = ['Open', 'High', 'Low', 'Close']
+
+# Worker process state: the shared block & the histories mapped from it so far
+worker_block = None
+worker_layout = {}
+worker_histories = {}
+
+
+# Copies every history's date index & OHLC columns into a single shared memory block.
+# Returns the block along with {ticker: (byte offset, rows)} so workers can map their own views.
+def share_histories(histories):
+    layout = {}
+    offset = 0
+    for ticker, history in histories.items():
+        layout[ticker] = (offset, len(history))
+        offset += len(history) * 8 * (1 + len(ohlc_columns))
+
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for ticker, history in histories.items():
+        dates, ohlc = history_views(block.buf, *layout[ticker])
+        dates[:] = pd.DatetimeIndex(history.index).as_unit('ns').asi8
+        ohlc[:] = history[ohlc_columns].to_numpy(dtype=float)
+    return block, layout
+
+
+# int64 dates & (rows x OHLC) float64 views into the shared buffer, no copies
+def history_views(buffer, offset, n_rows):
+    dates = np.ndarray((n_rows,), dtype=np.int64, buffer=buffer, offset=offset)
+    ohlc = np.ndarray((n_rows, len(ohlc_columns)), dtype=np.float64, buffer=buffer, offset=offset + 8 * n_rows)
+    return dates, ohlc
+
+
+def init_worker(block_name, layout):
+    global worker_block, worker_layout
+    worker_block = shared_memory.SharedMemory(name=block_name)
+    worker_layout = layout
+
+
+def worker_history(ticker):
+    if ticker not in worker_histories:
+        dates, ohlc = history_views(worker_block.buf, *worker_layout[ticker])
+        history = pd.DataFrame(ohlc, columns=ohlc_columns, index=pd.DatetimeIndex(dates.view('datetime64[ns]')),
+                               copy=False)
+        history.name = ticker
+        worker_histories[ticker] = history
+    return worker_histories[ticker]
+
+
+# Runs one chunk of parameter sets on one ticker, within a worker
+def run_chunk(ticker, params, settings):
+    results = sweep.evaluate_parameters(history=worker_history(ticker), params=params, **settings)
+    results.index = params.index  # Position of each parameter set within the batch
+    results.insert(0, 'Ticker', ticker)
+    return results
+
+
+# Yields DataFrames of summary rows (Ticker, parameters, final RPNL/UPNL/Total Value/Trade Count & the
+# analytics.metric_columns when metrics=True) as each chunk of (ticker, parameter set) jobs finishes.
+# params: DataFrame or {name: range} grid.
+def iter_batch(histories, buy_strategy, sell_strategy, params, start_date=None, trade_size=1,
+               allow_fractional=False, sell_all=False, calendar_gap=False, processes=None, chunk_size=256,
+               metrics=False):
+
+    params = sweep.parameter_grid(params) if isinstance(params, dict) else params.reset_index(drop=True)
+    settings = dict(buy_strategy=buy_strategy, sell_strategy=sell_strategy, start_date=start_date,
+                    trade_size=trade_size, allow_fractional=allow_fractional, sell_all=sell_all,
+                    calendar_gap=calendar_gap, metrics=metrics)
+    chunks = [params.iloc[idx: idx + chunk_size] for idx in range(0, len(params), chunk_size)]
+
+    block, layout = share_histories(histories)
+    try:
+        with ProcessPoolExecutor(max_workers=processes or os.cpu_count(), initializer=init_worker,
+                                 initargs=(block.name, layout)) as executor:
+            futures = [executor.submit(run_chunk, ticker, chunk, settings) for ticker in histories for chunk in chunks]
+            for future in as_completed(futures):
+                yield future.result()
+    finally:
+        block.close()
+        block.unlink()
+
+
+# Same as iter_batch, collected into a single DataFrame in (ticker, parameter set) order
+def run_batch(histories, buy_strategy, sell_strategy, params, start_date=None, trade_size=1, allow_fractional=False,
+              sell_all=False, calendar_gap=False, processes=None, chunk_size=256, metrics=False):
+
+    results = list(iter_batch(histories=histories, buy_strategy=buy_strategy, sell_strategy=sell_strategy,
+                              params=params, start_date=start_date, trade_size=trade_size,
+                              allow_fractional=allow_fractional, sell_all=sell_all, calendar_gap=calendar_gap,
+                              processes=processes, chunk_size=chunk_size, metrics=metrics))
+    if len(results) == 0:
+        return pd.DataFrame(columns=['Ticker'] + list(sweep.sweep_defaults) + sweep.result_columns +
+                                    (analytics.metric_columns if metrics else []))
+    results = pd.concat(results)
+    ticker_order = results['Ticker'].map({ticker: idx for idx, ticker in enumerate(histories)})
+    return results.iloc[np.lexsort((results.index, ticker_order))].reset_index(drop=True)
+
+
+# 'buy_ma_span_one=10,25,50' -> ('buy_ma_span_one', [10, 25, 50])
+def parse_param(text):
+    name, values = text.split('=', 1)
+    if name not in sweep.sweep_defaults:
+        raise argparse.ArgumentTypeError(f'Unknown parameter {name}, choose from {", ".join(sweep.sweep_defaults)}')
+
+    def parse_value(value):
+        if value == 'None':
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+
+    return name, [parse_value(value) for value in values.split(',')]
+
+
+# A registered strategy's name or a rule expression, ie: 'close < sma(25) * 0.975 & rsi(14) < 30'
+def parse_strategy(text):
+    try:
+        signals.strategy(text)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f'{error}. Choose from {", ".join(signals.strategies)} or write a rule')
+    return text
+
+
+strategy_help = f'One of {", ".join(signals.strategies)} or a rule, ie: "close < sma(25) * 0.975 & rsi(14) < 30"'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Backtest a strategy over many tickers & parameter sets in parallel.')
+    parser.add_argument('tickers', nargs='+', help='Tickers to backtest')
+    parser.add_argument('--buy-strategy', default='On SMA', type=parse_strategy, help=strategy_help)
+    parser.add_argument('--sell-strategy', default='TD Countdown', type=parse_strategy, help=strategy_help)
+    parser.add_argument('--param', action='append', type=parse_param, default=[],
+                        help='Swept parameter as name=v1,v2,... ie: buy_ma_span_one=10,25,50 (repeatable)')
+    parser.add_argument('--start-date', default=None)
+    parser.add_argument('--trade-size', type=float, default=500)
+    parser.add_argument('--allow-fractional', action='store_true')
+    parser.add_argument('--sell-all', action='store_true')
+    parser.add_argument('--calendar-gap', action='store_true', help='Count gap_days/sell_gap_days in calendar days')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=256)
+    parser.add_argument('--metrics', action='store_true', help='Add CAGR, Sharpe, drawdowns... of every backtest')
+    parser.add_argument('--output', default=None, help='.csv or .parquet file, prints to stdout otherwise')
+    args = parser.parse_args(argv)
+
+    from data.bulk_loader import bulk_load
+    from data.ohlc_cache import read_history
+    histories = {}
+    for status in bulk_load(args.tickers).itertuples():  # Concurrent downloads & updates of the local store
+        if status.Status == 'failed':
+            print(f'Skipping {status.Ticker}: no history available ({status.Error})', file=sys.stderr)
+            continue
+        histories[status.Ticker] = read_history(status.Ticker)
+
+    results = run_batch(histories=histories, buy_strategy=args.buy_strategy, sell_strategy=args.sell_strategy,
+                        params=dict(args.param) if args.param else pd.DataFrame([sweep.sweep_defaults]),
+                        start_date=args.start_date, trade_size=args.trade_size,
+                        allow_fractional=args.allow_fractional, sell_all=args.sell_all,
+                        calendar_gap=args.calendar_gap, processes=args.processes, chunk_size=args.chunk_size,
+                        metrics=args.metrics)
+
+    if args.output is None:
+        print(results.to_string(index=False))
+    elif args.output.endswith('.parquet'):
+        results.to_parquet(args.output, index=False)
+    else:
+        results.to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    main()
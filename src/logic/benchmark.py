@@ -0,0 +1,146 @@
+import argparse
+import datetime
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from data.synthetic import synthetic_history, synthetic_decisions
+from logic import indicators, trade_logic
+
+# Wall time & peak memory of the trade_logic hot paths on synthetic histories, no network access needed.
+# Usage (from src/): python -m logic.benchmark --output bench.json --baseline previous_bench.json --threshold 1.5
+# Exits with status 1 when a case is slower (or peaks higher) than threshold x its baseline.
+
+bench_sizes = [1000, 10000, 100000]
+bench_densities = [0.01, 0.1, 0.5]
+
+
+# [(case name, function)] for every size & decision density. Histories start in 1800 so 100k bars fit in ns dates.
+def bench_cases(sizes=bench_sizes, densities=bench_densities):
+
+    cases = []
+    for n_bars in sizes:
+        history = synthetic_history(n_bars, seed=n_bars, start='1800-01-01')
+        close = history['Close']
+
+        def get_trades(strategy, spans, history=history):
+            indicators.ma_cache.clear()  # Time the averages too, not cache hits
+            return trade_logic.get_trades(asset_data=history, long_bool=True, strategy=strategy, gap=7, spans=spans,
+                                          scaling=0.975)
+
+        cases += [(f'td_strategy[bars={n_bars}]', lambda history=history: trade_logic.td_strategy(history, False)),
+                  (f'get_trades[On SMA,gap=7,bars={n_bars}]', lambda f=get_trades: f('On SMA', (25,))),
+                  (f'get_trades[On EMA Crossover,gap=7,bars={n_bars}]',
+                   lambda f=get_trades: f('On EMA Crossover', (10, 50))),
+                  (f'process_pnl_table[On SMA Crossover/TD Countdown,bars={n_bars}]',
+                   lambda history=history, start=history.index[n_bars // 10]:
+                   trade_logic.process_pnl_table(10, 50, None, None, 'On SMA Crossover', 'TD Countdown', history,
+                                                 trade_size=500, allow_fractional=True, start_date=start)),
+                  (f'dca_buy_report[bars={n_bars}]',
+                   lambda history=history: trade_logic.dca_buy_report(history, weekday=0, strategy='Open', interval=1,
+                                                                      usd_buy_amount=500, allow_fractional=True)),
+                  (f'dca_schedules[schedules=30,bars={n_bars}]',
+                   lambda history=history: trade_logic.dca_schedules(history, usd_buy_amounts=(500,)))]
+
+        for density in densities:
+            buy_series = (close * synthetic_decisions(history.index, density, seed=1)).replace(0, np.nan).dropna()
+            sell_series = (close * synthetic_decisions(history.index, density / 2, seed=2)).replace(0, np.nan).dropna()
+            decisions = synthetic_decisions(history.index, density, seed=3)
+            cases += [(f'pnl_calc[density={density},bars={n_bars}]',
+                       lambda history=history, buys=buy_series, sells=sell_series:
+                       trade_logic.pnl_calc(history, buys, sells, trade_size=500, allow_fractional=True,
+                                            sell_all=False)),
+                      (f'pnl_calc[as_ledger,density={density},bars={n_bars}]',
+                       lambda history=history, buys=buy_series, sells=sell_series:
+                       trade_logic.pnl_calc(history, buys, sells, trade_size=500, allow_fractional=True,
+                                            sell_all=False, as_ledger=True)),
+                      (f'gap_filter[density={density},gap=7,bars={n_bars}]',
+                       lambda decisions=decisions: trade_logic.gap_filter(decisions, 7))]
+    return cases
+
+
+# Best & mean wall time over repeat runs, then the peak traced memory of one more run (tracing slows it down)
+def measure(func, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': min(times), 'mean_seconds': float(np.mean(times)), 'peak_bytes': peak}
+
+
+def run_benchmarks(sizes=bench_sizes, densities=bench_densities, repeat=5, name_filter=None):
+    results = {}
+    for name, func in bench_cases(sizes, densities):
+        if name_filter is None or name_filter in name:
+            results[name] = measure(func, repeat=repeat)
+    return {'meta': {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                     'python': platform.python_version(),
+                     'numpy': np.__version__,
+                     'pandas': pd.__version__,
+                     'machine': platform.platform()},
+            'results': results}
+
+
+# Cases present in both runs whose time or peak memory grew past threshold x baseline.
+# Times under min_seconds in both runs are left out, as they are mostly timer noise.
+def find_regressions(results, baseline, threshold=1.5, min_seconds=0.001):
+    regressions = []
+    for name, current in results['results'].items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        for metric in ['seconds', 'peak_bytes']:
+            if metric == 'seconds' and max(current[metric], previous[metric]) < min_seconds:
+                continue
+            ratio = current[metric] / previous[metric] if previous[metric] > 0 else np.inf
+            if ratio > threshold:
+                regressions.append({'case': name, 'metric': metric, 'baseline': previous[metric],
+                                    'current': current[metric], 'ratio': ratio})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark trade_logic on synthetic histories.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=bench_sizes, help='History lengths in bars')
+    parser.add_argument('--densities', type=float, nargs='+', default=bench_densities,
+                        help='Share of bars with a decision (pnl_calc & gap_filter cases)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--filter', default=None, help='Only run the cases containing this text')
+    parser.add_argument('--output', default=None, help='JSON file to store the results in')
+    parser.add_argument('--baseline', default=None, help='JSON results of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=1.5, help='Allowed ratio vs. the baseline')
+    parser.add_argument('--min-seconds', type=float, default=0.001)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(sizes=args.sizes, densities=args.densities, repeat=args.repeat, name_filter=args.filter)
+    table = pd.DataFrame(results['results']).T
+    table['peak_mb'] = table['peak_bytes'] / 2 ** 20
+    print(table[['seconds', 'mean_seconds', 'peak_mb']].to_string(float_format='{:.4f}'.format))
+
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), threshold=args.threshold,
+                                           min_seconds=args.min_seconds)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) past {args.threshold}x the baseline:', file=sys.stderr)
+            print(pd.DataFrame(regressions).to_string(index=False), file=sys.stderr)
+            return 1
+        print(f'\nNo regressions past {args.threshold}x the baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+import argparse
+import logging
+import os
+import sys
+import pandas as pd
+from data.config import chart_url, ohlc_max_age
+from data.ohlc_cache import read_history
+from logic import adjustments, analytics, batch, execution, instrumentation, monte_carlo, portfolio, timeframes, \
+    trade_logic, walk_forward
+
+# Headless entry point for the backtesting engine: reads local OHLC files & never imports streamlit.
+# Usage (from src/): python -m logic.cli backtest VOO.parquet --buy-strategy "On SMA" --buy-spans 25 --output pnl.parquet
+# The refresh command is the only one downloading anything, into the local store (ie: as a nightly job).
+
+
+# '10' -> (10, None), '10,50' -> (10, 50), as process_pnl_table takes up to two spans per side
+def parse_spans(text):
+    spans = [int(span) for span in text.split(',')]
+    if not 1 <= len(spans) <= 2:
+        raise argparse.ArgumentTypeError(f'Expected one or two spans, got {text}')
+    return tuple(spans) + (None,) * (2 - len(spans))
+
+
+# 'W', 'M', '5D', ... as timeframes.parse_timeframe takes them
+def parse_timeframe(text):
+    try:
+        timeframes.parse_timeframe(text)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc))
+    return text
+
+
+# process_pnl_table's strategy inputs from the arguments of add_strategy_arguments
+def strategy_settings(args):
+    return dict(buy_ma_span_one=args.buy_spans[0], buy_ma_span_two=args.buy_spans[1],
+                sell_ma_span_one=args.sell_spans[0], sell_ma_span_two=args.sell_spans[1],
+                buy_strategy=args.buy_strategy, sell_strategy=args.sell_strategy,
+                gap_days=args.gap_days, sell_gap_days=args.sell_gap_days, calendar_gap=args.calendar_gap,
+                buy_scaling=args.buy_scaling, sell_scaling=args.sell_scaling, start_date=args.start_date,
+                trade_size=args.trade_size, allow_fractional=args.allow_fractional, sell_all=args.sell_all)
+
+
+# ExecutionModel of the arguments of add_execution_arguments, None without a fill model or costs
+def execution_model(args, fill=None):
+    model = execution.ExecutionModel(fill or args.fill or 'Touch', args.commission, args.commission_bps,
+                                     args.spread_bps, args.slippage_bps)
+    return None if args.fill is None and fill is None and execution.frictionless(model) else model
+
+
+# History to trade & pnl_calc's dividend inputs of --dividends: the history as stored without it, otherwise its
+# corporate action adjusted bars with their dividends paid out or reinvested
+def dividend_history(history, args):
+    if args.dividends is None:
+        return history, {}
+    adjusted = adjustments.adjust_history(history)
+    return adjusted, dict(dividends=adjusted['Dividends'], drip=args.dividends == 'reinvested')
+
+
+def backtest(args):
+    history, dividends = dividend_history(read_history(args.history, cache_dir=args.cache_dir), args)
+    pnl_table, _, _ = trade_logic.process_pnl_table(history=history, execution=execution_model(args),
+                                                    timeframe=args.timeframe, **dividends, **strategy_settings(args))
+    write_table(pnl_table, args.output)
+    return 0
+
+
+def run_costs(args):
+    history, dividends = dividend_history(read_history(args.history, cache_dir=args.cache_dir), args)
+    models = [execution_model(args, fill) for fill in ([args.fill] if args.fill else execution.fill_models)]
+    write_table(trade_logic.execution_report(history, models, timeframe=args.timeframe, **dividends,
+                                             **strategy_settings(args)), args.output, index=False)
+    return 0
+
+
+def run_monte_carlo(args):
+    history = read_history(args.history, cache_dir=args.cache_dir)
+    results = monte_carlo.monte_carlo(history, n_paths=args.paths, block_size=args.block_size, seed=args.seed,
+                                      processes=args.processes, **strategy_settings(args))
+    print(monte_carlo.summarize(results).to_string())
+    if args.output is not None:
+        write_table(results, args.output, index=False)
+    return 0
+
+
+def run_walk_forward(args):
+    history = read_history(args.history, cache_dir=args.cache_dir)
+    windows, oos_pnl = walk_forward.walk_forward(history, args.buy_strategy, args.sell_strategy, dict(args.param),
+                                                 in_sample=args.in_sample, out_of_sample=args.out_of_sample,
+                                                 step=args.step, anchored=args.anchored, objective=args.objective,
+                                                 start_date=args.start_date, trade_size=args.trade_size,
+                                                 allow_fractional=args.allow_fractional, sell_all=args.sell_all,
+                                                 calendar_gap=args.calendar_gap, processes=args.processes)
+    write_table(windows, args.output, index=False)
+    if args.pnl_output is not None:
+        write_table(oos_pnl.to_frame(), args.pnl_output)
+    return 0
+
+
+# One strategy over several histories sharing one cash balance, keyed by file name (without extension) or ticker
+def run_portfolio(args):
+    histories = {os.path.splitext(os.path.basename(source))[0]: read_history(source, cache_dir=args.cache_dir)
+                 for source in args.history}
+    equity, _, trades, holdings = portfolio.portfolio_backtest(histories, initial_cash=args.initial_cash,
+                                                               max_weight=args.max_weight,
+                                                               max_positions=args.max_positions,
+                                                               rebalance=args.rebalance, **strategy_settings(args))
+    print(holdings.to_string())
+    print(equity.iloc[-1:].to_string())
+    print(pd.Series(analytics.equity_metrics(equity['Total Value'], equity.index)).to_string())
+    if args.output is not None:
+        write_table(equity, args.output)
+    if args.trades_output is not None:
+        write_table(trades, args.trades_output)
+    return 0
+
+
+# Exits with 1 when any ticker failed to load, so schedulers flag partial refreshes
+def refresh(args):
+    from data.bulk_loader import bulk_load  # Only needed for downloads
+
+    tickers = list(args.tickers)
+    if args.tickers_file is not None:
+        with open(args.tickers_file) as tickers_file:
+            tickers += [line.split('#')[0].strip() for line in tickers_file if line.split('#')[0].strip()]
+    statuses = bulk_load(tickers, cache_dir=args.cache_dir, max_age=args.max_age, workers=args.workers,
+                         retries=args.retries, backoff=args.backoff, base_url=args.base_url, timeout=args.timeout,
+                         timeframes=args.timeframes, adjusted=args.adjusted)
+    write_table(statuses, args.output, index=False)
+    return int((statuses['Status'] == 'failed').any())
+
+
+# .parquet or .csv file, prints to stdout when path is None
+def write_table(table, path, index=True):
+    if path is None:
+        print(table.to_string(index=index))
+    elif path.endswith('.parquet'):
+        table.to_parquet(path, index=index)
+    else:
+        table.to_csv(path, index=index)
+
+
+# History & process_pnl_table inputs of a single strategy. history_nargs: ie: '+' for several histories
+def add_strategy_arguments(parser, history_nargs=None):
+    parser.add_argument('history', nargs=history_nargs,
+                        help='.parquet, .csv or .arrow OHLC file, or a ticker in the local store')
+    parser.add_argument('--cache-dir', default=None, help='Local store to look tickers up in')
+    parser.add_argument('--buy-strategy', default='On SMA', type=batch.parse_strategy,
+                        help=batch.strategy_help)
+    parser.add_argument('--sell-strategy', default='TD Countdown', type=batch.parse_strategy,
+                        help=batch.strategy_help)
+    parser.add_argument('--buy-spans', type=parse_spans, default=(25, None), help='span or span,span')
+    parser.add_argument('--sell-spans', type=parse_spans, default=(25, None), help='span or span,span')
+    parser.add_argument('--buy-scaling', type=float, default=1.0)
+    parser.add_argument('--sell-scaling', type=float, default=1.0)
+    parser.add_argument('--gap-days', type=int, default=0)
+    parser.add_argument('--sell-gap-days', type=int, default=0)
+    parser.add_argument('--calendar-gap', action='store_true', help='Count gaps in calendar days')
+    parser.add_argument('--start-date', default=None)
+    parser.add_argument('--trade-size', type=float, default=500)
+    parser.add_argument('--allow-fractional', action='store_true')
+    parser.add_argument('--sell-all', action='store_true')
+
+
+# Bars the signals run on, the ledger stays on the daily bars
+def add_timeframe_argument(parser):
+    parser.add_argument('--timeframe', type=parse_timeframe, default=None,
+                        help='Signal timeframe: W, M, Q (period aliases) or N daily bars (ie: 5D), daily by default')
+
+
+# Dividends of the history's corporate action adjusted bars, not included (as stored) by default
+def add_dividend_argument(parser):
+    parser.add_argument('--dividends', default=None, choices=['paid', 'reinvested'],
+                        help='Trade the split adjusted prices with their dividends paid out or reinvested (DRIP)')
+
+
+# Fill model & trading costs of an ExecutionModel
+def add_execution_arguments(parser):
+    parser.add_argument('--fill', default=None, choices=execution.fill_models,
+                        help='Fill model, decisions fill at their price without one')
+    parser.add_argument('--commission', type=float, default=0.0, help='Commission per trade')
+    parser.add_argument('--commission-bps', type=float, default=0.0, help='Commission in bps of the trade value')
+    parser.add_argument('--spread-bps', type=float, default=0.0, help='Bid/ask spread in bps, half paid per trade')
+    parser.add_argument('--slippage-bps', type=float, default=0.0, help='Slippage in bps paid per trade')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='strategy-tester', description='Headless strategy backtesting.')
+    parser.add_argument('--metrics', default=None,
+                        help='File to write the stage timings to, in the Prometheus text format')
+    parser.add_argument('--log-level', default='WARNING')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    backtest_parser = commands.add_parser('backtest', help='PNL table of one buy & sell strategy on one history')
+    add_strategy_arguments(backtest_parser)
+    add_timeframe_argument(backtest_parser)
+    add_dividend_argument(backtest_parser)
+    backtest_parser.add_argument('--output', default=None, help='.csv or .parquet file, prints to stdout otherwise')
+    add_execution_arguments(backtest_parser)
+    backtest_parser.set_defaults(run=backtest)
+
+    costs_parser = commands.add_parser('costs', help='PNL of one strategy surviving each fill model & the costs')
+    add_strategy_arguments(costs_parser)
+    add_timeframe_argument(costs_parser)
+    add_dividend_argument(costs_parser)
+    add_execution_arguments(costs_parser)
+    costs_parser.add_argument('--output', default=None, help='.csv or .parquet file, prints to stdout otherwise')
+    costs_parser.set_defaults(run=run_costs)
+
+    monte_carlo_parser = commands.add_parser('monte-carlo',
+                                             help='Results of one strategy over block bootstrapped price paths')
+    add_strategy_arguments(monte_carlo_parser)
+    monte_carlo_parser.add_argument('--paths', type=int, default=1000)
+    monte_carlo_parser.add_argument('--block-size', type=int, default=20, help='Bars per resampled block')
+    monte_carlo_parser.add_argument('--seed', type=int, default=None)
+    monte_carlo_parser.add_argument('--processes', type=int, default=None)
+    monte_carlo_parser.add_argument('--output', default=None, help='.csv or .parquet file of the per path results')
+    monte_carlo_parser.set_defaults(run=run_monte_carlo)
+
+    portfolio_parser = commands.add_parser('portfolio',
+                                           help='One buy & sell strategy over several histories sharing one cash '
+                                                'balance')
+    add_strategy_arguments(portfolio_parser, history_nargs='+')
+    portfolio_parser.add_argument('--initial-cash', type=float, default=100000.0)
+    portfolio_parser.add_argument('--max-weight', type=float, default=1.0,
+                                  help='Largest share of the portfolio value held in one asset after a buy')
+    portfolio_parser.add_argument('--max-positions', type=int, default=None, help='Most assets held at once')
+    portfolio_parser.add_argument('--rebalance', default=None,
+                                  help='Period alias (ie: W, M, Q) to bring held assets back to equal weights')
+    portfolio_parser.add_argument('--output', default=None, help='.csv or .parquet file of the daily equity')
+    portfolio_parser.add_argument('--trades-output', default=None, help='.csv or .parquet file of the trades')
+    portfolio_parser.set_defaults(run=run_portfolio)
+
+    walk_parser = commands.add_parser('walk-forward', help='Walk-forward optimization of one buy & sell strategy')
+    walk_parser.add_argument('history', help='.parquet, .csv or .arrow OHLC file, or a ticker in the local store')
+    walk_parser.add_argument('--cache-dir', default=None, help='Local store to look tickers up in')
+    walk_parser.add_argument('--buy-strategy', default='On SMA', type=batch.parse_strategy,
+                             help=batch.strategy_help)
+    walk_parser.add_argument('--sell-strategy', default='TD Countdown', type=batch.parse_strategy,
+                             help=batch.strategy_help)
+    walk_parser.add_argument('--param', action='append', type=batch.parse_param, default=[],
+                             help='Optimized parameter as name=v1,v2,... ie: buy_ma_span_one=10,25,50 (repeatable)')
+    walk_parser.add_argument('--in-sample', type=int, default=756, help='In-sample window in bars')
+    walk_parser.add_argument('--out-of-sample', type=int, default=126, help='Out-of-sample window in bars')
+    walk_parser.add_argument('--step', type=int, default=None, help='Bars between windows, out-of-sample by default')
+    walk_parser.add_argument('--anchored', action='store_true', help='Grow in-sample windows from the start date')
+    walk_parser.add_argument('--objective', default='PNL',
+                             help='Results column maximized in-sample, ie: PNL, Total Value, Sharpe or CAGR')
+    walk_parser.add_argument('--calendar-gap', action='store_true', help='Count gaps in calendar days')
+    walk_parser.add_argument('--start-date', default=None)
+    walk_parser.add_argument('--trade-size', type=float, default=500)
+    walk_parser.add_argument('--allow-fractional', action='store_true')
+    walk_parser.add_argument('--sell-all', action='store_true')
+    walk_parser.add_argument('--processes', type=int, default=None)
+    walk_parser.add_argument('--output', default=None, help='.csv or .parquet file of the windows, prints otherwise')
+    walk_parser.add_argument('--pnl-output', default=None, help='.csv or .parquet file of the out-of-sample PNL')
+    walk_parser.set_defaults(run=run_walk_forward)
+
+    refresh_parser = commands.add_parser('refresh', help='Download or update many tickers in the local store')
+    refresh_parser.add_argument('tickers', nargs='*', help='Tickers to load')
+    refresh_parser.add_argument('--tickers-file', default=None, help='File with one ticker per line (# comments)')
+    refresh_parser.add_argument('--cache-dir', default=None, help='Local store to write to')
+    refresh_parser.add_argument('--max-age', type=float, default=ohlc_max_age,
+                                help='Seconds a stored ticker is served before updating, 0 updates every ticker')
+    refresh_parser.add_argument('--workers', type=int, default=16, help='Max. concurrent downloads & connections')
+    refresh_parser.add_argument('--retries', type=int, default=3, help='Retries of timeouts, 429s & 5xx per ticker')
+    refresh_parser.add_argument('--backoff', type=float, default=1.0, help='Seconds before the first retry, doubling')
+    refresh_parser.add_argument('--timeout', type=float, default=30, help='Seconds per request')
+    refresh_parser.add_argument('--base-url', default=chart_url, help='Chart endpoint (CHART_URL)')
+    refresh_parser.add_argument('--timeframes', type=parse_timeframe, nargs='*', default=[],
+                                help='Timeframes whose cached bars are updated too (ie: W M)')
+    refresh_parser.add_argument('--adjusted', action='store_true',
+                                help='Update the corporate action adjusted bars the app loads too')
+    refresh_parser.add_argument('--output', default=None, help='.csv or .parquet file of the per ticker status')
+    refresh_parser.set_defaults(run=refresh)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper())
+    status = args.run(args)
+    if args.metrics is not None:
+        with open(args.metrics, 'wb') as metrics_file:
+            metrics_file.write(instrumentation.export())
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import collections
+import numpy as np
+import pandas as pd
+
+# Execution assumptions of a backtest: where decisions fill & what trading them costs. get_trades prices every
+# decision at its level (the MA line, or the close) as if it always filled there for free; an ExecutionModel moves
+# the fills to a fill model's bar & price, adds the half spread & slippage against the trader & charges commissions
+# on the ledger. Everything works on arrays of decisions, there is no loop over trades.
+
+# fill: one of fill_models
+# commission: per trade, commission_bps: of the trade value
+# spread_bps: full bid/ask spread (half is paid per trade), slippage_bps: paid per trade on top of it
+ExecutionModel = collections.namedtuple('ExecutionModel', ['fill', 'commission', 'commission_bps', 'spread_bps',
+                                                           'slippage_bps'], defaults=('Touch', 0.0, 0.0, 0.0, 0.0))
+
+# Touch: at the decision's level & date, or the open when the bar touching an intrabar level (On SMA/EMA) gaps past it
+# Next Open: at the open of the bar after the decision is known
+# VWAP: at the typical price (High + Low + Close) / 3 of the bar after the decision is known, a proxy of its VWAP
+fill_models = ['Touch', 'Next Open', 'VWAP']
+
+# ExecutionModel fields as table columns (ie: trade_logic.execution_report)
+model_columns = ['Fill', 'Commission', 'Commission bps', 'Spread bps', 'Slippage bps']
+
+
+# Fill bar positions & prices of the decisions at bar positions (sorted) with prices, under model.
+# ohlc: (open, high, low, close) arrays of the history. lookahead: bars past its own a decision depends on
+# (sweep.decision_lookahead), or an array of them per decision. intrabar: prices are levels touched within the bar
+# rather than closes. Decisions that would fill past the last bar are dropped.
+def fill_events(model, positions, prices, ohlc, buy, lookahead=0, intrabar=False):
+    open_price, high, low, close = ohlc
+    known = positions + lookahead  # Bar the decision is known (or its level touched) on
+    if model.fill == 'Touch':
+        fill_pos = positions
+        if intrabar:
+            prices = np.maximum(prices, open_price[known]) if buy else np.minimum(prices, open_price[known])
+    elif model.fill in ['Next Open', 'VWAP']:
+        fill_pos = known + 1
+        fill_pos = fill_pos[fill_pos < len(close)]
+        if model.fill == 'Next Open':
+            prices = open_price[fill_pos]
+        else:
+            prices = (high[fill_pos] + low[fill_pos] + close[fill_pos]) / 3
+    else:
+        raise ValueError(f'Unknown fill model {model.fill}, expected one of {fill_models}')
+
+    side = 1 if buy else -1
+    return fill_pos, prices * (1 + side * (model.spread_bps / 2 + model.slippage_bps) / 1e4)
+
+
+# Decision price Series (ie: process_pnl_table's buy & sell series) as fill price Series dated on their fill bars
+def fill_series(history, decisions, model, buy, lookahead=0, intrabar=False):
+    ohlc = [history[column].to_numpy(dtype=float) for column in ['Open', 'High', 'Low', 'Close']]
+    fill_pos, prices = fill_events(model, history.index.get_indexer(decisions.index),
+                                   decisions.to_numpy(dtype=float), ohlc, buy, lookahead=lookahead, intrabar=intrabar)
+    return pd.Series(prices, index=history.index[fill_pos], name=decisions.name, dtype=float)
+
+
+# Charges model's commissions on ledger columns (arrays by date, updated in place): every row with a trade pays
+# commission + commission_bps of its value, taken out of the Cash Balance & the RPNL from then on.
+# Returns the commission of every row.
+def charge_commissions(model, trade_value, cash_balance, rpnl):
+    fees = np.where(trade_value != 0, model.commission + np.abs(trade_value) * model.commission_bps / 1e4, 0.0)
+    paid = np.cumsum(fees)
+    cash_balance -= paid
+    rpnl -= paid
+    return fees
+
+
+# True when model changes nothing about get_trades' fills (frictionless touch fills)
+def frictionless(model):
+    return model is None or model == ExecutionModel()
@@ -0,0 +1,114 @@
+import collections
+import threading
+from logic.price_history import PriceHistory, content_fingerprint
+
+# Indicators shared across reruns, sessions & both sides of a trade. Entries are keyed on
+# (history fingerprint, column, indicator function, parameters) & the least recently used are evicted past max_bytes.
+class IndicatorCache:
+
+    def __init__(self, max_bytes=128 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits, self.misses = 0, 0
+        self.lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+        # Computed outside of the lock, concurrent misses on the same key compute it twice at worst
+        value = compute()
+        with self.lock:
+            self.misses += 1
+            if key not in self.entries:
+                self.entries[key] = value
+                self.nbytes += value.nbytes
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+ma_cache = IndicatorCache()
+
+
+# Fingerprint of a PriceHistory (memoized) or of a history DataFrame's dates & columns
+def history_fingerprint(asset_data, columns=('Close',)):
+    if isinstance(asset_data, PriceHistory):
+        return asset_data.fingerprint()
+    return content_fingerprint(asset_data.index.asi8, *[asset_data[column].to_numpy() for column in columns])
+
+
+# ma_func(series, span) through the shared cache. Provide the history's fingerprint when computing
+# several averages of the same history, the series is hashed otherwise. Returned series are read-only.
+def moving_average(series, ma_func, span=None, fingerprint=None):
+    return indicator(series, ma_func, (span,), fingerprint)
+
+
+# function(series, *parameters) through the shared cache, as moving_average
+def indicator(series, function, parameters=(), fingerprint=None):
+
+    def compute():
+        line = function(series, *parameters)
+        line.values.flags.writeable = False
+        return line
+
+    fingerprint = content_fingerprint(series.index.asi8, series.to_numpy()) if fingerprint is None else fingerprint
+    return ma_cache.get((fingerprint, series.name, function.__name__, *parameters), compute)
+
+
+# Indicator lines of a Series, or of every column of a DataFrame (ie: one per price path or asset).
+# A span of None takes the indicator's default.
+
+# Returns simple moving average with provided span
+def sma_line(series, span=None):
+    if span is None:
+        span = 200
+    return series.rolling(window=span).mean()
+
+
+# Returns exponentially weighed average based on provided span
+def ema_line(series, span=None):
+    if span is None:
+        span = 25
+    return series.ewm(span).mean()
+
+
+# Rolling sample standard deviation over span bars
+def std_line(series, span=None):
+    if span is None:
+        span = 20
+    return series.rolling(window=span).std()
+
+
+# Wilder's relative strength index: average gain over average loss (smoothed with alpha = 1 / span) scaled to 0-100
+def rsi_line(series, span=None):
+    if span is None:
+        span = 14
+    change = series.diff()
+    gain = change.clip(lower=0).ewm(alpha=1 / span, min_periods=span, adjust=False).mean()
+    loss = (-change).clip(lower=0).ewm(alpha=1 / span, min_periods=span, adjust=False).mean()
+    return 100 - 100 / (1 + gain / loss)
+
+
+# Highest value of the last span bars
+def highest_line(series, span=None):
+    if span is None:
+        span = 20
+    return series.rolling(window=span).max()
+
+
+# Lowest value of the last span bars
+def lowest_line(series, span=None):
+    if span is None:
+        span = 20
+    return series.rolling(window=span).min()
@@ -0,0 +1,84 @@
+import contextlib
+import functools
+import threading
+import time
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, start_http_server
+
+# Timing spans & counters around the backtest pipeline stages (loading, signals, ledger, plotting).
+# Every span feeds Prometheus metrics; spans of the current thread (ie: one Streamlit rerun) can also be traced
+# for a debug panel with start_trace / stop_trace.
+
+registry = CollectorRegistry()
+stage_seconds = Histogram('strategy_tester_stage_seconds', 'Wall time of a pipeline stage', ['stage'],
+                          registry=registry,
+                          buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+stage_items = Counter('strategy_tester_stage_items', 'Items handled by a pipeline stage (bars, decisions, trades)',
+                      ['stage', 'item'], registry=registry)
+
+local = threading.local()
+metrics_server = None
+metrics_lock = threading.Lock()
+
+
+# Times the enclosed block as stage. Counts set on the yielded dict (ie: record['trades'] = 12) are added to
+# the stage's item counters.
+@contextlib.contextmanager
+def span(stage):
+    record = {}
+    depth = getattr(local, 'depth', 0)
+    local.depth = depth + 1
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        seconds = time.perf_counter() - start
+        local.depth = depth
+        stage_seconds.labels(stage).observe(seconds)
+        for item, value in record.items():
+            stage_items.labels(stage, item).inc(value)
+        trace = getattr(local, 'trace', None)
+        if trace is not None:
+            trace.append({'Stage': stage, 'Depth': depth, 'Start': start - local.trace_start, 'Seconds': seconds,
+                          **record})
+
+
+# Decorator version of span. count: function of the result returning {item: count}.
+def timed(stage, count=None):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage) as record:
+                result = func(*args, **kwargs)
+                if count is not None:
+                    record.update(count(result))
+            return result
+        return wrapper
+    return decorator
+
+
+# Starts collecting the spans of the current thread
+def start_trace():
+    local.trace = []
+    local.trace_start = time.perf_counter()
+
+
+# [{Stage, Depth, Start (seconds since start_trace), Seconds, counts...}] of the spans since start_trace,
+# in start order (each stage before the stages nested in it)
+def stop_trace():
+    trace = getattr(local, 'trace', None)
+    local.trace = None
+    return sorted(trace or [], key=lambda entry: entry['Start'])
+
+
+# Prometheus text exposition of every metric so far (ie: for a node_exporter textfile)
+def export():
+    return generate_latest(registry)
+
+
+# Serves the metrics over http on port, once per process
+def serve_metrics(port):
+    global metrics_server
+    with metrics_lock:
+        if metrics_server is None:
+            metrics_server = start_http_server(port, registry=registry)
+    return metrics_server
@@ -0,0 +1,128 @@
+import numpy as np
+
+# NumPy kernels behind the trade logic hot paths. They take raw ndarrays (a history's bars, or 2-D blocks with one
+# row per parameter set / price path) & return masks or bar positions, writing into caller provided buffers where
+# given instead of building shifted & intermediate pandas Series.
+
+
+# Bool mask of the bars where series_one crosses series_two by the next bar: below it on bar t & above it on bar t+1
+# (above then below when upward=False). The last bar never crosses, NaNs never cross (as with pandas comparisons).
+# out: bool or int array of the broadcast shape to write the mask into,
+# scratch: bool array of the same shape minus the last bar, ie: kept across the blocks of a sweep.
+def crossings(series_one, series_two, upward=True, out=None, scratch=None):
+    shape = np.broadcast_shapes(np.shape(series_one), np.shape(series_two))
+    out = np.empty(shape, dtype=bool) if out is None else out
+    if scratch is None:
+        scratch = np.empty(shape[:-1] + (max(shape[-1] - 1, 0),), dtype=bool)
+
+    before, after = (np.less, np.greater) if upward else (np.greater, np.less)
+    before(series_one[..., :-1], series_two[..., :-1], out=scratch)
+    after(series_one[..., 1:], series_two[..., 1:], out=out[..., :-1])
+    np.logical_and(out[..., :-1], scratch, out=out[..., :-1])
+    out[..., -1:] = 0
+    return out
+
+
+# Bar positions & prices of the decisions, leaving out the ones without a usable price (0 or NaN)
+# as (prices * decision).replace(0, np.nan).dropna() would. Only the decision bars are read from prices.
+def decision_events(decision, prices):
+    positions = np.flatnonzero(decision)
+    event_prices = prices[positions] * decision[positions]
+    usable = (event_prices != 0) & ~np.isnan(event_prices)
+    return positions[usable], event_prices[usable]
+
+
+# Boolean mask over sorted decision points (bar positions or dates), False when the next point is within gap
+def gap_mask(points, gap):
+    keep = np.ones(len(points), dtype=bool)
+    np.greater(np.diff(points), gap, out=keep[:-1])
+    return keep
+
+
+# Matches np.round on a float, without numpy's per-scalar overhead
+def round_to(value, decimals):
+    scale = 10.0 ** decimals
+    return round(value * scale) / scale
+
+
+# Ledger math behind pnl_calc on plain arrays of decision prices (sorted by date) & sell flags.
+# Single pass over the decisions: row values are cumulative sums within each buy->sell segment,
+# only the carried balance / cost basis / cash between segments is scanned (once per sell).
+def ledger_balances(price, is_sell, trade_size, allow_fractional=True, sell_all=True):
+
+    is_buy = ~is_sell
+    trade_amount = trade_size / price
+    if not allow_fractional:
+        trade_amount = np.maximum(trade_amount.astype(int), 1)  # Buy/Sell 1 Share at minimum.
+
+    # Segment k holds the buys following sell k-1, closed by sell k. Trailing buys form the last segment.
+    segment = np.cumsum(is_sell)
+    segment -= is_sell
+    n_sells = int(np.count_nonzero(is_sell))
+    n_segments = n_sells + 1
+    buy_segment, buy_amount = segment[is_buy], trade_amount[is_buy]
+    seg_buy_shares = np.bincount(buy_segment, weights=buy_amount, minlength=n_segments)
+    seg_buy_worth = np.bincount(buy_segment, weights=price[is_buy] * buy_amount, minlength=n_segments)
+    seg_has_buys = np.bincount(buy_segment, minlength=n_segments) > 0
+
+    # Carried Share Balance, Cost Basis & Cash Balance entering each segment (plain floats for a fast scan)
+    shares, basis, cash = 0.0, 0.0, 0.0
+    carry = [(shares, basis, cash)]
+    sold, sell_basis = [], []
+    sell_price = price[is_sell]
+    sell_amount = trade_amount[is_sell]
+    for bought, worth, has_buys, sell_size, sell_at in zip(seg_buy_shares.tolist(), seg_buy_worth.tolist(),
+                                                            seg_has_buys.tolist(), sell_amount.tolist(),
+                                                            sell_price.tolist()):
+        # round_to(value, 2) & round_to(value, 4) inlined, the call overhead dominates this loop
+        amount = 0.0
+        if has_buys:
+            bought_shares = round(bought * 100.0) / 100.0
+            held = shares + bought_shares
+            basis = round((shares * basis + worth) / held * 10000.0) / 10000.0 if held != 0 else 0.0
+            amount = bought_shares if sell_all else sell_size
+            shares = round((bought - amount) * 100.0) / 100.0 + shares
+        elif not sell_all:
+            basis = basis if shares != 0 else 0.0
+            amount = shares if shares < sell_size else sell_size  # Limit sell to available balance
+            shares = round(-amount * 100.0) / 100.0 + shares
+        proceeds = round(abs(round(amount * 100.0) / 100.0) * sell_at * 100.0) / 100.0
+        cash = round((cash + proceeds) * 100.0) / 100.0
+        sold.append(amount)
+        sell_basis.append(basis)
+        carry.append((shares, basis, cash))
+    carry_shares, carry_basis, carry_cash = np.array(carry).T
+    sold, sell_basis = np.array(sold, dtype=float), np.array(sell_basis, dtype=float)
+
+    # Row level balances, accumulated within each segment on top of its carryover.
+    # The trade amounts become the share diffs in place, the running sums are rebased on each segment's start.
+    share_diff = trade_amount
+    share_diff[is_sell] = -sold
+    buy_worth = price * share_diff
+    buy_worth[is_sell] = 0
+    seg_diff = np.cumsum(share_diff)
+    seg_worth = np.cumsum(buy_worth)
+    seg_first = np.searchsorted(segment, np.arange(n_segments))
+    seg_first = seg_first[seg_first < len(segment)]  # The trailing segment can be empty
+    seg_diff -= (seg_diff[seg_first] - share_diff[seg_first])[segment]
+    seg_worth -= (seg_worth[seg_first] - buy_worth[seg_first])[segment]
+
+    closed = segment < n_sells  # Trailing buys without a sell are left unrounded, as with buy & hold
+    seg_diff[closed] = np.round(seg_diff[closed], 2)
+    share_balance = seg_diff + carry_shares[segment]
+    with np.errstate(divide='ignore', invalid='ignore'):  # Sell rows are zeroed out, their basis is carried below
+        cost_basis = (carry_shares[segment] * carry_basis[segment] + seg_worth) / share_balance
+    cost_basis[closed] = np.round(cost_basis[closed], 4)
+    cost_basis[is_sell] = sell_basis
+    cash_balance = carry_cash[segment]
+    cash_balance[is_sell] = carry_cash[1:]
+    trade_value = np.round(share_diff * price, 2)
+    realized = np.append(0, np.cumsum((sell_price - sell_basis) * sold))
+    rpnl = realized[np.cumsum(is_sell)]  # Carry the realized PNL forward from the latest sell
+
+    return {'Share Diff': share_diff,
+            'Share Balance': share_balance,
+            'Cash Balance': cash_balance,
+            'Cost Basis': cost_basis,
+            'Trade Value': trade_value,
+            'RPNL': rpnl}
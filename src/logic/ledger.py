@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+# Side codes of a ledger row. Buys & sells double as the 1/-1 decisions of plot_funcs.plot_decisions.
+BUY, SELL, CLOSE = 1, -1, 0
+side_names = {BUY: 'Buy', SELL: 'Sell', CLOSE: 'Closing Statement'}
+
+# Stored columns of pnl_calc's table; Decision comes from the side codes, Balance Value & UPNL are derived
+value_columns = ['Price', 'Share Diff', 'Closing Price', 'Share Balance', 'Cash Balance', 'Cost Basis',
+                 'Trade Value', 'RPNL']
+table_columns = ['Price', 'Decision', 'Share Diff', 'Closing Price', 'Share Balance', 'Balance Value',
+                 'Cash Balance', 'Cost Basis', 'Trade Value', 'UPNL', 'RPNL']
+
+
+# Trade history backed by typed arrays: int64 (ns) dates, int8 sides & a float64 array per value column.
+# Appends go into spare capacity (doubled when full); the pnl_calc style DataFrame is only built by to_frame.
+class TradeLedger:
+
+    def __init__(self, capacity=64, name='Date'):
+        self.size = 0
+        self.name = name  # Index name of to_frame
+        self.time = np.empty(capacity, dtype=np.int64)
+        self.side = np.empty(capacity, dtype=np.int8)
+        self.values = np.empty((len(value_columns), capacity))  # One row per column, so columns are contiguous
+        self.frame = None
+
+    @classmethod
+    def from_arrays(cls, dates, side, **columns):
+        dates = pd.DatetimeIndex(dates)
+        ledger = cls(capacity=max(len(dates), 1), name=dates.name)
+        ledger.size = len(dates)
+        ledger.time[:ledger.size] = dates.as_unit('ns').asi8
+        ledger.side[:ledger.size] = side
+        for idx, column in enumerate(value_columns):
+            ledger.values[idx, :ledger.size] = columns[column.lower().replace(' ', '_')]
+        return ledger
+
+    # Ledger of a pnl_calc style DataFrame (ie: from tranche_pnl_calc or streaming.replay)
+    @classmethod
+    def from_frame(cls, table):
+        codes = {name: code for code, name in side_names.items()}
+        return cls.from_arrays(table.index, table['Decision'].map(codes).to_numpy(dtype=np.int8),
+                               **{column.lower().replace(' ', '_'): table[column].to_numpy(dtype=float)
+                                  for column in value_columns})
+
+    def __len__(self):
+        return self.size
+
+    # Column view (no copy) of the stored columns, along with the derived Balance Value & UPNL
+    def __getitem__(self, column):
+        if column == 'Balance Value':
+            return self['Price'] * self['Share Balance']
+        elif column == 'UPNL':
+            return (self['Price'] - self['Cost Basis']) * self['Share Balance']
+        return self.values[value_columns.index(column), :self.size]
+
+    @property
+    def dates(self):
+        return pd.DatetimeIndex(self.time[:self.size].view('datetime64[ns]'), name=self.name)
+
+    @property
+    def sides(self):
+        return self.side[:self.size]
+
+    def append(self, date, side, price, share_diff, closing_price, share_balance, cash_balance, cost_basis,
+               trade_value, rpnl):
+        if self.size == self.time.shape[0]:
+            self.grow(2 * self.size)
+        self.time[self.size] = pd.Timestamp(date).as_unit('ns').value
+        self.side[self.size] = side
+        self.values[:, self.size] = (price, share_diff, closing_price, share_balance, cash_balance, cost_basis,
+                                     trade_value, rpnl)
+        self.size += 1
+        self.frame = None
+
+    def grow(self, capacity):
+        self.time = np.concatenate([self.time[:self.size], np.empty(capacity - self.size, dtype=np.int64)])
+        self.side = np.concatenate([self.side[:self.size], np.empty(capacity - self.size, dtype=np.int8)])
+        values = np.empty((len(value_columns), capacity))
+        values[:, :self.size] = self.values[:, :self.size]
+        self.values = values
+
+    # New ledger with the rows where mask is True
+    def take(self, mask):
+        ledger = TradeLedger(capacity=max(int(np.count_nonzero(mask)), 1), name=self.name)
+        ledger.size = int(np.count_nonzero(mask))
+        ledger.time[:ledger.size] = self.time[:self.size][mask]
+        ledger.side[:ledger.size] = self.sides[mask]
+        ledger.values[:, :ledger.size] = self.values[:, :self.size][:, mask]
+        return ledger
+
+    # Share quantities x factor & per share prices / factor of every row, in place (ie: shares grown by DRIP).
+    # Values in $ (Cash Balance, Trade Value, RPNL) stay as they are.
+    def scale_shares(self, factor):
+        for column in ['Share Diff', 'Share Balance']:
+            self.values[value_columns.index(column), :self.size] *= factor
+        for column in ['Price', 'Closing Price', 'Cost Basis']:
+            self.values[value_columns.index(column), :self.size] /= factor
+        self.frame = None
+
+    # {column: value} of the latest row, zeros when the ledger is empty
+    def last(self):
+        if self.size == 0:
+            return dict.fromkeys(table_columns, 0.0)
+        row = dict(zip(value_columns, self.values[:, self.size - 1].tolist()))
+        row['Decision'] = side_names[int(self.side[self.size - 1])]
+        row['Balance Value'] = row['Price'] * row['Share Balance']
+        row['UPNL'] = (row['Price'] - row['Cost Basis']) * row['Share Balance']
+        return row
+
+    # Side codes (1 = Buy, -1 = Sell, 0 = Closing Statement) by date, as plot_funcs.plot_decisions takes them
+    def decisions(self):
+        return pd.Series(self.sides, index=self.dates)
+
+    # pnl_calc style DataFrame, built once per state of the ledger (for display & file output)
+    def to_frame(self):
+        if self.frame is None:
+            names = np.array([side_names[code] for code in [BUY, SELL, CLOSE]], dtype=object)
+            self.frame = pd.DataFrame({column: self[column] if column != 'Decision' else
+                                       names[np.select([self.sides == BUY, self.sides == SELL], [0, 1], 2)]
+                                       for column in table_columns}, index=self.dates)
+        return self.frame
@@ -0,0 +1,166 @@
+import math
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from logic import signals, sweep, trade_logic
+from logic.price_history import price_frame
+
+# Monte Carlo robustness of a buy & sell strategy: price paths are resampled from the history's own bars
+# (circular block bootstrap of daily returns, keeping each bar's High/Low relative to its close) and traded with
+# the rules of get_trades & the ledger of pnl_calc. Paths are evaluated in batches of 2-D (path x bar) arrays.
+# Every batch has its own seed spawned from the run's seed, so results don't depend on the number of processes.
+
+result_columns = ['Final Value', 'PNL', 'Max Drawdown', 'Trade Count']
+
+# Max. number of (path x bar) cells simulated & evaluated per batch
+block_cells = 2 ** 22
+
+# Worker process state: the bar moves to resample & the strategy settings, shared by all batches
+worker_moves = None
+worker_settings = None
+
+
+# Log returns between closes along with the log High & Low relative to the close of the same bar
+def bar_moves(history):
+    history = price_frame(history)
+    high, low, close = (history[column].to_numpy(dtype=float) for column in ['High', 'Low', 'Close'])
+    return {'first_bar': (high[0], low[0], close[0]),
+            'returns': np.diff(np.log(close)),
+            'high': np.log(high[1:] / close[1:]),
+            'low': np.log(low[1:] / close[1:])}
+
+
+# (high, low, close) arrays of n_paths x n_bars, all starting from the history's first bar.
+# Blocks of block_size consecutive moves start anywhere in the history & wrap around its end.
+def bootstrap_paths(moves, n_paths, n_bars, block_size=20, rng=None):
+    rng = np.random.default_rng(rng)
+    n_moves = len(moves['returns'])
+    n_blocks = math.ceil((n_bars - 1) / block_size)
+    starts = rng.integers(0, n_moves, size=(n_paths, n_blocks))
+    picks = ((starts[:, :, None] + np.arange(block_size)) % n_moves).reshape(n_paths, -1)[:, :n_bars - 1]
+
+    first_high, first_low, first_close = moves['first_bar']
+    close = np.empty((n_paths, n_bars))
+    close[:, 0] = first_close
+    close[:, 1:] = first_close * np.exp(np.cumsum(moves['returns'][picks], axis=1))
+    high, low = np.empty_like(close), np.empty_like(close)
+    high[:, 0], low[:, 0] = first_high, first_low
+    high[:, 1:] = close[:, 1:] * np.exp(moves['high'][picks])
+    low[:, 1:] = close[:, 1:] * np.exp(moves['low'][picks])
+    return high, low, close
+
+
+# [(bar positions, decision prices)] of one side of the trade on every path, dated as get_trades dates them.
+# Sides with a start (sells in process_pnl_table) ignore decisions before it.
+def path_events(high, low, close, dates, strategy, long_bool, spans=(None, None), scaling=1.0, start_pos=None):
+    n_paths = close.shape[0]
+    spec = signals.strategy(strategy)
+    if not signals.trades(spec, long_bool):
+        return [(np.array([], dtype=int), np.array([], dtype=float))] * n_paths
+    elif spec.function is not None:
+        events = []
+        for path in range(n_paths):
+            path_history = pd.DataFrame({'High': high[path], 'Low': low[path], 'Close': close[path]}, index=dates)
+            decision, trade_point, _ = trade_logic.get_trades(
+                asset_data=path_history, long_bool=long_bool, strategy=strategy,
+                start=None if start_pos is None else dates[start_pos])
+            trade_pos = dates.get_indexer(decision.index[decision == 1])
+            events.append((trade_pos, close[path, trade_pos]))
+        return events
+
+    # Every path's rule at once, indicators run on one column per path so each path gets the exact indicator lines
+    graph = signals.SignalGraph()
+    decision, trade_point = graph.evaluate(graph.side(spec, long_bool, signals.bindings(spans, scaling)),
+                                           {'High': high, 'Low': low, 'Close': close})
+    signal = np.array(decision)
+    if start_pos is not None:
+        signal[:, :start_pos] = False
+
+    rows, cols = np.nonzero(signal)
+    prices = trade_point[rows, cols]
+    bounds = np.searchsorted(rows, np.arange(n_paths + 1))
+    return [(cols[bounds[path]: bounds[path + 1]], prices[bounds[path]: bounds[path + 1]]) for path in range(n_paths)]
+
+
+# result_columns of every path (rows of the high, low & close arrays) traded as process_pnl_table would.
+# Max Drawdown is the largest drop of the running PNL (RPNL + UPNL at each close) from its high, in $.
+def evaluate_paths(high, low, close, dates, buy_strategy, sell_strategy, buy_ma_span_one=None, buy_ma_span_two=None,
+                   sell_ma_span_one=None, sell_ma_span_two=None, gap_days=0, sell_gap_days=0, buy_scaling=1.0,
+                   sell_scaling=1.0, start_date=None, trade_size=1, allow_fractional=False, sell_all=False,
+                   calendar_gap=False):
+
+    n_paths, n_bars = close.shape
+    start_pos = 0 if start_date is None else dates.searchsorted(pd.to_datetime(start_date))
+    buy_events = path_events(high, low, close, dates, buy_strategy, True, spans=(buy_ma_span_one, buy_ma_span_two),
+                             scaling=buy_scaling)
+    sell_events = path_events(high, low, close, dates, sell_strategy, False,
+                              spans=(sell_ma_span_one, sell_ma_span_two), scaling=sell_scaling, start_pos=start_pos)
+    gap = gap_days if signals.strategy(buy_strategy).gap else 0
+    sell_gap = sell_gap_days if signals.strategy(sell_strategy).gap else 0
+    gap_dates = dates.to_numpy() if calendar_gap else None
+
+    results = np.zeros((n_paths, len(result_columns)))
+    bars = np.arange(start_pos, n_bars)
+    for path in range(n_paths):
+        positions, ledger = sweep.combination_ledger(buy_events[path], sell_events[path], gap=gap, sell_gap=sell_gap,
+                                                     start_pos=start_pos, end_pos=n_bars - 1, trade_size=trade_size,
+                                                     dates=gap_dates, allow_fractional=allow_fractional,
+                                                     sell_all=sell_all)
+        if ledger is None:
+            continue
+        rpnl, upnl, _, _, total_value, trade_count = sweep.closing_results(positions, ledger, close[path, -1],
+                                                                           n_bars - 1)
+
+        latest = np.searchsorted(positions, bars, side='right') - 1  # Latest trade of each bar
+        rows = np.maximum(latest, 0)
+        pnl = np.where(latest >= 0, ledger['RPNL'][rows] + (close[path, bars] - ledger['Cost Basis'][rows]) *
+                       ledger['Share Balance'][rows], 0.0)
+        drawdown = np.max(np.maximum.accumulate(np.maximum(pnl, 0.0)) - pnl)
+        results[path] = (total_value, rpnl + upnl, drawdown, trade_count)
+    return results
+
+
+def init_worker(moves, settings):
+    global worker_moves, worker_settings
+    worker_moves, worker_settings = moves, settings
+
+
+# Simulates & evaluates one batch of paths from its own seed
+def run_batch(n_paths, seed, moves=None, settings=None):
+    moves = worker_moves if moves is None else moves
+    settings = dict(worker_settings if settings is None else settings)
+    dates, n_bars, block_size = settings.pop('dates'), settings.pop('n_bars'), settings.pop('block_size')
+    high, low, close = bootstrap_paths(moves, n_paths, n_bars, block_size=block_size, rng=np.random.default_rng(seed))
+    return evaluate_paths(high, low, close, dates, **settings)
+
+
+# Final Value (Cash Balance + Balance Value), PNL, Max Drawdown & Trade Count of n_paths bootstrapped histories,
+# one row per path. Strategy inputs are process_pnl_table's. Paths are as long as the history & share its dates.
+def monte_carlo(history, buy_strategy, sell_strategy, n_paths=1000, block_size=20, seed=None, processes=None,
+                **strategy_settings):
+
+    history = price_frame(history)
+    moves = bar_moves(history)
+    settings = dict(strategy_settings, buy_strategy=buy_strategy, sell_strategy=sell_strategy, dates=history.index,
+                    n_bars=len(history), block_size=block_size)
+
+    batch_size = max(1, block_cells // len(history))
+    sizes = [min(batch_size, n_paths - start) for start in range(0, n_paths, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if processes == 1 or len(sizes) <= 1:
+        results = [run_batch(size, batch_seed, moves, settings) for size, batch_seed in zip(sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers=processes or os.cpu_count(), initializer=init_worker,
+                                 initargs=(moves, settings)) as executor:
+            results = list(executor.map(run_batch, sizes, seeds))
+    return pd.DataFrame(np.concatenate(results) if results else np.zeros((0, len(result_columns))),
+                        columns=result_columns).astype({'Trade Count': int})
+
+
+# Mean & quantiles of every result column over the paths
+def summarize(results, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+    summary = results.quantile(list(quantiles))
+    summary.index = [f'{quantile:.0%}' for quantile in quantiles]
+    return pd.concat([results.mean().to_frame('Mean').T, summary])
@@ -3,23 +3,84 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import pandas as pd
 import numpy as np
-
-
-def plot_price_data(plot_data, candlesticks=True):
+from logic.instrumentation import timed
+
+
+# Payload reduction for long histories (max_points=None plots every bar):
+# The bars from visible_start onwards are split into max_points buckets & the bars prior (only seen in
+# the range slider) into a quarter of that, so a figure's size is bounded whatever the history length.
+# Candlesticks are aggregated per bucket (first Open, max High, min Low, last Close), lines keep one
+# point per bucket chosen by Largest-Triangle-Three-Buckets.
+
+def bucket_starts(index, max_points, visible_start=None):
+    split = 0 if visible_start is None else index.searchsorted(pd.to_datetime(visible_start))
+    starts = []
+    for start, stop, n_buckets in [(0, split, max(max_points // 4, 1)), (split, len(index), max_points)]:
+        size = max(1, int(np.ceil((stop - start) / n_buckets)))
+        starts.append(np.arange(start, stop, size))
+    return np.concatenate(starts)
+
+
+def ohlc_buckets(index, open_price, high, low, close, starts):
+    ends = np.append(starts[1:], len(index)) - 1
+    return (index[starts], open_price[starts], np.maximum.reduceat(high, starts), np.minimum.reduceat(low, starts),
+            close[ends])
+
+
+# Largest-Triangle-Three-Buckets: first & last points, plus the point of each bucket in between forming the
+# largest triangle with the previously kept point & the average of the next bucket.
+def lttb(x, y, starts):
+    if len(starts) >= len(x) or len(starts) < 3:
+        return np.arange(len(x))
+    counts = np.diff(np.append(starts, len(x)))
+    x_avg, y_avg = np.add.reduceat(x, starts) / counts, np.add.reduceat(y, starts) / counts
+
+    kept = [0]
+    for bucket in range(1, len(starts) - 1):
+        a = kept[-1]
+        xb, yb = x[starts[bucket]: starts[bucket + 1]], y[starts[bucket]: starts[bucket + 1]]
+        xc, yc = (x_avg[bucket + 1], y_avg[bucket + 1]) if bucket + 2 < len(starts) else (x[-1], y[-1])
+        area = np.abs((x[a] - xc) * (yb - y[a]) - (x[a] - xb) * (yc - y[a]))
+        kept.append(starts[bucket] + int(np.argmax(area)))
+    kept.append(len(x) - 1)
+    return np.array(kept)
+
+
+# (dates, values) of a line series reduced to about max_points visible points, NaNs (ie: MA warm-up) dropped
+def downsample_line(series, max_points=None, visible_start=None):
+    index, values = series.index, np.asarray(series, dtype=float)
+    if max_points is None or len(values) <= max_points:
+        return index, values
+    valid = ~np.isnan(values)
+    index, values = index[valid], values[valid]
+    kept = lttb(index.asi8.astype(float), values, bucket_starts(index, max_points, visible_start))
+    return index[kept], values[kept]
+
+
+@timed('plot_price_data')
+def plot_price_data(plot_data, candlesticks=True, max_points=None, visible_start=None):
 
     # plot_data should have a datetime index & associated name
     figure = go.Figure()
+    index = plot_data.index
+    close = np.asarray(plot_data.Close, dtype=float)
 
     if candlesticks:
-        figure.add_trace(go.Candlestick(x=plot_data.index,
-                                           open=plot_data.Open,
-                                           close=plot_data.Close,
-                                           high=plot_data.High,
-                                           low=plot_data.Low,
+        ohlc = (index, np.asarray(plot_data.Open, dtype=float), np.asarray(plot_data.High, dtype=float),
+                np.asarray(plot_data.Low, dtype=float), close)
+        if max_points is not None and len(index) > max_points:
+            ohlc = ohlc_buckets(*ohlc, bucket_starts(index, max_points, visible_start))
+        dates, open_price, high, low, close = ohlc
+        figure.add_trace(go.Candlestick(x=dates,
+                                           open=open_price,
+                                           close=close,
+                                           high=high,
+                                           low=low,
                                         name=f'{plot_data.name} Close Price'))
     else:
-        figure.add_trace(go.Scatter(x=plot_data.index,
-                                        y=plot_data.Close,
+        dates, close = downsample_line(pd.Series(close, index=index), max_points, visible_start)
+        figure.add_trace(go.Scatter(x=dates,
+                                        y=close,
                                         mode='lines',
                                         line=dict(color='#1e272e'),
                                     name=plot_data.name,
@@ -30,9 +91,19 @@ def plot_price_data(plot_data, candlesticks=True):
     figure.update_yaxes(tickformat='$')
     return figure
 
-def plot_decisions(figure, decisions, price_point,  markers=True):
 
-    new_fig = go.Figure(figure)
+# At most max_points of the dates, keeping the first date of each cell of a max_points grid over their range
+def thin_dates(dates, max_points=None):
+    if max_points is None or len(dates) <= max_points:
+        return np.ones(len(dates), dtype=bool)
+    cell = (dates.asi8 - dates.asi8[0]) * max_points // max(dates.asi8[-1] - dates.asi8[0], 1)
+    return np.append(True, np.diff(cell) > 0)
+
+
+# Adds the decisions to the figure (in place). Vertical lines are drawn as one trace per side,
+# on a hidden 0-1 axis overlaying the prices, rather than one layout shape per trade.
+@timed('plot_decisions')
+def plot_decisions(figure, decisions, price_point,  markers=True, max_points=None):
 
     line_dicts = {
         'Buys': '#009432',
@@ -49,52 +120,58 @@ def plot_decisions(figure, decisions, price_point,  markers=True):
             mask = trades.get(decision)
             # Add Markers
             decision_price = (price_point.loc[mask] * decisions.loc[mask].abs()).replace(0, np.nan)
-            marker_name = 'Long Entry' if decision == 'Buy' else 'Short Entry'
-            new_fig.add_trace(go.Scatter(x=decision_price.index,
+            decision_price = decision_price.loc[thin_dates(decision_price.index, max_points)]
+            marker_name = 'Long Entry' if decision == 'Buys' else 'Short Entry'
+            figure.add_trace(go.Scatter(x=decision_price.index,
                                         y=decision_price.values,
                                         mode='markers',
                                         marker=marker_dicts.get(decision),
                                         name=marker_name)
                              )
     else:
-        shapes = {}
+        figure.update_layout(yaxis9=dict(overlaying='y', range=[0, 1], visible=False, fixedrange=True))
         for decision in list(trades.keys()):
-            mask = trades.get(decision)
-
-            line_color = line_dicts.get(decision)
-            decision_series = decisions.loc[mask]
-
-            if not decision_series.empty:
-                for date in tuple(decision_series.index.date):
-                    shapes[date.strftime('%Y-%m-%d')] = go.layout.Shape(line=dict(color=line_color, width=1),
-                                 opacity=0.6, type='line', x0=date, x1=date, xref='x', y0=0, y1=1, yref='y domain')
-        new_fig.update_layout(shapes=list(shapes.values()))
+            dates = pd.DatetimeIndex(decisions.index[trades.get(decision)].normalize().unique()).sort_values()
+            if len(dates) == 0:
+                continue
+            dates = dates[thin_dates(dates, max_points)]
+            figure.add_trace(go.Scatter(x=np.repeat(dates, 3),
+                                        y=np.tile([0, 1, np.nan], len(dates)),
+                                        yaxis='y9',
+                                        mode='lines',
+                                        line=dict(color=line_dicts.get(decision), width=1),
+                                        opacity=0.6,
+                                        hoverinfo='x',
+                                        name=decision)
+                             )
 
-    return new_fig
+    return figure
 
-def plot_ma(figure, ma_dict, long_bool):
 
-    new_fig = go.Figure(figure)
+# Adds the moving averages to the figure (in place)
+@timed('plot_ma')
+def plot_ma(figure, ma_dict, long_bool, max_points=None, visible_start=None):
 
     ma_keys = list(ma_dict.keys())
     if len(ma_keys) == 0:
-        return new_fig
+        return figure
     else:
         colors = ("#006266", "#05c46b") if long_bool else ("#6F1E51", "#ff5e57")
         ma_colors = dict(zip(ma_keys, colors))
 
         for moving_average in ma_keys:
-            ma_line = ma_dict.get(moving_average)
-            new_fig.add_trace(go.Scatter(x=ma_line.index,
-                                            y=ma_line.values,
+            dates, values = downsample_line(ma_dict.get(moving_average), max_points, visible_start)
+            figure.add_trace(go.Scatter(x=dates,
+                                            y=values,
                                             mode='lines',
                                             line=dict(color=ma_colors.get(moving_average), width=1),
                                             name=moving_average)
                              )
-        return new_fig
+        return figure
 
 # Used on the DCA page to track performance over time
-def dca_plot(dca_data, purchase_dates):
+@timed('dca_plot')
+def dca_plot(dca_data, purchase_dates, max_points=None):
 
     figure = make_subplots(rows=2, cols=1, shared_xaxes=True,
                            specs=[[{"secondary_y": False}],
@@ -105,7 +182,8 @@ def dca_plot(dca_data, purchase_dates):
     figure.update_layout(template='plotly_white', margin=dict(l=0, t=25), height=600)
 
 
-    figure.add_trace(go.Scatter(x=dca_data.index, y=dca_data['Close'],
+    dates, close = downsample_line(dca_data['Close'], max_points)
+    figure.add_trace(go.Scatter(x=dates, y=close,
                                 name='Close Price',
                                 mode='lines',
                                 line=dict(color='black')
@@ -114,22 +192,25 @@ def dca_plot(dca_data, purchase_dates):
 
     buy_series = dca_data.loc[purchase_dates]
 
-    figure.add_trace(go.Scatter(x=buy_series.index,
-                                y=buy_series['Share Balance'],
+    dates, share_balance = downsample_line(buy_series['Share Balance'], max_points)
+    figure.add_trace(go.Scatter(x=dates,
+                                y=share_balance,
                                 mode='lines',
                                 line=dict(color='#ff793f'),
                                 name='Share Count'), row=2, col=1, secondary_y=False)
 
-    figure.add_trace(go.Scatter(x=buy_series.index,
-                                y=buy_series['Value'],
+    dates, value = downsample_line(buy_series['Value'], max_points)
+    figure.add_trace(go.Scatter(x=dates,
+                                y=value,
                                 mode='lines',
                                 line=dict(color='#1289A7'),
                                 name='Investment Value',
                                 fill='tonexty'),
                      row=2, col=1, secondary_y=True)
 
-    figure.add_trace(go.Scatter(x=buy_series.index,
-                                y=buy_series['Cumulative Spend'],
+    dates, spend = downsample_line(buy_series['Cumulative Spend'], max_points)
+    figure.add_trace(go.Scatter(x=dates,
+                                y=spend,
                                 mode='lines',
                                 line=dict(color='#ED4C67'),
                                 name='Amount Invested'),
@@ -141,4 +222,16 @@ def dca_plot(dca_data, purchase_dates):
     figure['layout']['yaxis2']['showgrid'] = False
     figure['layout']['title'] = '<b>Performance Over Time</b>'
 
-    return figure
\ No newline at end of file
+    return figure
+
+# Histogram of a simulated result (ie: PNL over Monte Carlo paths), with the historical outcome marked
+@timed('distribution_plot')
+def distribution_plot(values, historical=None, name='PNL', bins=60):
+
+    figure = go.Figure(go.Histogram(x=values, nbinsx=bins, name=name, marker=dict(color='#1289A7')))
+    if historical is not None:
+        figure.add_vline(x=historical, line=dict(color='#EA2027', dash='dash'),
+                         annotation_text='Historical', annotation_position='top')
+    figure.update_layout(template='plotly_white', margin=dict(l=0, t=25), height=400, showlegend=False,
+                         xaxis_title=name, yaxis_title='Paths')
+    return figure
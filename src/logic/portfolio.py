@@ -0,0 +1,240 @@
+import numpy as np
+import pandas as pd
+from logic import kernels, ledger as trade_ledger, signals
+from logic.instrumentation import timed
+from logic.price_history import price_frame
+
+# Portfolio backtests: one buy & sell strategy run over many assets against a single shared cash balance.
+# Histories are aligned on the union of their dates into (bars x assets) arrays & the signals of every asset are
+# computed at once (TD Countdown, whose counts are sequential, excepted). The book then only steps through the bars
+# with a trade or a rebalance, each step working on the vector of assets involved rather than looping over assets.
+
+holding_columns = ['Share Balance', 'Cost Basis', 'Closing Price', 'Balance Value', 'RPNL', 'UPNL', 'Trade Count']
+trade_columns = ['Ticker', 'Decision', 'Share Diff', 'Price', 'Trade Value', 'Rebalance']
+equity_columns = ['Cash', 'Holdings Value', 'Total Value']
+
+
+# {column: (bars x assets) DataFrame} of the OHLC columns on the union of the histories' dates, one column per
+# ticker. Bars outside of (or missing from) an asset's history are NaN.
+def align_histories(histories):
+    histories = {ticker: price_frame(history) for ticker, history in histories.items()}
+    dates = pd.DatetimeIndex(np.unique(np.concatenate([history.index.to_numpy() for history in histories.values()]))
+                             if histories else [], name='Date')
+    columns = ['Open', 'High', 'Low', 'Close']
+    aligned = np.full((len(columns), len(dates), len(histories)), np.nan)
+    for idx, history in enumerate(histories.values()):  # Only places each history's bars, once
+        aligned[:, dates.searchsorted(history.index), idx] = history[columns].to_numpy(dtype=float).T
+    return {column: pd.DataFrame(aligned[pos], index=dates, columns=list(histories))
+            for pos, column in enumerate(columns)}
+
+
+# (bars x assets) decisions & decision prices of one side of the trade for every asset, dated as get_trades dates
+# them. prices: align_histories output, forward filled so holidays of one market don't break the averages.
+def asset_signals(prices, strategy, long_bool, spans=(None, None), scaling=1.0):
+    spec = signals.strategy(strategy)
+    close = prices['Close']
+    if not signals.trades(spec, long_bool):
+        return np.zeros(close.shape, dtype=bool), close.to_numpy(dtype=float)
+    elif spec.function is not None:
+        decision = np.zeros(close.shape, dtype=bool)
+        for idx, ticker in enumerate(close.columns):
+            listed = np.flatnonzero(close[ticker].notna().to_numpy())
+            history = pd.DataFrame({column: prices[column][ticker].to_numpy()[listed]
+                                    for column in ['Open', 'High', 'Low', 'Close']}, index=close.index[listed])
+            asset_decision, _ = spec.function(history, long_bool=long_bool)
+            decision[listed[asset_decision.to_numpy() == 1], idx] = True
+        return decision, close.to_numpy(dtype=float)
+
+    # Every asset's rule at once, on (assets x bars) arrays
+    graph = signals.SignalGraph()
+    decision, trade_point = graph.evaluate(graph.side(spec, long_bool, signals.bindings(spans, scaling)),
+                                           {column: frame.to_numpy(dtype=float).T for column, frame in prices.items()})
+    return np.array(decision.T), np.array(trade_point.T)
+
+
+# Same as trade_logic.gap_filter on every asset (column) at once: gap in bars, or calendar days when dates are given
+def gap_filter(decision, gap, dates=None):
+    assets, bars = np.nonzero(decision.T)  # Sorted by asset, then bar
+    if dates is None:
+        keep = kernels.gap_mask(bars, gap)
+    else:
+        keep = kernels.gap_mask(dates[bars], pd.Timedelta(days=gap).to_timedelta64())
+    keep[:-1] |= assets[1:] != assets[:-1]  # The last decision of an asset has no follower
+    filtered = np.zeros_like(decision)
+    filtered[bars[keep], assets[keep]] = True
+    return filtered
+
+
+# Last bar of every rebalancing period (a pandas period alias ie: 'W', 'M', 'Q'), from start_pos onwards.
+# The final bar is left out, it closes the books.
+def rebalance_bars(dates, freq, start_pos=0):
+    flags = np.zeros(len(dates), dtype=bool)
+    if freq is not None and len(dates) > 1:
+        periods = dates.to_period(freq).asi8
+        flags[:-1] = periods[1:] != periods[:-1]
+        flags[:start_pos] = False
+    return flags
+
+
+# Shares traded per decision, as in pnl_calc: trade_size worth, whole shares (1 at minimum) unless allow_fractional
+def trade_amount(price, trade_size, allow_fractional):
+    amount = trade_size / price
+    return amount if allow_fractional else np.maximum(np.floor(amount), 1)
+
+
+# Buy & sell strategy (process_pnl_table's inputs) over every history ({ticker: history}) with one cash balance.
+# Each buy decision spends trade_size on its asset, limited by:
+#   max_weight: largest share of the portfolio's value held in one asset after a buy
+#   max_positions: most assets held at once, new positions on the same bar are taken in histories order
+#   cash: the buys of a bar are scaled down together when they cost more than the cash available
+# Sells come first on every bar so their proceeds can be spent by the same bar's buys. Buys on the bar of a sell of
+# the same asset are dropped, as in pnl_calc. rebalance: period alias, held assets are brought back to equal shares
+# of the amount invested (capped at max_weight) at the close of every period. Trades fill at the decision prices.
+# Returns the daily equity (equity_columns), the shares held per asset & day, the trades (trade_columns, by date)
+# & one holding_columns row per asset valued at its latest close.
+@timed('portfolio_backtest', count=lambda result: {'bars': len(result[0]), 'trades': len(result[2])})
+def portfolio_backtest(histories, buy_strategy, sell_strategy, buy_ma_span_one=None, buy_ma_span_two=None,
+                       sell_ma_span_one=None, sell_ma_span_two=None, gap_days=0, sell_gap_days=0, buy_scaling=1.0,
+                       sell_scaling=1.0, start_date=None, trade_size=1, allow_fractional=False, sell_all=False,
+                       calendar_gap=False, initial_cash=100000.0, max_weight=1.0, max_positions=None, rebalance=None):
+
+    prices = align_histories(histories)
+    dates, tickers = prices['Close'].index, prices['Close'].columns
+    tradeable = prices['Close'].notna().to_numpy()
+    prices = {column: frame.ffill() for column, frame in prices.items()}
+    mark = np.nan_to_num(prices['Close'].to_numpy(dtype=float))  # Latest close, 0 before an asset's history
+    start_pos = 0 if start_date is None else dates.searchsorted(pd.to_datetime(start_date))
+    gap_dates = dates.to_numpy() if calendar_gap else None
+
+    buy_spans = (buy_ma_span_one, buy_ma_span_two)
+    buys, buy_price = asset_signals(prices, buy_strategy, True, spans=buy_spans, scaling=buy_scaling)
+    buys &= tradeable
+    if gap_days > 0 and signals.strategy(buy_strategy).gap:
+        buys = gap_filter(buys, gap_days, gap_dates)
+    buys[:start_pos] = False
+
+    sell_spans = (sell_ma_span_one, sell_ma_span_two)
+    sells, sell_price = asset_signals(prices, sell_strategy, False, spans=sell_spans, scaling=sell_scaling)
+    sells &= tradeable
+    sells[:start_pos] = False
+    if sell_gap_days > 0 and signals.strategy(sell_strategy).gap:
+        sells = gap_filter(sells, sell_gap_days, gap_dates)
+    buys &= ~sells
+
+    rebalancing = rebalance_bars(dates, rebalance, start_pos) & tradeable.any(axis=1)
+    book = run_book(buys, sells, buy_price, sell_price, mark, rebalancing, tradeable, trade_size=trade_size,
+                    allow_fractional=allow_fractional, sell_all=sell_all, initial_cash=initial_cash,
+                    max_weight=max_weight, max_positions=max_positions)
+    event_bars, held, cash, trades, (shares, basis, realized, trade_count) = book
+
+    # Daily shares & cash from the state after the latest event bar (the initial state before the first)
+    latest = np.searchsorted(event_bars, np.arange(len(dates)), side='right')
+    positions, cash_balance = held[latest], cash[latest]
+    holdings_value = np.einsum('ij,ij->i', positions, mark)
+    equity = pd.DataFrame({'Cash': cash_balance, 'Holdings Value': holdings_value,
+                           'Total Value': cash_balance + holdings_value}, index=dates).iloc[start_pos:]
+    positions = pd.DataFrame(positions, index=dates, columns=tickers).iloc[start_pos:]
+
+    bars, assets, share_diff, price, is_rebalance = trades
+    trades = pd.DataFrame({'Ticker': tickers[assets],
+                           'Decision': np.where(share_diff > 0, trade_ledger.side_names[trade_ledger.BUY],
+                                                trade_ledger.side_names[trade_ledger.SELL]),
+                           'Share Diff': share_diff,
+                           'Price': price,
+                           'Trade Value': share_diff * price,
+                           'Rebalance': is_rebalance}, index=dates[bars], columns=trade_columns)
+
+    closing_price = mark[-1] if len(dates) else np.zeros(len(tickers))
+    holdings = pd.DataFrame({'Share Balance': shares,
+                             'Cost Basis': basis,
+                             'Closing Price': closing_price,
+                             'Balance Value': shares * closing_price,
+                             'RPNL': realized,
+                             'UPNL': (closing_price - basis) * shares,
+                             'Trade Count': trade_count}, index=tickers)
+    return equity, positions, trades, holdings
+
+
+# Steps the shared book through every bar with a decision or a rebalance.
+# Returns the event bars, the shares held & cash before the first & after each of them, the trades as
+# (bars, assets, share diffs, prices, rebalance flags) arrays & the final (shares, cost basis, RPNL, trade count)
+# of every asset.
+def run_book(buys, sells, buy_price, sell_price, mark, rebalancing, tradeable, trade_size, allow_fractional,
+             sell_all, initial_cash, max_weight, max_positions):
+
+    n_assets = mark.shape[1]
+    shares, basis = np.zeros(n_assets), np.zeros(n_assets)
+    realized, trade_count = np.zeros(n_assets), np.zeros(n_assets, dtype=int)
+    cash = float(initial_cash)
+
+    event_bars = np.flatnonzero(buys.any(axis=1) | sells.any(axis=1) | rebalancing)
+    buy_bars, buy_assets = np.nonzero(buys)  # Sorted by bar, then asset
+    sell_bars, sell_assets = np.nonzero(sells)
+    buy_bounds = np.searchsorted(buy_bars, np.append(event_bars, len(buys)))
+    sell_bounds = np.searchsorted(sell_bars, np.append(event_bars, len(sells)))
+    held = np.zeros((len(event_bars) + 1, n_assets))
+    cash_after = np.full(len(event_bars) + 1, cash)
+    trades = []
+
+    def book_trades(bar, assets, share_diff, price, is_rebalance):
+        traded = share_diff != 0
+        assets, share_diff, price = assets[traded], share_diff[traded], price[traded]
+        buying, selling = share_diff > 0, share_diff < 0
+        realized[assets[selling]] += (price[selling] - basis[assets[selling]]) * -share_diff[selling]
+        balance = shares[assets] + share_diff
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bought_basis = (shares[assets] * basis[assets] + share_diff * price) / balance
+        basis[assets] = np.where(balance <= 0, 0.0, np.where(buying, bought_basis, basis[assets]))
+        shares[assets] = np.where(balance <= 0, 0.0, balance)  # Clears float dust from full sells
+        trade_count[assets] += 1
+        trades.append((np.full(len(assets), bar), assets, share_diff, price, np.full(len(assets), is_rebalance)))
+        return float(share_diff @ price)
+
+    for event, bar in enumerate(event_bars):
+        # Sells first, limited to the shares held
+        assets = sell_assets[sell_bounds[event]: sell_bounds[event + 1]]
+        assets = assets[shares[assets] > 0]
+        if len(assets):
+            price = sell_price[bar, assets]
+            amount = shares[assets] if sell_all else \
+                np.minimum(shares[assets], trade_amount(price, trade_size, allow_fractional))
+            cash -= book_trades(bar, assets, -amount, price, False)
+
+        # Buys, limited by max_weight, max_positions & the cash left
+        assets = buy_assets[buy_bounds[event]: buy_bounds[event + 1]]
+        if len(assets):
+            price = buy_price[bar, assets]
+            amount = trade_amount(price, trade_size, allow_fractional)
+            if max_weight < 1:
+                room = max_weight * (cash + shares @ mark[bar]) / price - shares[assets]
+                amount = np.minimum(amount, np.maximum(room, 0))
+            if max_positions is not None:
+                new = shares[assets] == 0
+                amount[new & (np.cumsum(new) > max_positions - np.count_nonzero(shares))] = 0
+            cost = float(amount @ price)
+            if cost > cash:
+                amount = amount * (max(cash, 0.0) / cost)
+            if not allow_fractional:
+                amount = np.floor(amount)
+            cash -= book_trades(bar, assets, amount, price, False)
+
+        # Rebalance the held (& tradeable) assets to equal shares of the amount invested
+        if rebalancing[bar]:
+            assets = np.flatnonzero((shares > 0) & tradeable[bar])
+            if len(assets):
+                price = mark[bar, assets]
+                invested = float(shares[assets] @ price)
+                target = np.minimum(invested / len(assets), max_weight * (cash + shares @ mark[bar])) / price
+                if not allow_fractional:
+                    target = np.floor(target)
+                cash -= book_trades(bar, assets, target - shares[assets], price, True)
+
+        held[event + 1] = shares
+        cash_after[event + 1] = cash
+
+    if trades:
+        trades = tuple(np.concatenate(column) for column in zip(*trades))
+    else:
+        trades = (np.array([], dtype=int), np.array([], dtype=int), np.array([]), np.array([]),
+                  np.array([], dtype=bool))
+    return event_bars, held, cash_after, trades, (shares, basis, realized, trade_count)
@@ -0,0 +1,100 @@
+import hashlib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+
+# Compact, read-only daily price history: an int64 date index (ns since epoch) & one contiguous
+# array per OHLC column, either float64 or (opt-in) float32. Opened from an uncompressed Arrow file
+# the arrays are memory-mapped, so every session/process viewing the same ticker shares its pages.
+class PriceHistory:
+
+    columns = ['Open', 'High', 'Low', 'Close']
+
+    def __init__(self, dates, prices, name=None):
+        self.dates = dates
+        self.prices = prices  # {column: array}
+        self.name = name
+        self.frame = None
+        self.digest = None
+
+    @classmethod
+    def from_frame(cls, history, float32=False, name=None):
+        dtype = np.float32 if float32 else np.float64
+        dates = pd.DatetimeIndex(history.index).as_unit('ns').asi8.copy()
+        prices = {column: np.ascontiguousarray(history[column].to_numpy(dtype=dtype)) for column in cls.columns}
+        for array in [dates, *prices.values()]:
+            array.flags.writeable = False
+        return cls(dates, prices, name=getattr(history, 'name', None) if name is None else name)
+
+    # Memory-maps a file written by write_arrow, no copies of the price data are made
+    @classmethod
+    def from_arrow(cls, path, name=None):
+        table = ipc.open_file(pa.memory_map(path, 'r')).read_all().combine_chunks()
+        dates = table.column('Date').chunk(0).to_numpy(zero_copy_only=True).view(np.int64)
+        prices = {column: table.column(column).chunk(0).to_numpy(zero_copy_only=True) for column in cls.columns}
+        return cls(dates, prices, name=name)
+
+    def write_arrow(self, path):
+        table = pa.table({'Date': pa.array(self.dates.view('datetime64[ns]')),
+                          **{column: pa.array(self.prices[column]) for column in self.columns}})
+        with pa.OSFile(path, 'wb') as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    @property
+    def index(self):
+        return pd.DatetimeIndex(self.dates.view('datetime64[ns]'), name='Date')
+
+    @property
+    def Open(self):
+        return self.prices['Open']
+
+    @property
+    def High(self):
+        return self.prices['High']
+
+    @property
+    def Low(self):
+        return self.prices['Low']
+
+    @property
+    def Close(self):
+        return self.prices['Close']
+
+    def __len__(self):
+        return len(self.dates)
+
+    # Bytes of the dates & prices, as IndicatorCache sizes its entries
+    @property
+    def nbytes(self):
+        return self.dates.nbytes + sum(array.nbytes for array in self.prices.values())
+
+    # Content fingerprint of the dates & prices, computed once as the arrays are read-only
+    def fingerprint(self):
+        if self.digest is None:
+            self.digest = content_fingerprint(self.dates, *self.prices.values())
+        return self.digest
+
+    # OHLC DataFrame over the same memory (built once), for the pandas based trade logic
+    def to_frame(self):
+        if self.frame is None:
+            self.frame = pd.DataFrame(self.prices, index=self.index, copy=False)
+        self.frame.name = self.name
+        return self.frame
+
+
+# Hash of the arrays' contents (dtype & shape included), identifies a history whichever object holds it
+def content_fingerprint(*arrays):
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(f'{array.dtype.str}{array.shape}'.encode())
+        digest.update(array.data)
+    return digest.hexdigest()
+
+
+# Lets trade logic take either a PriceHistory or a history DataFrame
+def price_frame(asset_data):
+    return asset_data.to_frame() if isinstance(asset_data, PriceHistory) else asset_data
@@ -0,0 +1,416 @@
+import collections
+import functools
+import re
+import numpy as np
+import pandas as pd
+from logic import indicators, kernels
+from logic.price_history import PriceHistory
+
+# Strategies as declarative signal rules. A rule such as `close < sma(25) * 0.975 & rsi(14) < 30` is parsed once,
+# then added to a SignalGraph where every distinct subexpression is a single node: identical ones (ie: the sma(25)
+# of a rule & of its trade price, or of every combination of a sweep) are only computed once. The graph is evaluated
+# node by node over whole arrays of bars, on one history or on 2-D blocks of them (price paths, assets), & each
+# value is dropped as soon as the nodes using it are computed.
+#
+# Rules combine the bar columns (open, high, low, close, volume), numbers, the strategy parameters (span_one,
+# span_two & scaling, as swept by the engines) & the functions below with + - * /, comparisons (< <= > >= == !=)
+# & the logical & | ~ (which bind looser than comparisons). A rule is true on the bars it decides to trade on.
+
+# Expression names of the history columns
+columns = {'open': 'Open', 'high': 'High', 'low': 'Low', 'close': 'Close', 'volume': 'Volume'}
+
+# Strategy parameters rules can use, bound to the spans & scaling of get_trades (& process_pnl_table's side inputs)
+parameter_names = ['span_one', 'span_two', 'scaling']
+
+
+# Fingerprint of every column of a history the rules can read, keying the indicators of any of them in the shared
+# cache (a PriceHistory's covers all of its prices)
+def history_fingerprint(asset_data):
+    if isinstance(asset_data, PriceHistory):
+        return asset_data.fingerprint()
+    return indicators.history_fingerprint(asset_data, [column for column in columns.values() if column in asset_data])
+
+
+# Array functions (bars on the last axis) of the rules
+def cross_above(series_one, series_two):
+    return kernels.crossings(series_one, series_two, upward=True)
+
+
+def cross_below(series_one, series_two):
+    return kernels.crossings(series_one, series_two, upward=False)
+
+
+# Value periods bars before, NaN before the first bar
+def previous(values, periods=None):
+    periods = 1 if periods is None else int(periods)
+    shifted = np.full(np.shape(values), np.nan)
+    if periods < shifted.shape[-1]:
+        shifted[..., periods:] = values[..., :shifted.shape[-1] - periods]
+    return shifted
+
+
+# kind: 'indicator' (a pandas function of a Series or of a DataFrame's columns, see indicators), 'array' (a function
+#       of arrays) or 'macro' (a rule over its inputs & parameters)
+# inputs: [(name, default column or None when required)], parameters: [(name, default)]
+# lookahead: bars past its own a value depends on, ie: a crossover on bar t is only known on bar t+1
+Function = collections.namedtuple('Function', ['kind', 'function', 'inputs', 'parameters', 'lookahead'],
+                                  defaults=([('source', 'close')], [('span', None)], 0))
+
+functions = {'sma': Function('indicator', indicators.sma_line),
+             'ema': Function('indicator', indicators.ema_line),
+             'std': Function('indicator', indicators.std_line),
+             'rsi': Function('indicator', indicators.rsi_line),
+             'highest': Function('indicator', indicators.highest_line),
+             'lowest': Function('indicator', indicators.lowest_line),
+             'bb_upper': Function('macro', 'sma(source, span) + width * std(source, span)',
+                                  parameters=[('span', 20), ('width', 2)]),
+             'bb_lower': Function('macro', 'sma(source, span) - width * std(source, span)',
+                                  parameters=[('span', 20), ('width', 2)]),
+             'prev': Function('array', previous, inputs=[('values', None)], parameters=[('periods', 1)]),
+             'cross_above': Function('array', cross_above, inputs=[('series_one', None), ('series_two', None)],
+                                     parameters=[], lookahead=1),
+             'cross_below': Function('array', cross_below, inputs=[('series_one', None), ('series_two', None)],
+                                     parameters=[], lookahead=1)}
+
+operators = {'+': np.add, '-': np.subtract, '*': np.multiply, '/': np.divide, '<': np.less, '<=': np.less_equal,
+             '>': np.greater, '>=': np.greater_equal, '==': np.equal, '!=': np.not_equal, '&': np.logical_and,
+             '|': np.logical_or, 'neg': np.negative, '~': np.logical_not}
+
+# Operators whose operands can be swapped, so a + b & b + a are the same node
+commutative = {'+', '*', '==', '!=', '&', '|'}
+
+# Binary operators by precedence, loosest first
+precedence = [['|'], ['&'], ['<', '<=', '>', '>=', '==', '!='], ['+', '-'], ['*', '/']]
+
+token_pattern = re.compile(r'\s*(?:(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|(?P<name>[A-Za-z_]\w*)|'
+                           r'(?P<operator><=|>=|==|!=|[-+*/<>&|~(),]))')
+
+
+# Syntax tree of an expression, as nested tuples: ('number', value), ('name', name), ('call', name, args),
+# ('unary', operator, operand) & ('binary', operator, left, right)
+class Parser:
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = []
+        pos = 0
+        while text[pos:].strip():
+            match = token_pattern.match(text, pos)
+            if match is None:
+                raise ValueError(f'Invalid rule {text!r}: unexpected {text[pos:].strip()[0]!r}')
+            self.tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            pos = match.end()
+        self.pos = 0
+
+    def parse(self):
+        tree = self.binary(0)
+        if self.pos < len(self.tokens):
+            raise ValueError(f'Invalid rule {self.text!r}: unexpected {self.tokens[self.pos][1]!r}')
+        return tree
+
+    def peek(self):
+        return self.tokens[self.pos][1] if self.pos < len(self.tokens) else None
+
+    def take(self, expected=None):
+        if self.pos == len(self.tokens):
+            raise ValueError(f'Invalid rule {self.text!r}: unexpected end')
+        kind, value = self.tokens[self.pos]
+        if expected is not None and value != expected:
+            raise ValueError(f'Invalid rule {self.text!r}: expected {expected!r}, got {value!r}')
+        self.pos += 1
+        return kind, value
+
+    def binary(self, level):
+        if level == len(precedence):
+            return self.unary()
+        tree = self.binary(level + 1)
+        while self.peek() in precedence[level]:
+            _, operator = self.take()
+            tree = ('binary', operator, tree, self.binary(level + 1))
+        return tree
+
+    def unary(self):
+        if self.peek() in ['-', '~']:
+            _, operator = self.take()
+            return ('unary', 'neg' if operator == '-' else operator, self.unary())
+        return self.primary()
+
+    def primary(self):
+        kind, value = self.take()
+        if kind == 'number':
+            return ('number', float(value) if any(_ in value for _ in '.eE') else int(value))
+        elif kind == 'name' and self.peek() == '(':
+            if value not in functions:
+                raise ValueError(f'Invalid rule {self.text!r}: unknown function {value}, expected one of '
+                                 f'{", ".join(functions)}')
+            self.take('(')
+            args = []
+            while self.peek() != ')':
+                if args:
+                    self.take(',')
+                args.append(self.binary(0))
+            self.take(')')
+            function = functions[value]
+            if len(args) > len(function.inputs) + len(function.parameters):
+                raise ValueError(f'Invalid rule {self.text!r}: too many arguments to {value}')
+            return ('call', value, tuple(args))
+        elif kind == 'name':
+            return ('name', value)
+        elif value == '(':
+            tree = self.binary(0)
+            self.take(')')
+            return tree
+        raise ValueError(f'Invalid rule {self.text!r}: unexpected {value!r}')
+
+
+@functools.lru_cache(maxsize=1024)
+def parse(text):
+    return Parser(text).parse()
+
+
+# Names a syntax tree refers to (columns & parameters)
+def tree_names(tree):
+    if tree[0] == 'name':
+        return {tree[1]}
+    children = tree[2] if tree[0] == 'call' else tree[2:] if tree[0] != 'number' else ()
+    return set().union(*[tree_names(child) for child in children])
+
+
+# Bars past its own the value of a syntax tree depends on
+def tree_lookahead(tree):
+    if tree[0] in ['number', 'name']:
+        return 0
+    elif tree[0] == 'call':
+        function = functions[tree[1]]
+        own = tree_lookahead(parse(function.function)) if function.kind == 'macro' else function.lookahead
+        return own + max([tree_lookahead(arg) for arg in tree[2]], default=0)
+    return max(tree_lookahead(child) for child in tree[2:])
+
+
+# Hash-consed DAG of signal expressions. Nodes are (operator, child nodes, parameters) & a node is only added once,
+# so the expressions added to a graph share their common subexpressions. Nodes are numbered in the order they are
+# added, after their children: ascending ids are a topological order.
+class SignalGraph:
+
+    def __init__(self):
+        self.nodes = []
+        self.ids = {}
+
+    def node(self, operator, children=(), parameters=()):
+        if operator in commutative:
+            children = tuple(sorted(children))
+        key = (operator, tuple(children), tuple(parameters))
+        if key not in self.ids:
+            self.ids[key] = len(self.nodes)
+            self.nodes.append(key)
+        return self.ids[key]
+
+    def constant(self, node):
+        operator, _, parameters = self.nodes[node]
+        return parameters[0] if operator == 'const' else None
+
+    def is_constant(self, node):
+        return self.nodes[node][0] == 'const'
+
+    # Node of a syntax tree, with the strategy parameters of bindings & the local names of a macro in scope
+    def add(self, tree, bindings, scope=None):
+        kind = tree[0]
+        if kind == 'number':
+            return self.node('const', parameters=(tree[1],))
+        elif kind == 'name':
+            name = tree[1]
+            if scope is not None and name in scope:
+                return scope[name]
+            elif name in columns:
+                return self.node('input', parameters=(columns[name],))
+            elif name in bindings:
+                return self.node('const', parameters=(bindings[name],))
+            raise ValueError(f'Unknown name {name}, expected a column ({", ".join(columns)}) or a parameter '
+                             f'({", ".join(parameter_names)})')
+        elif kind in ['unary', 'binary']:
+            children = [self.add(child, bindings, scope) for child in tree[2:]]
+            if all(self.is_constant(child) for child in children) and \
+                    all(self.constant(child) is not None for child in children):
+                return self.node('const', parameters=(operators[tree[1]](*[self.constant(child)
+                                                                           for child in children]).item(),))
+            return self.node(tree[1], children)
+        return self.call(tree[1], [self.add(arg, bindings, scope) for arg in tree[2]], bindings)
+
+    # Node of a function of arg nodes: leading non-constant args are its inputs (the missing ones take their
+    # default column), the following ones its parameters. Functions without parameters take every arg as an input.
+    def call(self, name, args, bindings):
+        function = functions[name]
+        n_inputs = 0
+        while n_inputs < min(len(args), len(function.inputs)) and \
+                (not function.parameters or not self.is_constant(args[n_inputs])):
+            n_inputs += 1
+        inputs, parameters = args[:n_inputs], args[n_inputs:]
+        for input_name, default in function.inputs[n_inputs:]:
+            if default is None:
+                raise ValueError(f'{name} needs a {input_name}')
+            inputs.append(self.node('input', parameters=(columns[default],)))
+        if len(parameters) > len(function.parameters) or not all(self.is_constant(arg) for arg in parameters):
+            raise ValueError(f'{name} takes {len(function.inputs)} series & {len(function.parameters)} numbers')
+        values = [self.constant(arg) for arg in parameters] + \
+                 [default for _, default in function.parameters[len(parameters):]]
+
+        if function.kind == 'macro':
+            scope = {input_name: node for (input_name, _), node in zip(function.inputs, inputs)}
+            scope.update({parameter: self.node('const', parameters=(value,))
+                          for (parameter, _), value in zip(function.parameters, values)})
+            return self.add(parse(function.function), bindings, scope)
+        return self.node(name, inputs, values)
+
+    # Decision & trade price nodes of one side of spec (a Strategy with rules)
+    def side(self, spec, long_bool, bindings):
+        return (self.add(parse(spec.buy if long_bool else spec.sell), bindings),
+                self.add(parse(spec.price), bindings))
+
+    # {label: node} of spec's plotted lines, labels formatted with the bindings
+    def lines(self, spec, bindings):
+        return {label.format(**bindings): self.add(parse(line), bindings) for label, line in spec.lines.items()}
+
+    # Nodes roots depend on (themselves included), skipping the nodes of done
+    def closure(self, roots, done=()):
+        stack, found = list(roots), set()
+        while stack:
+            node = stack.pop()
+            if node not in found and node not in done:
+                found.add(node)
+                stack.extend(self.nodes[node][1])
+        return found
+
+    # Yields the value of every node of roots, in order, as arrays of the bars' shape. data: a history DataFrame, or
+    # {column: 2-D array} with one row per path/asset. fingerprint: the history's, to share the indicators of its
+    # columns through indicators.ma_cache. Values are dropped once every node & root using them is done.
+    def evaluate(self, roots, data, fingerprint=None):
+        frame = isinstance(data, pd.DataFrame)
+        shape = (len(data),) if frame else np.shape(next(iter(data.values())))
+        users = collections.Counter(roots)
+        for node in self.closure(roots):
+            users.update(set(self.nodes[node][1]))
+
+        values, done = {}, set()
+        for root in roots:
+            for node in sorted(self.closure([root], done)):
+                values[node] = self.compute(node, values, data, frame, shape, fingerprint)
+                done.add(node)
+                for child in set(self.nodes[node][1]):
+                    users[child] -= 1
+                    if users[child] == 0:
+                        del values[child]
+            yield np.broadcast_to(values[root], shape)
+            users[root] -= 1
+            if users[root] == 0:
+                del values[root]
+
+    def compute(self, node, values, data, frame, shape, fingerprint):
+        operator, children, parameters = self.nodes[node]
+        if operator == 'const':
+            return parameters[0]
+        elif operator == 'input':
+            if parameters[0] not in data:
+                raise ValueError(f'{parameters[0]} is not available to the rules here')
+            return data[parameters[0]].to_numpy() if frame else data[parameters[0]]
+        args = [values[child] for child in children]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if operator in operators:
+                return operators[operator](*args)
+
+            function = functions[operator]
+            args = [np.broadcast_to(arg, shape) for arg in args]
+            if function.kind == 'array':
+                return function.function(*args, *parameters)
+            source_operator, _, source_parameters = self.nodes[children[0]]
+            if frame and fingerprint is not None and source_operator == 'input':
+                return indicators.indicator(data[source_parameters[0]], function.function, parameters,
+                                            fingerprint).to_numpy()
+            elif frame:
+                return function.function(pd.Series(args[0], index=data.index), *parameters).to_numpy()
+            return function.function(pd.DataFrame(args[0].T), *parameters).to_numpy().T
+
+
+# name: shown in the app & taken by the engines
+# buy & sell: rules of each side, None for a side that never trades
+# price: expression of the price decisions trade at
+# lines: {label (formatted with the parameters): expression} plotted along the prices
+# function: plug-in returning (decision, trade point) Series as td_strategy does, in place of rules
+# gap: the minimum gaps between decisions apply, intrabar: prices are levels touched within the bar (not closes)
+Strategy = collections.namedtuple('Strategy', ['name', 'buy', 'sell', 'price', 'lines', 'function', 'gap', 'intrabar'],
+                                  defaults=(None, None, 'close', {}, None, True, False))
+
+# Registered strategies by name, in the order the app lists them
+strategies = {}
+
+
+# Adds (or replaces) a strategy, checking its expressions first
+def register(spec):
+    check(spec)
+    strategies[spec.name] = spec
+    return spec
+
+
+# Registered strategy of name, or a strategy trading the rule name on both sides (ie: a rule typed in the app).
+# Raises ValueError when name is neither.
+def strategy(name):
+    if name in strategies:
+        return strategies[name]
+    return check(Strategy(name, buy=name, sell=name))
+
+
+# Raises ValueError when an expression of spec doesn't parse or refers to unknown names
+def check(spec):
+    graph = SignalGraph()
+    for text in [spec.buy, spec.sell, spec.price, *spec.lines.values()]:
+        if text is not None:
+            graph.add(parse(text), dict.fromkeys(parameter_names, 1))
+    return spec
+
+
+# True when the buy (long_bool) or sell side of spec makes decisions
+def trades(spec, long_bool):
+    return spec.function is not None or (spec.buy if long_bool else spec.sell) is not None
+
+
+# parameter_names one side of spec uses, in parameter_names order
+def parameters(spec, long_bool):
+    if not trades(spec, long_bool) or spec.function is not None:
+        return []
+    names = set().union(*[tree_names(parse(text)) for text in [spec.buy if long_bool else spec.sell, spec.price,
+                                                                *spec.lines.values()]])
+    return [name for name in parameter_names if name in names]
+
+
+# Bars past its own each decision of one side of spec depends on
+def lookahead(spec, long_bool):
+    if not trades(spec, long_bool) or spec.function is not None:
+        return 0
+    return tree_lookahead(parse(spec.buy if long_bool else spec.sell))
+
+
+# Parameter bindings of get_trades' spans & scaling
+def bindings(spans=(), scaling=1.0):
+    spans = list(spans or ()) + [None, None]
+    return {'span_one': spans[0], 'span_two': spans[1], 'scaling': scaling}
+
+
+# TD Sequential counts run bar after bar rather than over whole arrays, so TD Countdown plugs its decisions in
+def td_countdown(history, long_bool=True, start_date=None, timeframe=None):
+    from logic import trade_logic  # Which builds on the strategies here
+    return trade_logic.td_strategy(history, long_bool=long_bool, start_date=start_date, timeframe=timeframe)
+
+
+register(Strategy('Hold/None', gap=False))
+register(Strategy('On SMA', buy='cross_above(high, sma(span_one) * scaling)',
+                  sell='cross_below(low, sma(span_one) * scaling)', price='sma(span_one) * scaling',
+                  lines={'SMA ({span_one})': 'sma(span_one) * scaling'}, intrabar=True))
+register(Strategy('On EMA', buy='cross_above(high, ema(span_one) * scaling)',
+                  sell='cross_below(low, ema(span_one) * scaling)', price='ema(span_one) * scaling',
+                  lines={'EMA ({span_one})': 'ema(span_one) * scaling'}, intrabar=True))
+register(Strategy('On SMA Crossover', buy='cross_above(sma(span_one), sma(span_two))',
+                  sell='cross_below(sma(span_one), sma(span_two))',
+                  lines={'SMA ({span_one})': 'sma(span_one)', 'SMA ({span_two})': 'sma(span_two)'}))
+register(Strategy('On EMA Crossover', buy='cross_above(ema(span_one), ema(span_two))',
+                  sell='cross_below(ema(span_one), ema(span_two))',
+                  lines={'EMA ({span_one})': 'ema(span_one)', 'EMA ({span_two})': 'ema(span_two)'}))
+register(Strategy('TD Countdown', function=td_countdown, gap=False))
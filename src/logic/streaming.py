@@ -0,0 +1,492 @@
+import collections
+import datetime
+import numpy as np
+import pandas as pd
+from logic import indicators, kernels, ledger, signals, trade_logic
+from logic.price_history import price_frame
+
+# Bar by bar evaluation of the strategies in signals.strategies, for live appends (ie: paper trading monitors).
+# Each stream keeps only the state its indicator needs, so an update is O(1) per bar (O(span) for window extremes
+# & deviations).
+# Decisions are dated as get_trades dates them: a crossover at t is only known once bar t+1 has arrived,
+# and with a gap a decision is only final once no other decision can follow within the gap.
+
+# Span defaults of the indicators' lines
+span_defaults = {indicators.sma_line: 200, indicators.ema_line: 25, indicators.std_line: 20, indicators.rsi_line: 14,
+                 indicators.highest_line: 20, indicators.lowest_line: 20}
+
+Bar = collections.namedtuple('Bar', ['pos', 'date', 'high', 'low', 'close'])
+Decision = collections.namedtuple('Decision', ['pos', 'date', 'price', 'close'])
+
+
+# Rolling mean over the last span values, same summation (Kahan, remove then add) as pandas' rolling().mean()
+class SMAStream:
+
+    def __init__(self, span=None):
+        self.span = span_defaults[indicators.sma_line] if span is None else span
+        self.window = collections.deque()
+        self.total = 0.0
+        self.compensation = 0.0
+
+    def add(self, value):
+        y = value - self.compensation
+        t = self.total + y
+        self.compensation = t - self.total - y
+        self.total = t
+
+    def update(self, value):
+        if len(self.window) == self.span:
+            self.add(-self.window.popleft())
+        self.window.append(value)
+        self.add(value)
+        return self.total / self.span if len(self.window) == self.span else np.nan
+
+
+# Adjusted exponentially weighed mean, same recursion as pandas' ewm(com=span).mean() (see ema_line)
+class EMAStream:
+
+    def __init__(self, span=None):
+        self.span = span_defaults[indicators.ema_line] if span is None else span
+        self.decay = 1 - 1 / (1 + self.span)
+        self.weight = 0.0
+        self.value = np.nan
+
+    def update(self, value):
+        if self.weight == 0:
+            self.value, self.weight = value, 1.0
+            return self.value
+        self.weight *= self.decay
+        if self.value != value:
+            self.value = (self.weight * self.value + value) / (self.weight + 1)
+        self.weight += 1
+        return self.value
+
+
+# Wilder's RSI, same recursion as pandas' ewm(alpha=1 / span, adjust=False).mean() of the gains & losses (see rsi_line)
+class RSIStream:
+
+    def __init__(self, span=None):
+        self.span = span_defaults[indicators.rsi_line] if span is None else span
+        self.alpha = 1 / self.span
+        self.decay = 1 - self.alpha
+        self.previous = np.nan
+        self.gain, self.loss = np.nan, np.nan
+        self.count = 0
+
+    def smooth(self, mean, value):
+        if mean != mean:
+            return value
+        return (self.decay * mean + self.alpha * value) / (self.decay + self.alpha) if mean != value else mean
+
+    def update(self, value):
+        change = value - self.previous
+        self.previous = value
+        if change == change:  # No change before the first value
+            self.count += 1
+            self.gain = self.smooth(self.gain, max(change, 0.0))
+            self.loss = self.smooth(self.loss, max(-change, 0.0))
+        if self.count < self.span:
+            return np.nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return 100 - 100 / (1 + np.float64(self.gain) / self.loss)
+
+
+# reducer (ie: np.max) of the last span values, NaN until there are span of them
+class WindowStream:
+
+    def __init__(self, reducer, span):
+        self.reducer = reducer
+        self.window = collections.deque(maxlen=span)
+
+    def update(self, value):
+        self.window.append(value)
+        return self.reducer(self.window) if len(self.window) == self.window.maxlen else np.nan
+
+
+# Streams of the indicators, by their line function: stream(*parameters)
+indicator_streams = {
+    indicators.sma_line: SMAStream,
+    indicators.ema_line: EMAStream,
+    indicators.rsi_line: RSIStream,
+    indicators.std_line: lambda span=None: WindowStream(lambda window: np.std(window, ddof=1),
+                                                        span_defaults[indicators.std_line] if span is None else span),
+    indicators.highest_line: lambda span=None: WindowStream(max, span_defaults[indicators.highest_line]
+                                                            if span is None else span),
+    indicators.lowest_line: lambda span=None: WindowStream(min, span_defaults[indicators.lowest_line]
+                                                           if span is None else span)}
+
+
+# TD Sequential setups & countdowns as in trade_logic.td_strategy, one bar at a time.
+# update returns True when the bar is a qualified countdown 13.
+class TDStream:
+
+    def __init__(self, long_bool=True, countdown_days=35):
+        self.long_bool = long_bool
+        self.countdown_days = countdown_days
+        self.closes = collections.deque(maxlen=5)
+        self.bars = collections.deque(maxlen=9)  # (date, high, low) of the latest 9 bars
+        self.setup_run, self.opposite_run = 0, 0
+        self.countdown = None
+
+    def update(self, date, high, low, close):
+        self.closes.append(close)
+        self.bars.append((date, high, low))
+        lower = len(self.closes) == 5 and close < self.closes[0]
+        higher = len(self.closes) == 5 and close > self.closes[0]
+        self.setup_run = self.setup_run + 1 if (lower if self.long_bool else higher) else 0
+        self.opposite_run = self.opposite_run + 1 if (higher if self.long_bool else lower) else 0
+
+        if self.opposite_run == 9:
+            self.countdown = None  # Cancelled by a setup in the opposite direction
+        if self.setup_run == 9:
+            # New countdown (recycling any in progress), from setup bar 9 until countdown_days after setup bar 7
+            extreme = max(bar[1] for bar in self.bars) if self.long_bool else min(bar[2] for bar in self.bars)
+            self.countdown = {'nine': date, 'end': self.bars[-3][0] + datetime.timedelta(days=self.countdown_days + 1),
+                              'extreme': extreme, 'count': 0}
+        countdown = self.countdown
+        if countdown is None:
+            return False
+
+        beyond_setup = (low > countdown['extreme']) if self.long_bool else (high < countdown['extreme'])
+        if date > countdown['end'] or (beyond_setup and date != countdown['nine']):
+            self.countdown = None
+            return False
+
+        _, prior_high, prior_low = self.bars[-3]
+        if not ((close < prior_low) if self.long_bool else (close > prior_high)):
+            return False
+        countdown['count'] += 1
+        if countdown['count'] == 8:
+            countdown['eight_close'] = close
+        elif countdown['count'] == 11:
+            countdown['eleven_bound'] = low if self.long_bool else high
+        if countdown['count'] < 13:
+            return False
+
+        # Ensure TD Countdown meets Qualifier Criteria, otherwise defer to the next countdown bar
+        if self.long_bool:
+            qualified = low <= countdown['eight_close'] and close <= countdown['eleven_bound']
+        else:
+            qualified = high >= countdown['eight_close'] and close >= countdown['eleven_bound']
+        if qualified:
+            self.countdown = None
+        return qualified
+
+
+# Bar by bar evaluation of the roots of a signals.SignalGraph. Every node emits its values in bar order, an elementwise
+# node once each of its children has the bar's value & a crossover a bar late (it needs the next bar's values), so
+# the values of each root line up with the bars by their order.
+class GraphStream:
+
+    def __init__(self, graph, roots):
+        self.graph = graph
+        self.roots = roots
+        self.order = sorted(graph.closure(roots))  # Children are added before their parents
+        self.queues = {node: [collections.deque() for _ in graph.nodes[node][1]] for node in self.order}
+        self.states = {node: self.state(*graph.nodes[node]) for node in self.order}
+
+    @staticmethod
+    def state(operator, children, parameters):
+        if operator == 'input' and parameters[0] not in ['High', 'Low', 'Close']:
+            raise ValueError(f'{parameters[0]} is not available to the rules here')
+        elif operator in ['const', 'input'] or operator in signals.operators:
+            return None
+        function = signals.functions[operator]
+        if function.function in [signals.cross_above, signals.cross_below]:
+            return [None]  # Values of the prior bar
+        elif function.function is signals.previous:
+            return collections.deque(maxlen=1 if parameters[0] is None else int(parameters[0]))
+        elif function.function in indicator_streams:
+            return indicator_streams[function.function](*parameters)
+        raise ValueError(f'{operator} has no bar by bar form')
+
+    # Values of each root which became known with bar: [[values] by root]
+    def update(self, bar):
+        values = {}
+        for node in self.order:
+            operator, children, parameters = self.graph.nodes[node]
+            if operator == 'const':
+                values[node] = [parameters[0]]
+                continue
+            elif operator == 'input':
+                values[node] = [getattr(bar, parameters[0].lower())]
+                continue
+            queues = self.queues[node]
+            for queue, child in zip(queues, children):
+                queue.extend(values[child])
+            values[node] = []
+            while all(queues):
+                values[node].extend(self.step(node, operator, [queue.popleft() for queue in queues]))
+        return [values[root] for root in self.roots]
+
+    def step(self, node, operator, args):
+        if operator in signals.operators:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return [signals.operators[operator](*args)]
+        function = signals.functions[operator].function
+        state = self.states[node]
+        if function in [signals.cross_above, signals.cross_below]:
+            prior, state[0] = state[0], args
+            if prior is None:
+                return []
+            before, after = (np.less, np.greater) if function is signals.cross_above else (np.greater, np.less)
+            return [bool(before(*prior) and after(*args))]
+        elif function is signals.previous:
+            value = state[0] if len(state) == state.maxlen else np.nan
+            state.append(args[0])
+            return [value]
+        return [state.update(args[0])]
+
+
+# Plug-in strategies (signals.Strategy.function) with a bar by bar form: stream(long_bool)
+function_streams = {signals.td_countdown: TDStream}
+
+
+# Buy (long_bool=True) or sell decisions of one strategy, with the same inputs as get_trades.
+# update returns the decisions which became final with the bar; decisions up to final_pos are final.
+class SignalStream:
+
+    def __init__(self, strategy, long_bool, spans=(None, None), scaling=1, gap=0, calendar_gap=False, start=None):
+        spec = signals.strategy(strategy)
+        self.long_bool = long_bool
+        self.start = None if start is None else pd.to_datetime(start)
+        self.td, self.rules = None, None
+        if spec.function is not None:
+            if spec.function not in function_streams:
+                raise ValueError(f'{spec.name} has no bar by bar form')
+            self.td = function_streams[spec.function](long_bool)
+        elif signals.trades(spec, long_bool):
+            graph = signals.SignalGraph()
+            self.rules = GraphStream(graph, graph.side(spec, long_bool,
+                                                       signals.bindings(spans, 1 if scaling is None else scaling)))
+        self.bars = collections.deque()  # Bars whose decision isn't known yet
+        self.decided, self.prices = collections.deque(), collections.deque()
+        self.gap = gap if spec.gap else 0  # As with get_trades, no gap for Hold & TD Countdown
+        self.calendar_gap = calendar_gap
+        self.cooldown = pd.Timedelta(days=gap)
+        self.pending = None  # Latest decision, held back until no other one can follow within the gap
+        self.final_pos = -1
+
+    def update(self, bar):
+        decision = None
+        if self.td is not None:
+            if self.td.update(bar.date, bar.high, bar.low, bar.close):
+                decision = Decision(bar.pos, bar.date, bar.close, bar.close)
+            determined = bar
+        elif self.rules is not None:
+            self.bars.append(bar)
+            decided, prices = self.rules.update(bar)
+            self.decided.extend(decided)
+            self.prices.extend(prices)
+            determined = None
+            if self.decided and self.prices:  # The rules are known up to the bar before (crossovers) or this one
+                determined = self.bars.popleft()
+                price = float(self.prices.popleft())
+                if self.decided.popleft() and price == price and price != 0:
+                    decision = Decision(determined.pos, determined.date, price, determined.close)
+        else:
+            determined = bar
+
+        if decision is not None and self.start is not None and decision.date < self.start:
+            decision = None
+        if determined is None:
+            return []
+        return self.apply_gap(decision, determined)
+
+    # Same outcome as gap_filter: a decision is dropped when another one follows within the gap
+    def apply_gap(self, decision, determined):
+        if self.gap <= 0:
+            self.final_pos = determined.pos
+            return [] if decision is None else [decision]
+
+        final = []
+        if decision is not None:
+            if self.pending is not None and not self.within_gap(self.pending, decision):
+                final.append(self.pending)
+            self.pending = decision
+        # Any later decision is on a bar after the determined one, so out of the pending decision's gap
+        if self.pending is not None and (determined.date - self.pending.date >= self.cooldown if self.calendar_gap
+                                         else determined.pos + 1 - self.pending.pos > self.gap):
+            final.append(self.pending)
+            self.pending = None
+        self.final_pos = determined.pos if self.pending is None else self.pending.pos - 1
+        return final
+
+    def within_gap(self, first, second):
+        if self.calendar_gap:
+            return second.date - first.date <= self.cooldown
+        return second.pos - first.pos <= self.gap
+
+    # Decisions held back at the end of the history (ie: end of a replay), which the gap keeps
+    def flush(self):
+        final = [] if self.pending is None else [self.pending]
+        self.pending = None
+        return final
+
+
+# Running balances of pnl_calc, one decision date at a time. Open segments (buys not yet closed by a sell) are
+# left unrounded as with pnl_calc on the history so far; a sell rounds & carries the segment as ledger_balances does.
+class LedgerStream:
+
+    def __init__(self, trade_size, allow_fractional=True, sell_all=True):
+        self.trade_size = trade_size
+        self.allow_fractional = allow_fractional
+        self.sell_all = sell_all
+        self.shares, self.basis, self.cash, self.realized = 0.0, 0.0, 0.0, 0.0  # Carried into the open segment
+        self.bought, self.worth, self.has_buys = 0.0, 0.0, False  # Buys of the open segment
+        self.started = False  # Sells prior to the first buy are ignored
+        self.last_row = None
+        self.trades = ledger.TradeLedger()  # Every booked row
+
+    def trade_amount(self, price):
+        amount = self.trade_size / price
+        return amount if self.allow_fractional else max(int(amount), 1)  # Buy/Sell 1 Share at minimum.
+
+    # Books the buy & sell decisions of one date (a sell overrides a buy on the same date).
+    # Returns the ledger row, None when nothing was traded (ie: excess sells).
+    def trade(self, buy=None, sell=None):
+        self.started = self.started or buy is not None
+        if sell is not None and self.started:
+            return self.sell(sell)
+        elif buy is not None:
+            return self.buy(buy)
+        return None
+
+    def buy(self, decision):
+        amount = self.trade_amount(decision.price)
+        self.bought += amount
+        self.worth += decision.price * amount
+        self.has_buys = True
+        balance = self.shares + self.bought
+        basis = (self.shares * self.basis + self.worth) / balance
+        return self.row(decision, ledger.BUY, amount, balance, basis)
+
+    def sell(self, decision):
+        sell_size = self.trade_amount(decision.price)
+        amount = 0.0
+        if self.has_buys:
+            held = self.shares + kernels.round_to(self.bought, 2)
+            self.basis = kernels.round_to((self.shares * self.basis + self.worth) / held, 4) if held != 0 else 0.0
+            amount = kernels.round_to(self.bought, 2) if self.sell_all else sell_size
+            self.shares = kernels.round_to(self.bought - amount, 2) + self.shares
+        elif not self.sell_all:
+            self.basis = self.basis if self.shares != 0 else 0.0
+            amount = self.shares if self.shares < sell_size else sell_size  # Limit sell to available balance
+            self.shares = kernels.round_to(-amount, 2) + self.shares
+        self.cash = kernels.round_to(
+            self.cash + kernels.round_to(abs(kernels.round_to(amount, 2)) * decision.price, 2), 2)
+        self.realized += (decision.price - self.basis) * amount
+        self.bought, self.worth, self.has_buys = 0.0, 0.0, False
+        return self.row(decision, ledger.SELL, -amount, self.shares, self.basis)
+
+    def row(self, decision, side, share_diff, balance, basis):
+        trade_value = kernels.round_to(share_diff * decision.price, 2)
+        if trade_value == 0:
+            return None
+        self.trades.append(decision.date, side, price=decision.price, share_diff=share_diff,
+                           closing_price=decision.close, share_balance=balance, cash_balance=self.cash,
+                           cost_basis=basis, trade_value=trade_value, rpnl=self.realized)
+        self.last_row = {'Date': decision.date,
+                         'Price': decision.price,
+                         'Decision': ledger.side_names[side],
+                         'Share Diff': share_diff,
+                         'Closing Price': decision.close,
+                         'Share Balance': balance,
+                         'Balance Value': decision.price * balance,
+                         'Cash Balance': self.cash,
+                         'Cost Basis': basis,
+                         'Trade Value': trade_value,
+                         'UPNL': (decision.price - basis) * balance,
+                         'RPNL': self.realized}
+        return self.last_row
+
+    # Valuation of the current balances at the latest close, as pnl_calc's closing statement
+    def closing_statement(self, date, close):
+        last = self.last_row or dict.fromkeys(trade_logic.pnl_columns, 0.0)
+        return {'Date': date,
+                'Price': close,
+                'Decision': 'Closing Statement',
+                'Share Diff': 0.0,
+                'Closing Price': close,
+                'Share Balance': last['Share Balance'],
+                'Balance Value': close * last['Share Balance'],
+                'Cash Balance': last['Cash Balance'],
+                'Cost Basis': last['Cost Basis'],
+                'Trade Value': 0.0,
+                'UPNL': (close - last['Cost Basis']) * last['Share Balance'],
+                'RPNL': last['RPNL']}
+
+
+# Buy & sell signals along with the ledger of one asset, with the same inputs as process_pnl_table.
+# update takes one bar at a time & returns the ledger rows booked with it.
+class StrategyStream:
+
+    def __init__(self, buy_strategy, sell_strategy, buy_ma_span_one=None, buy_ma_span_two=None, sell_ma_span_one=None,
+                 sell_ma_span_two=None, gap_days=0, sell_gap_days=0, buy_scaling=1.0, sell_scaling=1.0,
+                 start_date=None, trade_size=1, allow_fractional=False, sell_all=False, calendar_gap=False):
+
+        self.buy_signals = SignalStream(buy_strategy, True, spans=(buy_ma_span_one, buy_ma_span_two),
+                                        scaling=buy_scaling, gap=gap_days, calendar_gap=calendar_gap,
+                                        start=start_date)
+        self.sell_signals = SignalStream(sell_strategy, False, spans=(sell_ma_span_one, sell_ma_span_two),
+                                         scaling=sell_scaling, gap=sell_gap_days, calendar_gap=calendar_gap,
+                                         start=start_date)
+        self.ledger = LedgerStream(trade_size, allow_fractional=allow_fractional, sell_all=sell_all)
+        self.buys, self.sells = collections.deque(), collections.deque()
+        self.n_bars = 0
+        self.last_bar = None
+
+    def update(self, date, high, low, close):
+        bar = Bar(self.n_bars, pd.Timestamp(date), float(high), float(low), float(close))
+        self.n_bars += 1
+        self.last_bar = bar
+        self.buys.extend(self.buy_signals.update(bar))
+        self.sells.extend(self.sell_signals.update(bar))
+        return self.book(min(self.buy_signals.final_pos, self.sell_signals.final_pos))
+
+    # Books the final decisions up to bar position until, in date order
+    def book(self, until):
+        rows = []
+        while True:
+            buy = self.buys[0] if self.buys and self.buys[0].pos <= until else None
+            sell = self.sells[0] if self.sells and self.sells[0].pos <= until else None
+            if buy is None and sell is None:
+                return rows
+            pos = min(decision.pos for decision in [buy, sell] if decision is not None)
+            buy = self.buys.popleft() if buy is not None and buy.pos == pos else None
+            sell = self.sells.popleft() if sell is not None and sell.pos == pos else None
+            row = self.ledger.trade(buy=buy, sell=sell)
+            if row is not None:
+                rows.append(row)
+
+    # Books the decisions still held back by a gap, once no more bars will be added
+    def flush(self):
+        self.buys.extend(self.buy_signals.flush())
+        self.sells.extend(self.sell_signals.flush())
+        return self.book(self.n_bars)
+
+    def closing_statement(self):
+        return self.ledger.closing_statement(self.last_bar.date, self.last_bar.close)
+
+
+# Streams a whole history through a StrategyStream & returns the final ledger in pnl_calc's format
+def replay(history, **settings):
+
+    history = price_frame(history)
+    stream = StrategyStream(**settings)
+    for date, high, low, close in zip(history.index, history['High'].to_numpy(dtype=float),
+                                      history['Low'].to_numpy(dtype=float), history['Close'].to_numpy(dtype=float)):
+        stream.update(date, high, low, close)
+    stream.flush()
+
+    if not stream.ledger.started:
+        return pd.DataFrame(np.full((1, len(trade_logic.pnl_columns)), 0), columns=trade_logic.pnl_columns,
+                            index=[datetime.date.today()])
+    trades = stream.ledger.trades
+    trades = trades.take(trades.dates != stream.last_bar.date)
+    statement = stream.closing_statement()
+    trades.append(statement['Date'], ledger.CLOSE, price=statement['Price'], share_diff=0.0,
+                  closing_price=statement['Closing Price'], share_balance=statement['Share Balance'],
+                  cash_balance=statement['Cash Balance'], cost_basis=statement['Cost Basis'], trade_value=0.0,
+                  rpnl=statement['RPNL'])
+    return trades.to_frame()
@@ -0,0 +1,222 @@
+import itertools
+import numpy as np
+import pandas as pd
+from logic import analytics, kernels, signals, trade_logic
+from logic.price_history import price_frame
+
+# Inputs of process_pnl_table which can be swept, along with their process_pnl_table defaults
+sweep_defaults = {'buy_ma_span_one': None,
+                  'buy_ma_span_two': None,
+                  'sell_ma_span_one': None,
+                  'sell_ma_span_two': None,
+                  'buy_scaling': 1.0,
+                  'sell_scaling': 1.0,
+                  'gap_days': 0,
+                  'sell_gap_days': 0}
+
+result_columns = ['RPNL', 'UPNL', 'Cash Balance', 'Balance Value', 'Total Value', 'Trade Count']
+
+
+# Every combination of the provided parameter ranges ie: {'buy_ma_span_one': range(10, 100, 5), ...}
+def parameter_grid(param_ranges):
+    names = list(param_ranges.keys())
+    return pd.DataFrame(list(itertools.product(*[list(param_ranges[name]) for name in names])), columns=names)
+
+
+# n_samples combinations drawn independently from each parameter range. Seeded for reproducible sweeps.
+def random_parameters(param_ranges, n_samples, seed=None):
+    rng = np.random.default_rng(seed)
+    samples = {}
+    for name, values in param_ranges.items():
+        values = list(values)
+        samples[name] = [values[idx] for idx in rng.integers(0, len(values), size=n_samples)]
+    return pd.DataFrame(samples)
+
+
+# Grid sweep (n_samples=None) or random sweep of process_pnl_table over the parameter ranges.
+# Returns one row per combination with its final RPNL, UPNL, Total Value & Trade Count (& analytics.metric_columns
+# when metrics=True).
+def parameter_sweep(history, buy_strategy, sell_strategy, param_ranges, n_samples=None, seed=None, start_date=None,
+                    trade_size=1, allow_fractional=False, sell_all=False, calendar_gap=False, metrics=False):
+
+    params = parameter_grid(param_ranges) if n_samples is None else random_parameters(param_ranges, n_samples, seed)
+    return evaluate_parameters(history=history, buy_strategy=buy_strategy, sell_strategy=sell_strategy, params=params,
+                               start_date=start_date, trade_size=trade_size, allow_fractional=allow_fractional,
+                               sell_all=sell_all, calendar_gap=calendar_gap, metrics=metrics)
+
+
+# Evaluates a DataFrame of parameter combinations (columns named as in sweep_defaults).
+# Each distinct indicator is computed once (see signals.SignalGraph) through the shared indicator cache & only the
+# ledger runs per combination.
+# end_date closes the books on that bar, ignoring every later decision. events: from parameter_events, to reuse
+# the signals of a previous call on the same history (ie: over several date windows). metrics=True adds the
+# analytics.metric_columns of every combination's daily equity (NaN without trades).
+def evaluate_parameters(history, buy_strategy, sell_strategy, params, start_date=None, trade_size=1,
+                        allow_fractional=False, sell_all=False, calendar_gap=False, end_date=None, events=None,
+                        metrics=False):
+
+    history = price_frame(history)
+    params = with_defaults(params)
+    if events is None:
+        events = parameter_events(history, buy_strategy, sell_strategy, params, start_date=start_date)
+    buy_keys, sell_keys, buy_events, sell_events = events
+
+    start_pos = 0 if start_date is None else history.index.searchsorted(pd.to_datetime(start_date))
+    end_pos = len(history) - 1 if end_date is None else \
+        history.index.searchsorted(pd.to_datetime(end_date), side='right') - 1
+    closing_price = history['Close'].iloc[end_pos]
+    dates = history.index.to_numpy() if calendar_gap else None
+    buy_gap_applies, sell_gap_applies = signals.strategy(buy_strategy).gap, signals.strategy(sell_strategy).gap
+    buy_lookahead, sell_lookahead = decision_lookahead(buy_strategy), decision_lookahead(sell_strategy, False)
+    results = np.zeros((len(params), len(result_columns)))
+    metric_values = np.full((len(params) if metrics else 0, len(analytics.metric_columns)), np.nan)
+    close, bar_dates = history['Close'].to_numpy(dtype=float), history.index.to_numpy()
+    for row, (buy_key, sell_key, gap, sell_gap) in enumerate(zip(buy_keys, sell_keys, params['gap_days'],
+                                                                 params['sell_gap_days'])):
+        positions, ledger = combination_ledger(buy_events[buy_key], sell_events[sell_key],
+                                               gap=gap if buy_gap_applies else 0,
+                                               sell_gap=sell_gap if sell_gap_applies else 0,
+                                               start_pos=start_pos, end_pos=end_pos, dates=dates,
+                                               trade_size=trade_size, allow_fractional=allow_fractional,
+                                               sell_all=sell_all, buy_lookahead=buy_lookahead,
+                                               sell_lookahead=sell_lookahead)
+        if ledger is not None:
+            results[row] = closing_results(positions, ledger, closing_price, end_pos)
+            if metrics:
+                metric_values[row] = list(analytics.ledger_metrics(positions, ledger, close, bar_dates,
+                                                                   start_pos=start_pos, end_pos=end_pos).values())
+
+    results = pd.DataFrame(results, columns=result_columns)
+    results['Trade Count'] = results['Trade Count'].astype(int)
+    if metrics:
+        results = pd.concat([results, pd.DataFrame(metric_values, columns=analytics.metric_columns)], axis=1)
+    return pd.concat([params, results], axis=1)
+
+
+# result_columns values of a combination_ledger, valued at closing_price on the end_pos bar
+def closing_results(positions, ledger, closing_price, end_pos):
+    traded = np.flatnonzero(ledger['Trade Value'] != 0)
+    if len(traded) == 0:
+        return np.zeros(len(result_columns))
+    last = traded[-1]
+    share_balance, cost_basis = ledger['Share Balance'][last], ledger['Cost Basis'][last]
+    cash_balance = ledger['Cash Balance'][last]
+    balance_value = closing_price * share_balance
+    trade_count = len(traded) - (positions[last] == end_pos)  # Trades on the last bar become the closing statement
+    return (ledger['RPNL'][last], (closing_price - cost_basis) * share_balance, cash_balance,
+            balance_value, cash_balance + balance_value, trade_count)
+
+
+def with_defaults(params):
+    params = params.reset_index(drop=True)
+    for name, default in sweep_defaults.items():
+        if name not in params.columns:
+            params[name] = default
+    return params
+
+
+# Signal keys of every combination (one per row of params) along with the decision events of each distinct key:
+# (buy keys, sell keys, {buy key: (positions, prices)}, {sell key: (positions, prices)})
+def parameter_events(history, buy_strategy, sell_strategy, params, start_date=None):
+
+    fingerprint = signals.history_fingerprint(history)
+    history = price_frame(history)
+    params = with_defaults(params)
+
+    buy_used = signals.parameters(signals.strategy(buy_strategy), True)
+    sell_used = signals.parameters(signals.strategy(sell_strategy), False)
+    buy_keys = [signal_key(buy_used, *key) for key in
+                params[['buy_ma_span_one', 'buy_ma_span_two', 'buy_scaling']].itertuples(index=False)]
+    sell_keys = [signal_key(sell_used, *key) for key in
+                 params[['sell_ma_span_one', 'sell_ma_span_two', 'sell_scaling']].itertuples(index=False)]
+    buy_events = strategy_events(history, buy_strategy, True, set(buy_keys), fingerprint=fingerprint)
+    sell_events = strategy_events(history, sell_strategy, False, set(sell_keys), start=start_date,
+                                  fingerprint=fingerprint)
+    return buy_keys, sell_keys, buy_events, sell_events
+
+
+# Bars past a decision's own bar which it depends on: crossovers are dated on the bar before the cross
+def decision_lookahead(strategy, long_bool=True):
+    return signals.lookahead(signals.strategy(strategy), long_bool)
+
+
+# Time ordered trades of one combination between the start_pos & end_pos bars, along with their ledger_balances
+# (None when nothing is bought). Decisions relying on bars past end_pos are dropped before the gaps apply,
+# so none of them can cancel an earlier one.
+def combination_ledger(buy_events, sell_events, gap, sell_gap, start_pos, end_pos, trade_size, dates=None,
+                       allow_fractional=False, sell_all=False, buy_lookahead=0, sell_lookahead=0):
+
+    buy_pos, buy_price = buy_events
+    until_end = buy_pos + buy_lookahead <= end_pos
+    buy_pos, buy_price = buy_pos[until_end], buy_price[until_end]
+    if gap > 0:
+        buy_pos, buy_price = gap_filter(buy_pos, buy_price, gap, dates)
+    from_start = buy_pos >= start_pos
+    buy_pos, buy_price = buy_pos[from_start], buy_price[from_start]
+    if len(buy_pos) == 0:
+        return None, None
+
+    sell_pos, sell_price = sell_events
+    until_end = sell_pos + sell_lookahead <= end_pos
+    sell_pos, sell_price = sell_pos[until_end], sell_price[until_end]
+    if sell_gap > 0:
+        sell_pos, sell_price = gap_filter(sell_pos, sell_price, sell_gap, dates)
+    proper_sells = sell_pos >= buy_pos[0]
+    sell_pos, sell_price = sell_pos[proper_sells], sell_price[proper_sells]
+    distinct_buys = ~np.isin(buy_pos, sell_pos)
+    buy_pos, buy_price = buy_pos[distinct_buys], buy_price[distinct_buys]
+
+    positions = np.concatenate([buy_pos, sell_pos])
+    order = np.argsort(positions, kind='stable')
+    is_sell = np.concatenate([np.zeros(len(buy_pos), dtype=bool), np.ones(len(sell_pos), dtype=bool)])[order]
+    ledger = kernels.ledger_balances(np.concatenate([buy_price, sell_price])[order], is_sell, trade_size,
+                                         allow_fractional=allow_fractional, sell_all=sell_all)
+    return positions[order], ledger
+
+
+# Reduces the swept inputs of one side to the ones its strategy actually uses (used: signals.parameters of the
+# side), so combinations share signals.
+def signal_key(used, span_one, span_two, scaling):
+    return tuple(value if name in used else None
+                 for name, value in zip(signals.parameter_names, [span_one, span_two, scaling]))
+
+
+# Same as get_trades' gap: a decision is dropped when another one follows within gap bars,
+# or within gap calendar days when the bar dates are provided.
+def gap_filter(positions, prices, gap, dates=None):
+    if dates is None:
+        keep = kernels.gap_mask(positions, gap)
+    else:
+        keep = kernels.gap_mask(dates[positions], pd.Timedelta(days=gap).to_timedelta64())
+    return positions[keep], prices[keep]
+
+
+# Returns {signal key: (bar positions, decision prices)} for every key of one side of the trade.
+# The rules of every key go into one signal graph, so each distinct indicator is computed once for all of them.
+def strategy_events(history, strategy, long_bool, keys, start=None, fingerprint=None):
+
+    spec = signals.strategy(strategy)
+    start_pos = 0 if start is None else history.index.searchsorted(pd.to_datetime(start))
+    empty = (np.array([], dtype=int), np.array([], dtype=float))
+
+    if not signals.trades(spec, long_bool):
+        return {key: empty for key in keys}
+    elif spec.function is not None:
+        decision, trade_point, _ = trade_logic.get_trades(asset_data=history, long_bool=long_bool, strategy=strategy,
+                                                          start=start)
+        trade_dates = decision.index[decision == 1]
+        events = (history.index.get_indexer(trade_dates), trade_point.loc[trade_dates].to_numpy(dtype=float))
+        return {key: events for key in keys}
+
+    # Keys sharing spans next to each other, so their indicators are dropped as soon as possible
+    keys = sorted(keys, key=lambda key: tuple(-1 if value is None else value for value in key))
+    graph = signals.SignalGraph()
+    roots = [graph.side(spec, long_bool, signals.bindings(key[:2], key[2])) for key in keys]
+    values = graph.evaluate([node for side in roots for node in side], history, fingerprint)
+
+    events = {}
+    for key in keys:
+        positions, prices = kernels.decision_events(next(values), next(values))
+        from_start = positions >= start_pos
+        events[key] = (positions[from_start], prices[from_start])
+    return events
@@ -0,0 +1,124 @@
+import re
+import numpy as np
+import pandas as pd
+from logic import indicators
+from logic.price_history import PriceHistory, price_frame
+
+# Weekly, monthly & custom N-day bars built from the daily history, so signals can run at any timeframe. A bar
+# aggregates a run of daily bars (first Open, highest High, lowest Low, last Close, summed Volume) & is dated on its
+# last daily bar, so its decisions & lines land on daily dates as they are: a weekly signal is on the week's last
+# trading day. Calendar timeframes group the daily bars by pandas period, N-day bars by position from the first bar.
+
+# Timeframes of the app: pandas period aliases (ie: 'W', 'M', 'Q', 'W-FRI') or 'ND' for bars of N daily bars
+timeframe_names = {'Daily': 'D', 'Weekly': 'W', 'Monthly': 'M', 'Quarterly': 'Q'}
+
+# Columns of the bars, Volume only when the daily history has it
+bar_columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# Bars shared by both sides of a trade & across reruns, keyed on (daily history fingerprint, timeframe)
+bar_cache = indicators.IndicatorCache(max_bytes=64 * 2 ** 20)
+
+
+# ('days', N) for 'ND' (& daily: 'D' or None), ('period', alias) for calendar timeframes
+def parse_timeframe(timeframe):
+    if timeframe is None:
+        return 'days', 1
+    match = re.fullmatch(r'(\d*)D', timeframe.upper())
+    if match and int(match.group(1) or 1) > 0:
+        return 'days', int(match.group(1) or 1)
+    try:
+        multiple = pd.Period('2000-01-01', freq=timeframe).freq.n
+    except ValueError:
+        multiple = None
+    if multiple != 1:
+        raise ValueError(f'Unknown timeframe {timeframe}, expected a period alias (ie: W, M, Q) or N days (ie: 3D)')
+    return 'period', timeframe
+
+
+# True when timeframe aggregates daily bars
+def resampled(timeframe):
+    return parse_timeframe(timeframe) != ('days', 1)
+
+
+# Position of the first daily bar of every bar. offset: daily bars preceding dates[0] in the full history, as N-day
+# bars count from its first bar (a tail of the history then resamples into the same bars).
+def bar_starts(dates, timeframe, offset=0):
+    kind, value = parse_timeframe(timeframe)
+    if len(dates) == 0:
+        return np.zeros(0, dtype=int)
+    if kind == 'days':
+        first = -offset % value
+        return np.append(0, np.arange(first, len(dates), value)) if first else np.arange(0, len(dates), value)
+    periods = pd.DatetimeIndex(dates).to_period(value).asi8
+    return np.flatnonzero(np.diff(periods, prepend=periods[0] - 1))
+
+
+# OHLC bars (& Volume, when history has it) of history at timeframe, dated on their last daily bar.
+# Daily timeframes return history as is.
+def resample(history, timeframe, offset=0):
+    history = price_frame(history)
+    if not resampled(timeframe):
+        return history
+
+    columns = [column for column in bar_columns if column in history]
+    if len(history) == 0:
+        return history[columns]
+    starts = bar_starts(history.index, timeframe, offset)
+    ends = np.append(starts[1:], len(history)) - 1
+    aggregates = {'Open': lambda values: values[starts],
+                  'High': lambda values: np.fmax.reduceat(values, starts),  # fmax/fmin skip missing prices
+                  'Low': lambda values: np.fmin.reduceat(values, starts),
+                  'Close': lambda values: values[ends],
+                  'Volume': lambda values: np.add.reduceat(np.nan_to_num(values), starts)}
+    bars = pd.DataFrame({column: aggregates[column](history[column].to_numpy()) for column in columns},
+                        index=history.index[ends])
+    bars.name = getattr(history, 'name', None)
+    return bars
+
+
+# Bars of asset_data (PriceHistory or DataFrame) at timeframe as a read-only PriceHistory, through bar_cache
+def price_bars(asset_data, timeframe):
+
+    def compute():
+        history = price_frame(asset_data)
+        return PriceHistory.from_frame(resample(history, timeframe), float32=history['Close'].dtype == np.float32)
+
+    return bar_cache.get((indicators.history_fingerprint(asset_data, PriceHistory.columns), timeframe), compute)
+
+
+# Bars of timeframe from a daily history, reusing the previously resampled bars (cached): only the bars from the
+# last cached one onwards (it may have been partial) are resampled again. Everything is resampled when the cached
+# bars no longer line up with history (ie: adjusted prices, or N-day bars counted from another first bar).
+def update_bars(cached, history, timeframe):
+    history = price_frame(history)
+    if cached is None or len(cached) < 2:
+        return resample(history, timeframe)
+
+    kept = cached.iloc[:-1]
+    last_pos = history.index.get_indexer(kept.index[-1:])[0]
+    kind, value = parse_timeframe(timeframe)
+    lined_up = last_pos >= 0 and history['Close'].iloc[last_pos] == kept['Close'].iloc[-1] and \
+        (kind == 'period' or (last_pos + 1) % value == 0) and \
+        list(kept.columns) == [column for column in bar_columns if column in history]
+    if not lined_up:
+        return resample(history, timeframe)
+
+    tail = resample(history.iloc[last_pos + 1:], timeframe, offset=last_pos + 1)
+    bars = pd.concat([kept, tail])
+    bars.name = getattr(history, 'name', None)
+    return bars
+
+
+# Series on bars (ie: decisions, MA lines) on the daily dates of daily_index: decisions get fill_value between the
+# bars, lines (fill_value=None) keep their latest bar's value
+def to_daily(series, daily_index, fill_value=None):
+    if fill_value is not None:
+        return series.reindex(daily_index, fill_value=fill_value)
+    return series.reindex(daily_index, method='ffill')
+
+
+# Daily bars from each decision (on the dates of its bar in bar_index) to the close of the bar lookahead bars later,
+# the lookahead of execution.fill_events in daily bars for decisions made on bars
+def daily_lookahead(daily_index, bar_index, dates, lookahead=1):
+    known = np.minimum(bar_index.searchsorted(dates) + lookahead, len(bar_index) - 1)
+    return daily_index.get_indexer(bar_index[known]) - daily_index.get_indexer(dates)
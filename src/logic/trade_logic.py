@@ -1,218 +1,351 @@
 import pandas as pd
 import numpy as np
+import calendar
 import datetime
-import streamlit as st
-
-# Returns simple moving average with provided span
-def sma_line(series, span=None):
-    if span is None:
-        span = 200
-    return series.rolling(window=span).mean()
-
-# Returns exponentially weighed average based on provided span
-def ema_line(series, span=None):
-    if span is None:
-        span = 25
-    return series.ewm(span).mean()
-
-strategies = {'Hold/None': None,
-              'On SMA': sma_line,
-              'On EMA': ema_line,
-              'On SMA Crossover': sma_line,
-              'On EMA Crossover': ema_line,
-              'TD Countdown': None}
+import itertools
+import logging
+from logic import adjustments, execution as trade_execution, kernels, ledger as trade_ledger, signals, timeframes
+from logic.instrumentation import timed
+from logic.price_history import price_frame
+
+logger = logging.getLogger(__name__)
 
 interval_strategy = {'Weekly': 1,
                  'Bi-Monthly': 2,
                  'Monthly': 4}
 
+# strategy: name of a strategy in signals.strategies, or a rule (see signals) traded on both sides
 # Gap prevents buys/sells within small timeframes. ie: Gap of 7 = maximum of a weekly buy frequency
-# Returns boolean series with Buy=1, No Buy=0 along with Respective Moving Average(s)
-def get_trades(asset_data, long_bool, strategy, gap=0, spans=(None), scaling=1, start=None):
-
-
+# Gap is counted in bars, or calendar days when calendar_gap=True
+# timeframe: bars the signals run on (see timeframes), decisions & lines are returned on the daily dates
+# Returns boolean series with Buy=1, No Buy=0 along with the strategy's lines (ie: its moving averages)
+@timed('get_trades', count=lambda result: {'bars': len(result[0]), 'decisions': int((result[0] == 1).sum())})
+def get_trades(asset_data, long_bool, strategy, gap=0, spans=(None), scaling=1, start=None, calendar_gap=False,
+               timeframe=None):
+
+    spec = signals.strategy(strategy)
+    if spec.function is None and signals.trades(spec, long_bool) and timeframes.resampled(timeframe):
+        daily = price_frame(asset_data)
+        decision, trade_point, ma_dict = get_trades(timeframes.price_bars(asset_data, timeframe), long_bool, strategy,
+                                                    gap=gap, spans=spans, scaling=scaling, start=start,
+                                                    calendar_gap=calendar_gap)
+        daily_dates, daily_index = daily.loc[start:].index, daily.index
+        return (timeframes.to_daily(decision, daily_dates, fill_value=0),
+                timeframes.to_daily(trade_point, daily_dates),
+                {name: timeframes.to_daily(line, daily_index) for name, line in ma_dict.items()})
+
+    if not signals.trades(spec, long_bool):
+        return pd.Series(dtype=float), pd.Series(dtype=float), {}
+    elif spec.function is not None:
+        decision, trade_point = spec.function(price_frame(asset_data), long_bool=long_bool, start_date=start,
+                                              timeframe=timeframe)
+        return decision, trade_point, {}
+
+    # Decisions, trade prices & lines evaluated together, sharing their indicators
+    fingerprint = signals.history_fingerprint(asset_data)
+    asset_data = price_frame(asset_data)
     start = asset_data.index[0] if start is None else start
-    ma_dict = {}
-    if 'Hold' in strategy:
-        return pd.Series(dtype=float), pd.Series(dtype=float), ma_dict
-    elif strategy in ['On SMA', 'On EMA']:
-        ma_type = strategy.split('On ')[-1]
-        trade_func = strategies.get(strategy)
-        trade_bound = (asset_data['High'] if long_bool else asset_data['Low']).loc[start:]
-        trade_point = (trade_func(asset_data['Close'], span=spans[0]) * scaling).loc[start:] # Buy/Sell on the MA line
-        crossover_line = get_crossover_point(trade_bound, trade_point, upward=long_bool)
-        ma_dict = {f'{ma_type} ({spans[0]})': trade_point}
-
-
-    elif strategy in ['On SMA Crossover', 'On EMA Crossover']:
-        ma_type = strategy.split(' Crossover')[0].split('On ')[-1]
-        trade_func = strategies.get(strategy)
-        ma_one = trade_func(asset_data['Close'], span=spans[0])
-        ma_two = trade_func(asset_data['Close'], span=spans[1])
-        crossover_line = get_crossover_point(ma_one, ma_two, upward=long_bool).loc[start:]
-        trade_point = asset_data.loc[crossover_line.index, 'Close']
-        ma_dict = {f'{ma_type} ({spans[0]})': ma_one, f'{ma_type} ({spans[1]})': ma_two}
-
-    elif strategy == 'TD Countdown':
-        decision, trade_point = td_strategy(td_df=asset_data, long_bool=long_bool, start_date=start)
-        return decision, trade_point, ma_dict
+    graph = signals.SignalGraph()
+    parameters = signals.bindings(spans, scaling)
+    lines = graph.lines(spec, parameters)
+    values = graph.evaluate([*graph.side(spec, long_bool, parameters), *lines.values()], asset_data, fingerprint)
+    crossover_line = pd.Series(next(values).astype(int), index=asset_data.index).loc[start:]
+    trade_point = pd.Series(next(values), index=asset_data.index).loc[start:]
+    ma_dict = {label: pd.Series(line, index=asset_data.index) for label, line in zip(lines, values)}
 
     if gap > 0:
-        new_line = [value if (value == 1 and (1 != crossover_line.values[idx + 1: idx + gap + 1]).all())
-                    else 0 for idx, value in zip(range(0, len(crossover_line)), crossover_line.values)]
-        crossover_line = pd.Series(data=new_line,
-                                   index=crossover_line.index)
+        crossover_line = gap_filter(crossover_line, gap, calendar_gap=calendar_gap)
 
     return crossover_line, trade_point, ma_dict
 
 
-# Returns series of  0, 1 values. 1 = series_one crosses series two, 0 = No Cross
-# Series one should be of a lower span than series two.
-def get_crossover_point(series_one, series_two, upward=True):
-
-    if upward:
-        cross_series = ((series_one < series_two) & (series_one.shift(-1) > series_two.shift(-1))).astype(int)
+# Keeps a decision (1) only when no other decision follows within gap bars (calendar days if calendar_gap).
+# Only the decision positions are compared, so it is O(n) regardless of the gap.
+def gap_filter(decision, gap, calendar_gap=False):
+    trades = np.flatnonzero(decision.to_numpy() == 1)
+    if calendar_gap:
+        keep = kernels.gap_mask(decision.index.to_numpy()[trades], pd.Timedelta(days=gap).to_timedelta64())
     else:
-        cross_series = ((series_one > series_two) & (series_one.shift(-1) < series_two.shift(-1))).astype(int)
+        keep = kernels.gap_mask(trades, gap)
+    filtered = np.zeros(len(decision), dtype=int)
+    filtered[trades[keep]] = 1
+    return pd.Series(data=filtered, index=decision.index)
+
 
-    return cross_series
+# Decision prices (the trade point on each decision bar) as pnl_calc takes them, without full length temporaries
+def decision_series(decision, trade_point):
+    if not trade_point.index.equals(decision.index):
+        trade_point = trade_point.reindex(decision.index)  # ie: TD Countdown prices also cover the bars before start
+    positions, prices = kernels.decision_events(decision.to_numpy(), trade_point.to_numpy(dtype=float))
+    return pd.Series(prices, index=decision.index[positions])
 
 
 # Logic for a naive buying strategy on a specific weekday at certain intervals.
 # If the buy amount is < share price, the share quantity bought will be 1. Assumes no fractional shares.
-def dca_buy_report(asset_data, weekday, strategy, interval, usd_buy_amount, allow_fractional=False):
-
-    buy_dates = asset_data.index[asset_data.index.weekday == weekday][::interval]
-    buy_df = asset_data.loc[buy_dates, ['Open', 'Close']]
-
-    prelim_share_amount = (usd_buy_amount / buy_df[strategy])
-    buy_df['Shares Bought'] = prelim_share_amount if allow_fractional else prelim_share_amount.astype(int).replace(0, 1)
-    buy_df['Share Balance'] = buy_df['Shares Bought'].cumsum()
-    if not allow_fractional:
-        buy_df['Share Balance'] = buy_df['Share Balance'].astype(int)
-    buy_df['Cost Basis'] = (buy_df['Shares Bought'] * buy_df[strategy]).cumsum() / buy_df['Share Balance']
-    buy_df['Cumulative Spend'] = (buy_df['Shares Bought'] * buy_df[strategy]).cumsum()
-    buy_df = asset_data.merge(buy_df.drop(['Open', 'Close'], axis=1),
-                              how='left', left_index=True, right_index=True)
-
-    fill_cols = ['Share Balance', 'Cost Basis', 'Cumulative Spend']
-    buy_df.loc[:, fill_cols] = buy_df.loc[:, fill_cols].fillna(method='ffill')
-    buy_df.fillna(0, inplace=True)
-
-    buy_df['Unrealized PNL'] = buy_df['Share Balance'] * (buy_df['Close'] - buy_df['Cost Basis'])
-    buy_df['Value'] = buy_df['Share Balance'] * buy_df['Close']
-    buy_df['ROE %'] = (buy_df['Value'] / buy_df['Cumulative Spend'] - 1) * 100
-
-    buy_df = buy_df.drop(['Low', 'High', 'Open', 'Volume', 'Dividends', 'Stock Splits'], axis=1).fillna(0)
+# dividends: per share Dividends by ex-date (adjustments.adjust_history's), paid out or reinvested (drip) as in
+# dca_balances
+@timed('dca_buy_report')
+def dca_buy_report(asset_data, weekday, strategy, interval, usd_buy_amount, allow_fractional=False, dividends=None,
+                   drip=False):
+
+    asset_data = price_frame(asset_data)
+    _, buy_days, shares_bought, buy_price = dca_purchases(asset_data, [weekday], [interval], [strategy],
+                                                          [usd_buy_amount], allow_fractional=allow_fractional)
+    paid = None if dividends is None else adjustments.dividends_on(dividends, asset_data.index)
+    balances = dca_balances(shares_bought, buy_price, asset_data['Close'].to_numpy(dtype=float), dividends=paid,
+                            drip=drip)
+    buy_df = pd.DataFrame({'Close': asset_data['Close'], 'Shares Bought': shares_bought[0],
+                           **{column: values[0] for column, values in balances.items()}}, index=asset_data.index)
+    buy_dates = asset_data.index[buy_days[0]]
 
     return buy_df, buy_dates
 
-# See https://oxfordstrat.com/indicators/td-sequential-3/ for more details on TD implementation
-# Not implemented: Countdown Cancellation & Recycling
-def td_strategy(td_df, long_bool=True, start_date=None):
-
-    def td_setup_func(bool_arr):
-        # O(n) loop. Could likely improve on complexity, but am unsure how.
-        new_arr = list()
-        count = 0
-
-        for obs in bool_arr:
-            if obs == True:
-                count = count + 1
-            else:
-                count = 0
-            new_arr.append(count)
-        return new_arr
-
-    def td_countdown_func(bool_arr):
-        # O(n) loop. Could likely improve on complexity, but am unsure how.
-        new_arr = list()
-        count = 0
-
-        for obs in bool_arr:
-            if obs == True:
-                count = count + 1
-                new_arr.append(count)
-            else:
-                new_arr.append(np.nan)
-        return new_arr
-
-
-    start_date = td_df.index[0] if start_date is None else start_date
-    close_df = td_df['Close'].to_numpy()
-    countdown_df = td_df[['Close', 'Low', 'High']]
 
-    # Boolean of TD; greater/lesser than last 4 closes.
-    if long_bool:
-        td_setup = np.append(np.full(4, np.nan),
-                               [(close_df[idx] < close_df[idx - 4]) for idx in range(4, len(close_df))])
+# Every weekday x interval x Open/Close x purchase amount DCA schedule evaluated at once.
+# Returns a summary with one row per schedule (final balances, ROE %) & the schedules' daily Value (equity curves).
+# dividends & drip: as in dca_buy_report
+@timed('dca_schedules')
+def dca_schedules(asset_data, weekdays=range(5), intervals=interval_strategy.values(), strategies=('Open', 'Close'),
+                  usd_buy_amounts=(250,), allow_fractional=False, dividends=None, drip=False):
+
+    asset_data = price_frame(asset_data)
+    schedules, buy_days, shares_bought, buy_price = dca_purchases(asset_data, weekdays, intervals, strategies,
+                                                                  usd_buy_amounts, allow_fractional=allow_fractional)
+    paid = None if dividends is None else adjustments.dividends_on(dividends, asset_data.index)
+    balances = dca_balances(shares_bought, buy_price, asset_data['Close'].to_numpy(dtype=float), dividends=paid,
+                            drip=drip)
+
+    interval_names = {interval: name for name, interval in interval_strategy.items()}
+    schedules['Weekday'] = [calendar.day_name[weekday] for weekday in schedules['Weekday']]
+    schedules['Interval'] = [interval_names.get(interval, interval) for interval in schedules['Interval']]
+    summary = schedules.assign(Purchases=buy_days.sum(axis=1),
+                               **{column: values[:, -1] for column, values in balances.items()})
+    equity_curves = pd.DataFrame(balances['Value'].T, index=asset_data.index,
+                                 columns=pd.MultiIndex.from_frame(schedules))
+    return summary, equity_curves
+
+
+# Shares bought on each bar, with one row per schedule in (weekday, interval, strategy, amount) product order.
+# A schedule buys on every interval-th occurence of its weekday, at the Open or Close (strategy).
+def dca_purchases(asset_data, weekdays, intervals, strategies, usd_buy_amounts, allow_fractional=False):
+
+    schedules = pd.DataFrame(list(itertools.product(weekdays, intervals, strategies, usd_buy_amounts)),
+                             columns=['Weekday', 'Interval', 'Time', 'Amount'])
+    bar_weekday = asset_data.index.weekday.to_numpy()
+    occurence = np.zeros(len(bar_weekday), dtype=int)  # 0 for the first Monday, 1 for the second...
+    for weekday in np.unique(bar_weekday):
+        occurence[bar_weekday == weekday] = np.arange((bar_weekday == weekday).sum())
+
+    buy_days = (bar_weekday == schedules['Weekday'].to_numpy()[:, None]) & \
+               (occurence % schedules['Interval'].to_numpy()[:, None] == 0)
+    price_arrays = {strategy: asset_data[strategy].to_numpy(dtype=float) for strategy in set(strategies)}
+    buy_price = np.stack([price_arrays[strategy] for strategy in schedules['Time']])
+    shares_bought = schedules['Amount'].to_numpy(dtype=float)[:, None] / buy_price
+    if not allow_fractional:
+        shares_bought = np.maximum(shares_bought.astype(int), 1)  # Buy 1 Share at minimum.
+    shares_bought = np.where(buy_days, shares_bought, 0.0)
+    return schedules, buy_days, shares_bought, buy_price
+
+
+# Running DCA balances from the shares bought on each bar (schedules x bars), 0 until the first purchase.
+# dividends: per share dividend of each bar (adjustments.dividends_on), paid on the shares held before it (Dividend
+# Income, counted in the ROE %) or reinvested at its close when drip=True, where they add to the cost basis.
+def dca_balances(shares_bought, buy_price, close, dividends=None, drip=False):
+    if dividends is not None and drip:
+        growth = adjustments.drip_factor(dividends, close)  # Shares compound at every ex-date
+        share_balance = np.cumsum(shares_bought / growth, axis=1) * growth
     else:
-        td_setup = np.append(np.full(4, np.nan),
-                                [(close_df[idx] > close_df[idx - 4]) for idx in range(4, len(close_df))])
-
-    # Gather the setups to calculate the countdowns thereafter
-    setup_count = pd.Series(td_setup_func(td_setup), index=td_df.index)
-    td_nines = setup_count.index[setup_count == 9]
+        share_balance = np.cumsum(shares_bought, axis=1)
+    cumulative_spend = np.cumsum(shares_bought * buy_price, axis=1)
+    income = np.zeros_like(share_balance)
+    if dividends is not None:
+        income[:, 1:] = np.cumsum(share_balance[:, :-1] * dividends[1:], axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cost_basis = np.nan_to_num((cumulative_spend + income if drip else cumulative_spend) / share_balance)
+        value = share_balance * close
+        roe = np.nan_to_num(((value if drip else value + income) / cumulative_spend - 1) * 100)
+    balances = {'Share Balance': share_balance,
+                'Cost Basis': cost_basis,
+                'Cumulative Spend': cumulative_spend,
+                'Unrealized PNL': share_balance * (close - cost_basis),
+                'Value': value,
+                'ROE %': roe}
+    if dividends is not None:
+        balances['Dividend Income'] = income
+    return balances
 
-    # Calculate Countdowns until 35 days after start or next TD 9 setup, whichever comes first.
-    countdown_list = list()
-    for idx in range(0, len(td_nines)):
-        start = td_nines[idx]
-        start_idx = td_df.index[td_df.index.get_loc(start) - 2]
+# See https://oxfordstrat.com/indicators/td-sequential-3/ for more details on TD implementation
+# A countdown starts on bar 9 of a TD Setup & lasts until 35 days after setup bar 7, unless:
+#   Recycled: a new setup in the same direction completes, which restarts the countdown
+#   Cancelled: a setup in the opposite direction completes, or price trades entirely beyond the
+#              setup's extreme (a low above the setup's highest high for buys, vice versa for sells)
+# Bar 13 must meet the qualifier (vs. the close of bar 8 & the low/high of bar 11), otherwise the
+# signal is deferred to the next countdown bar which does.
+# timeframe: bars the setups & countdowns are counted on (see timeframes), the countdown window is stretched by the
+# daily bars per bar so it spans as many bars as on daily bars. Decisions are returned on the daily dates.
+@timed('td_strategy', count=lambda result: {'bars': len(result[0]), 'decisions': int(result[0].sum())})
+def td_strategy(td_df, long_bool=True, start_date=None, countdown_days=35, timeframe=None):
+
+    td_df = price_frame(td_df)
+    if timeframes.resampled(timeframe):
+        bars = timeframes.price_bars(td_df, timeframe)
+        decision, trade_point = td_strategy(bars, long_bool=long_bool, start_date=start_date,
+                                            countdown_days=countdown_days * len(td_df) / max(len(bars), 1))
+        return (timeframes.to_daily(decision, td_df.loc[start_date:].index, fill_value=0),
+                timeframes.to_daily(trade_point, td_df.index))
 
-        if idx + 1 == len(td_nines):
-            end = start_idx + datetime.timedelta(days=35)
+    start_date = td_df.index[0] if start_date is None else start_date
+    close, low, high = (td_df[column].to_numpy(dtype=float) for column in ['Close', 'Low', 'High'])
+    n_bars = len(close)
+    bar_idx = np.arange(n_bars)
+
+    # Setup bar 9 of each run of closes lower/higher than the close 4 bars prior
+    def setup_nines(setup_bool):
+        run_start = np.maximum.accumulate(np.where(setup_bool, -1, bar_idx))
+        return np.flatnonzero(bar_idx - run_start == 9)
+
+    lower_close, higher_close = np.zeros(n_bars, dtype=bool), np.zeros(n_bars, dtype=bool)
+    lower_close[4:] = close[4:] < close[:-4]
+    higher_close[4:] = close[4:] > close[:-4]
+    td_nines = setup_nines(lower_close if long_bool else higher_close)
+    opposite_nines = np.append(setup_nines(higher_close if long_bool else lower_close), n_bars)
+
+    # Countdown bars close below the low (above the high) of 2 bars prior, they need not be consecutive
+    countdown_bool = np.zeros(n_bars, dtype=bool)
+    countdown_bool[2:] = (close[2:] < low[:-2]) if long_bool else (close[2:] > high[:-2])
+    countdown_bars = np.flatnonzero(countdown_bool)
+
+    window_end = td_df.index.searchsorted(td_df.index[td_nines - 2] + datetime.timedelta(days=countdown_days + 1),
+                                          side='right')
+    recycle = np.append(td_nines, n_bars)[1:]  # Next setup 9 (none past the last)
+    opposite = opposite_nines[np.searchsorted(opposite_nines, td_nines)]
+
+    thirteens = []
+    for nine, end in zip(td_nines, np.minimum.reduce([window_end, recycle, opposite])):
+        setup_bars = slice(nine - 8, nine + 1)
+        if long_bool:
+            beyond_setup = np.flatnonzero(low[nine + 1: end] > high[setup_bars].max())
         else:
-            end = min(td_nines[idx + 1], start_idx + datetime.timedelta(days=35))
+            beyond_setup = np.flatnonzero(high[nine + 1: end] < low[setup_bars].min())
+        if len(beyond_setup) > 0:
+            end = nine + 1 + beyond_setup[0]
 
-        countdown_span = countdown_df.loc[start_idx:end + datetime.timedelta(days=1)]
+        countdown = countdown_bars[np.searchsorted(countdown_bars, nine): np.searchsorted(countdown_bars, end)]
+        if len(countdown) < 13:
+            continue
 
+        # Ensure TD Countdown meets Qualifier Criteria
+        eight_close, eleven_bound = close[countdown[7]], (low if long_bool else high)[countdown[10]]
+        candidates = countdown[12:]
         if long_bool:
-            td_countdown = [(countdown_span.loc[:, 'Close'][idx] < countdown_span.loc[:, 'Low'][idx - 2])
-                              for idx in range(2, len(countdown_span))]
+            qualified = (low[candidates] <= eight_close) & (close[candidates] <= eleven_bound)
         else:
-            td_countdown = [(countdown_span.loc[:, 'Close'][idx] > countdown_span.loc[:, 'High'][idx - 2])
-                            for idx in range(2, len(countdown_span))]
-        countdown_list.append(pd.Series(td_countdown_func(td_countdown), index=countdown_span.index[2:]))
-
-    countdowns = pd.concat(countdown_list).dropna()
-    countdowns = countdowns.loc[~countdowns.index.duplicated('first')].loc[start_date:]
-    td_thirteens = countdowns.loc[countdowns==13]
-    # Ensure TD Countdown meets Qualifier Criteria
-    comparison_col = 'Low' if long_bool else 'High'
-    prior_date = countdowns.index[0]
-    for thirteen_date in td_thirteens.index:
-        until_date = countdowns.index[countdowns.index.get_loc(thirteen_date) + 1]
-        countdown_subset = countdowns[prior_date:until_date]
-        thirteen_idx = td_df.index.get_loc(thirteen_date)
-        thirteen_low = td_df.loc[thirteen_date, comparison_col]
-        thirteen_close = td_df.loc[thirteen_date, 'Close']
-
-        eight_indices = countdown_subset.index[countdown_subset == 8]
-        eleven_indices = countdown_subset.index[countdown_subset == 11]
-
-        if eight_indices.shape[0] > 0 and eleven_indices.shape[0] > 0:
-            eight_close = td_df.loc[eight_indices[-1], 'Close']
-            eleven_low = td_df.loc[eleven_indices[-1], comparison_col]
-            if long_bool:
-                qualifier_bool = (thirteen_low <= eight_close) and (thirteen_close <= eleven_low)
-            else:
-                qualifier_bool = (thirteen_low >= eight_close) and (thirteen_close >= eleven_low)
-        else:
-            qualifier_bool = False
-        if not qualifier_bool:
-            td_thirteens.drop(thirteen_date, inplace=True)
-        prior_date = until_date - datetime.timedelta(days=1)
+            qualified = (high[candidates] >= eight_close) & (close[candidates] >= eleven_bound)
+        if qualified.any():
+            thirteens.append(candidates[qualified.argmax()])
 
-    decision = (countdowns == 13).astype(int)
+    decision = pd.Series(0, index=td_df.index)
+    decision.iloc[thirteens] = 1
+    decision = decision.loc[start_date:]
     trade_point = td_df.loc[:, 'Close']
 
-
     return decision, trade_point
 
+pnl_columns = trade_ledger.table_columns
+
 # Calculates PNL and associated balance data
 # Rejects excess sells (ie: when Share Balance == 0) and returns a proper trade history.
-def pnl_calc(asset_data, buy_series, sell_series, trade_size, allow_fractional=True, sell_all=True):
+# as_ledger=True returns it as a TradeLedger, otherwise as a DataFrame (TradeLedger.to_frame).
+# vectorized=False runs the original per-sell tranche loop, kept for equivalence checks.
+# execution: ExecutionModel whose commissions are charged on the ledger (fills are priced by process_pnl_table)
+# dividends: per share Dividends by ex-date (adjustments.adjust_history's, on its prices), paid into the Cash Balance
+# & RPNL of the shares held before each ex-date, or reinvested at the ex-date close when drip=True: the ledger then
+# trades the dividend reinvested prices & its shares grow into the reinvested ones (fractional).
+@timed('pnl_calc', count=lambda result: {'ledger_rows': len(result)})
+def pnl_calc(asset_data, buy_series, sell_series, trade_size, allow_fractional=True, sell_all=True, vectorized=True,
+             as_ledger=False, execution=None, dividends=None, drip=False):
+
+    asset_data = price_frame(asset_data)
+    if dividends is not None and not buy_series.empty:
+        settings = dict(trade_size=trade_size, allow_fractional=allow_fractional, sell_all=sell_all,
+                        vectorized=vectorized, as_ledger=True, execution=execution)
+        if drip:
+            growth = pd.Series(adjustments.drip_factor(adjustments.dividends_on(dividends, asset_data.index),
+                                                       asset_data['Close']), index=asset_data.index)
+            final_pnl = pnl_calc(asset_data.assign(Close=asset_data['Close'] * growth),
+                                 buy_series * growth.reindex(buy_series.index),
+                                 sell_series * growth.reindex(sell_series.index), **settings)
+            final_pnl.scale_shares(growth.reindex(final_pnl.dates).to_numpy())
+        else:
+            final_pnl = pnl_calc(asset_data, buy_series, sell_series, **settings)
+            paid = dividends.loc[dividends > 0]
+            adjustments.pay_dividends(final_pnl.dates, final_pnl['Share Balance'], final_pnl['Cash Balance'],
+                                      final_pnl['RPNL'], pd.DatetimeIndex(paid.index), paid.to_numpy(dtype=float))
+        return final_pnl if as_ledger else final_pnl.to_frame()
+
+    if not vectorized:
+        final_pnl = tranche_pnl_calc(asset_data=asset_data, buy_series=buy_series, sell_series=sell_series,
+                                     trade_size=trade_size, allow_fractional=allow_fractional, sell_all=sell_all)
+        if execution is not None:
+            cash_balance = final_pnl['Cash Balance'].to_numpy(dtype=float, copy=True)
+            rpnl = final_pnl['RPNL'].to_numpy(dtype=float, copy=True)
+            trade_execution.charge_commissions(execution, final_pnl['Trade Value'].to_numpy(dtype=float),
+                                               cash_balance, rpnl)
+            final_pnl['Cash Balance'], final_pnl['RPNL'] = cash_balance, rpnl
+        if as_ledger:
+            return trade_ledger.TradeLedger() if buy_series.empty else trade_ledger.TradeLedger.from_frame(final_pnl)
+        return final_pnl
+
+    # Return empty DF if no buys occur
+    if buy_series.empty:
+        if as_ledger:
+            return trade_ledger.TradeLedger()
+        return pd.DataFrame(np.full((1, len(pnl_columns)), 0), columns=pnl_columns, index=[datetime.date.today()])
+
+    # Remove all sells occuring prior to first buy date & overlapping buy decisions
+    proper_sells = sell_series[buy_series.index[0]:] if sell_series.shape[0] > 0 else pd.Series(dtype=float)
+    buy_series = buy_series.drop(buy_series.index.intersection(proper_sells.index))
+
+    # Empty sides left out of the append, whose dtype would otherwise come from them in later pandas versions
+    dates = [index for index in [buy_series.index, proper_sells.index] if len(index)]
+    dates = dates[0].append(dates[1:])
+    order = np.argsort(dates.values, kind='stable')
+    dates = dates[order]
+    price = np.concatenate([buy_series.to_numpy(dtype=float), proper_sells.to_numpy(dtype=float)])[order]
+    is_sell = np.concatenate([np.zeros(len(buy_series), dtype=bool), np.ones(len(proper_sells), dtype=bool)])[order]
+
+    balances = kernels.ledger_balances(price, is_sell, trade_size, allow_fractional=allow_fractional, sell_all=sell_all)
+    if execution is not None:
+        trade_execution.charge_commissions(execution, balances['Trade Value'], balances['Cash Balance'],
+                                           balances['RPNL'])
+    final_pnl = trade_ledger.TradeLedger.from_arrays(dates,
+                                                     np.where(is_sell, trade_ledger.SELL, trade_ledger.BUY),
+                                                     price=price,
+                                                     share_diff=balances['Share Diff'],
+                                                     closing_price=asset_data['Close'].reindex(dates).to_numpy(),
+                                                     share_balance=balances['Share Balance'],
+                                                     cash_balance=balances['Cash Balance'],
+                                                     cost_basis=balances['Cost Basis'],
+                                                     trade_value=balances['Trade Value'],
+                                                     rpnl=balances['RPNL'])
+
+    final_pnl = final_pnl.take(balances['Trade Value'] != 0)  # Remove excess sells
+
+    # Add in Closing Statement for proper valuation, in place of any trade on the last date
+    statement_end = asset_data.index[-1]  # The last date in asset history (to calculate most recent PNLs)
+    closing_price = asset_data['Close'].iloc[-1]
+    last_entry = final_pnl.last()
+    final_pnl = final_pnl.take(final_pnl.dates != statement_end)
+    final_pnl.append(statement_end, trade_ledger.CLOSE, price=closing_price, share_diff=0.0,
+                     closing_price=closing_price, share_balance=last_entry['Share Balance'],
+                     cash_balance=last_entry['Cash Balance'], cost_basis=last_entry['Cost Basis'], trade_value=0.0,
+                     rpnl=last_entry['RPNL'])
+
+    return final_pnl if as_ledger else final_pnl.to_frame()
+
+
+# Original per-sell tranche implementation of pnl_calc
+def tranche_pnl_calc(asset_data, buy_series, sell_series, trade_size, allow_fractional=True, sell_all=True):
 
     # Bring sells/buys together in a DataFrame & fetch closing price
     buy_df = pd.DataFrame(zip(buy_series.values, np.full(len(buy_series), 'Buy')), columns=['Price', 'Decision'],
@@ -254,7 +387,6 @@ def pnl_calc(asset_data, buy_series, sell_series, trade_size, allow_fractional=T
 
     sell_df = pd.DataFrame(zip(proper_sells.values, np.full(len(proper_sells), 'Sell')), columns=['Price', 'Decision'],
                            index=proper_sells.index).loc[buy_df.index[0]:]
-    import streamlit as st
 
     buy_df.drop(buy_series.index.intersection(sell_series.index), inplace=True) # Remove overlapping decisions
 
@@ -282,9 +414,9 @@ def pnl_calc(asset_data, buy_series, sell_series, trade_size, allow_fractional=T
                 pos += 1
             if pos < len(trade_df.index):
                 start_index = trade_df.index[pos]
-                print(f"Start Index: {start_index}")
+                logger.debug("Start Index: %s", start_index)
             else:
-                print("No valid start location found.")
+                logger.info("No valid start location found.")
         else:
             break
         tranche_sell = tranche.index[-1]
@@ -350,6 +482,10 @@ def pnl_calc(asset_data, buy_series, sell_series, trade_size, allow_fractional=T
     return final_pnl
 
 
+# execution: ExecutionModel of the fills & trading costs, None fills every decision at its price for free
+# timeframe: bars the signals run on (see timeframes), the ledger stays on the daily bars
+# dividends & drip: paid out or reinvested by pnl_calc
+@timed('process_pnl_table')
 def process_pnl_table(buy_ma_span_one,
                       buy_ma_span_two,
                       sell_ma_span_one,
@@ -363,9 +499,18 @@ def process_pnl_table(buy_ma_span_one,
                       start_date=None,
                       trade_size=1,
                       allow_fractional=False,
-                      sell_all=False):
-
-
+                      sell_all=False,
+                      vectorized=True,
+                      sell_gap_days=0,
+                      calendar_gap=False,
+                      as_ledger=False,
+                      execution=None,
+                      timeframe=None,
+                      dividends=None,
+                      drip=False):
+
+
+    history = price_frame(history)
     buy_ma_spans = [buy_ma_span_one, buy_ma_span_two]
     final_buy_spans = buy_ma_spans if pd.notnull(buy_ma_spans).all() else [buy_ma_span_one]
 
@@ -379,21 +524,34 @@ def process_pnl_table(buy_ma_span_one,
         asset_data=history,
         gap=gap_days,
         spans=final_buy_spans,
-        scaling=buy_scaling
+        scaling=buy_scaling,
+        calendar_gap=calendar_gap,
+        timeframe=timeframe
     )
-    buy_series = (buy_point * buy_decision).replace(0, np.nan).dropna()[start_date:]
+    buy_series = decision_series(buy_decision, buy_point)[start_date:]
 
     # Sell Decisions
     sell_decision, sell_point, sell_ma_lines = get_trades(
         strategy=sell_strategy,
         long_bool=False,
         asset_data=history,
-        gap=0,
+        gap=sell_gap_days,
         spans=final_sell_spans,
         scaling=sell_scaling,
-        start=start_date
+        start=start_date,
+        calendar_gap=calendar_gap,
+        timeframe=timeframe
     )
-    sell_series = (sell_point * sell_decision).replace(0, np.nan).dropna()
+    sell_series = decision_series(sell_decision, sell_point)
+
+    if execution is not None:
+        # Crossovers are dated on the bar before the cross, On SMA/EMA levels are touched within the bar
+        buy_series, sell_series = (trade_execution.fill_series(history, series, execution, buy=buy,
+                                                               lookahead=fill_lookahead(history, series, strategy,
+                                                                                        execution, timeframe, buy),
+                                                               intrabar=signals.strategy(strategy).intrabar)
+                                   for series, strategy, buy in [(buy_series, buy_strategy, True),
+                                                                 (sell_series, sell_strategy, False)])
 
     pnl_table = pnl_calc(
         asset_data=history,
@@ -401,7 +559,46 @@ def process_pnl_table(buy_ma_span_one,
         sell_series=sell_series,
         trade_size=trade_size,
         allow_fractional=allow_fractional,
-        sell_all=sell_all
+        sell_all=sell_all,
+        vectorized=vectorized,
+        as_ledger=as_ledger,
+        execution=execution,
+        dividends=dividends,
+        drip=drip
     )
 
     return pnl_table, buy_ma_lines, sell_ma_lines
+
+
+# Daily bars past its own each decision of strategy (a Series dated on its bars) is known on, as fill_series takes it.
+# Crossovers are known a bar later: on resampled bars, the next daily bar opens that bar (Touch) & the fill models
+# trading after the decision wait for the bar's close.
+def fill_lookahead(history, decisions, strategy, execution, timeframe=None, long_bool=True):
+    lookahead = signals.lookahead(signals.strategy(strategy), long_bool)
+    if execution.fill == 'Touch' or not timeframes.resampled(timeframe):
+        return lookahead
+    return timeframes.daily_lookahead(history.index, timeframes.price_bars(history, timeframe).index, decisions.index,
+                                      lookahead)
+
+
+# How much of a strategy's PNL (RPNL + UPNL) survives each ExecutionModel in models: frictionless fills (PNL),
+# the model's fills alone (Gross PNL) & its fills with its costs (Net PNL). Fill Drag & Costs split the difference,
+# Edge Retained is Net PNL / PNL (NaN without a frictionless profit). settings: process_pnl_table's strategy inputs.
+def execution_report(history, models, **settings):
+
+    def final_pnl(execution):
+        ledger, _, _ = process_pnl_table(history=history, execution=execution, as_ledger=True, **settings)
+        last = ledger.last()
+        return last['RPNL'] + last['UPNL'], max(len(ledger) - 1, 0)  # Without the closing statement
+
+    frictionless, _ = final_pnl(None)
+    rows = []
+    for model in models:
+        gross, _ = final_pnl(trade_execution.ExecutionModel(fill=model.fill))
+        net, trade_count = final_pnl(model)
+        rows.append({'Trade Count': trade_count, 'PNL': frictionless, 'Gross PNL': gross, 'Net PNL': net,
+                     'Fill Drag': frictionless - gross, 'Costs': gross - net,
+                     'Edge Retained': net / frictionless if frictionless > 0 else np.nan})
+    return pd.concat([pd.DataFrame(models, columns=trade_execution.model_columns),
+                      pd.DataFrame(rows, columns=['Trade Count', 'PNL', 'Gross PNL', 'Net PNL', 'Fill Drag', 'Costs',
+                                                  'Edge Retained'])], axis=1)
@@ -0,0 +1,143 @@
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from logic import analytics, batch, signals, sweep
+from logic.price_history import price_frame
+
+# Walk-forward optimization: the swept parameters are picked on each in-sample window, then traded untouched
+# on the out-of-sample window right after it. Decisions come from indicators computed once over the full history
+# (moving averages & TD counts only look back) & are sliced per window, so no window sees bars past its own end.
+
+# Worker process state: the signal events of every parameter combination, shared by all windows
+worker_events = None
+
+
+# [(in-sample start, out-of-sample start, out-of-sample end)] bar positions, ends excluded.
+# Windows move forward by step bars (out_of_sample by default, for back to back out-of-sample windows).
+# anchored=True keeps every in-sample window starting at start_pos instead of rolling it forward.
+def walk_forward_windows(n_bars, in_sample, out_of_sample, step=None, anchored=False, start_pos=0):
+    step = step or out_of_sample
+    windows = []
+    oos_start = start_pos + in_sample
+    while oos_start < n_bars:
+        windows.append((start_pos if anchored else oos_start - in_sample, oos_start,
+                        min(oos_start + out_of_sample, n_bars)))
+        oos_start += step
+    return windows
+
+
+def init_worker(block_name, layout, events):
+    global worker_events
+    batch.init_worker(block_name, layout)
+    worker_events = events
+
+
+# Best parameter set of the in-sample window by objective (a results column, 'PNL' = RPNL + UPNL, or one of
+# analytics.metric_columns ie: Sharpe), along with its out-of-sample summary & daily PNL
+def run_window(history, params, window, settings, events, objective='PNL'):
+    is_start, oos_start, oos_end = window
+    in_sample = sweep.evaluate_parameters(history=history, params=params, start_date=history.index[is_start],
+                                          end_date=history.index[oos_start - 1], events=events,
+                                          metrics=objective in analytics.metric_columns, **settings)
+    in_sample['PNL'] = in_sample['RPNL'] + in_sample['UPNL']
+    best = np.nan_to_num(in_sample[objective].to_numpy(dtype=float), nan=-np.inf).argmax()  # Undefined ranks last
+
+    out_of_sample = sweep.evaluate_parameters(history=history, params=params.iloc[[best]],
+                                              start_date=history.index[oos_start],
+                                              end_date=history.index[oos_end - 1],
+                                              events=select_events(events, best), **settings)
+    out_of_sample['PNL'] = out_of_sample['RPNL'] + out_of_sample['UPNL']
+    daily_pnl = window_pnl(history, events, params.iloc[best], best, oos_start, oos_end, settings)
+
+    summary = {'In-Sample Start': history.index[is_start],
+               'Out-of-Sample Start': history.index[oos_start],
+               'Out-of-Sample End': history.index[oos_end - 1],
+               **params.iloc[best].to_dict(),
+               f'In-Sample {objective}': in_sample[objective].iloc[best]}
+    summary.update({f'Out-of-Sample {column}': out_of_sample[column].iloc[0]
+                    for column in ['PNL', 'RPNL', 'UPNL', 'Trade Count']})
+    return summary, daily_pnl
+
+
+def run_worker_window(ticker, params, window, settings, objective):
+    return run_window(batch.worker_history(ticker), params, window, settings, worker_events, objective)
+
+
+# parameter_events output restricted to a single combination
+def select_events(events, row):
+    buy_keys, sell_keys, buy_events, sell_events = events
+    return [buy_keys[row]], [sell_keys[row]], buy_events, sell_events
+
+
+# RPNL + UPNL of the parameter set on row at every bar of an out-of-sample window, starting flat on its first bar
+def window_pnl(history, events, param_set, row, oos_start, oos_end, settings):
+    buy_keys, sell_keys, buy_events, sell_events = events
+    buy_strategy, sell_strategy = settings['buy_strategy'], settings['sell_strategy']
+    close = history['Close'].to_numpy(dtype=float)[oos_start: oos_end]
+    pnl = pd.Series(0.0, index=history.index[oos_start: oos_end])
+
+    positions, ledger = sweep.combination_ledger(
+        buy_events[buy_keys[row]], sell_events[sell_keys[row]],
+        gap=param_set['gap_days'] if signals.strategy(buy_strategy).gap else 0,
+        sell_gap=param_set['sell_gap_days'] if signals.strategy(sell_strategy).gap else 0,
+        start_pos=oos_start, end_pos=oos_end - 1, trade_size=settings['trade_size'],
+        dates=history.index.to_numpy() if settings['calendar_gap'] else None,
+        allow_fractional=settings['allow_fractional'], sell_all=settings['sell_all'],
+        buy_lookahead=sweep.decision_lookahead(buy_strategy),
+        sell_lookahead=sweep.decision_lookahead(sell_strategy, False))
+    if ledger is None:
+        return pnl
+
+    latest = np.searchsorted(positions, np.arange(oos_start, oos_end), side='right') - 1  # Latest trade of each bar
+    traded = latest >= 0
+    rows = latest[traded]
+    pnl[traded] = ledger['RPNL'][rows] + (close[traded] - ledger['Cost Basis'][rows]) * ledger['Share Balance'][rows]
+    return pnl
+
+
+# Walk-forward optimization of process_pnl_table's spans, scaling & gaps over param_ranges
+# ({name: values} as in sweep.parameter_sweep). Window sizes are in bars.
+# Returns one row per window (dates, chosen parameters, in-sample score & out-of-sample results)
+# along with the out-of-sample PNL of every window stitched into a single running PNL curve.
+def walk_forward(history, buy_strategy, sell_strategy, param_ranges, in_sample=756, out_of_sample=126, step=None,
+                 anchored=False, objective='PNL', start_date=None, trade_size=1, allow_fractional=False,
+                 sell_all=False, calendar_gap=False, processes=None):
+
+    history = price_frame(history)
+    params = sweep.with_defaults(sweep.parameter_grid(param_ranges))
+    events = sweep.parameter_events(history, buy_strategy, sell_strategy, params)
+    start_pos = 0 if start_date is None else history.index.searchsorted(pd.to_datetime(start_date))
+    windows = walk_forward_windows(len(history), in_sample, out_of_sample, step=step, anchored=anchored,
+                                   start_pos=start_pos)
+    settings = dict(buy_strategy=buy_strategy, sell_strategy=sell_strategy, trade_size=trade_size,
+                    allow_fractional=allow_fractional, sell_all=sell_all, calendar_gap=calendar_gap)
+    if processes == 1 or len(windows) <= 1:
+        outcomes = [run_window(history, params, window, settings, events, objective) for window in windows]
+    else:
+        block, layout = batch.share_histories({'history': history})
+        try:
+            with ProcessPoolExecutor(max_workers=processes or os.cpu_count(), initializer=init_worker,
+                                     initargs=(block.name, layout, events)) as executor:
+                outcomes = list(executor.map(run_worker_window, ['history'] * len(windows),
+                                             [params] * len(windows), windows, [settings] * len(windows),
+                                             [objective] * len(windows)))
+        finally:
+            block.close()
+            block.unlink()
+
+    summary = pd.DataFrame([window_summary for window_summary, _ in outcomes])
+    return summary, stitch_pnl([daily_pnl for _, daily_pnl in outcomes])
+
+
+# Chains the daily PNL of consecutive out-of-sample windows, each one carrying on from the previous window's
+# final PNL. Overlapping windows (step < out_of_sample) are cut where the next one starts.
+def stitch_pnl(window_pnls):
+    pieces = []
+    carried = 0.0
+    for idx, pnl in enumerate(window_pnls):
+        if idx + 1 < len(window_pnls):
+            pnl = pnl[pnl.index < window_pnls[idx + 1].index[0]]
+        pieces.append(pnl + carried)
+        carried += pnl.iloc[-1] if len(pnl) else 0.0
+    return pd.concat(pieces).rename('Out-of-Sample PNL') if pieces else pd.Series(dtype=float, name='Out-of-Sample PNL')
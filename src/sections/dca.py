@@ -1,6 +1,8 @@
 import streamlit as st 
-from logic import trade_logic, plot_funcs
+from logic import instrumentation, trade_logic, plot_funcs
 from logic.styling import dollar_format
+from logic.price_history import price_frame
+from data.config import app_defaults
 import pandas as pd 
 import numpy as np
 
@@ -27,22 +29,30 @@ with purchase_col:
 
 divisible = True if 'crypto' in st.session_state['info'].get('quoteType').lower() else st.session_state.get('allow_fractional', True)
 
-dca_data = st.session_state['history'].loc[st.session_state['history'].index.tz_localize(None) >= pd.to_datetime(st.session_state['start_date'])]
+history = price_frame(st.session_state['history'])
+dca_data = history.loc[history.index >= pd.to_datetime(st.session_state['start_date'])]
 dca_df, purchase_dates = trade_logic.dca_buy_report(asset_data=dca_data,
                                                     weekday=day_number,
                                                     strategy=selected_strategy,
                                                     interval=interval_number,
                                                     usd_buy_amount=selected_spend,
-                                                    allow_fractional=divisible)
+                                                    allow_fractional=divisible,
+                                                    dividends=st.session_state.get('dividends'),
+                                                    drip=st.session_state.get('drip', False))
 
 pnl_amount = dollar_format(dca_df['Unrealized PNL'][-1])
 final_balance = dca_df['Share Balance'][-1]
 shares_owned = int(final_balance) if float(final_balance).is_integer() else final_balance
 share_count = dollar_format(final_balance)
-value_amount = dollar_format(dca_df['Value'][-1])
+# Paid out dividends are cash on top of the shares' value, reinvested ones are already in it
+paid_income = dca_df['Dividend Income'][-1] if 'Dividend Income' in dca_df and not st.session_state.get('drip', False) \
+    else 0.0
+value_amount = dollar_format(dca_df['Value'][-1] + paid_income)
 
 
-st.plotly_chart(plot_funcs.dca_plot(dca_df, purchase_dates), use_container_width=True, height=2000)
+dca_figure = plot_funcs.dca_plot(dca_df, purchase_dates, max_points=app_defaults['max_plot_points'])
+with instrumentation.span('plotly_chart'):
+    st.plotly_chart(dca_figure, use_container_width=True, height=2000)
 
 summary_cols = st.columns(2)
 with summary_cols[0]:
@@ -51,7 +61,7 @@ with summary_cols[0]:
         ## Portfolio Summary 📒
         - **Shares Accumulated:** {share_count}
         - **Unrealized PnL:** {pnl_amount}
-        """
+        """ + (f"- **Dividends Paid Out:** {dollar_format(paid_income)}" if paid_income else '')
     )
 
 with summary_cols[1]: 
@@ -66,7 +76,8 @@ with st.expander('View Trade History'):
     trades_table.index = trades_table.index.strftime('%Y/%m/%d')
     pct_columns = ['ROE %']
     share_columns = ['Shares Bought', 'Share Balance']
-    float_columns = ['Close', 'Cost Basis', 'Cumulative Spend', 'Unrealized PNL', 'Value']
+    float_columns = ['Close', 'Cost Basis', 'Cumulative Spend', 'Unrealized PNL', 'Value',
+                     *dca_df.columns.intersection(['Dividend Income'])]
     st.table(
         trades_table.style.format(
             "{:.2f}", subset=share_columns).format(
@@ -74,3 +85,21 @@ with st.expander('View Trade History'):
             "{:.2%}", subset=pct_columns)
     )
 
+
+with st.expander('Compare All Schedules'):
+    schedule_summary, equity_curves = trade_logic.dca_schedules(asset_data=dca_data,
+                                                                usd_buy_amounts=[selected_spend],
+                                                                allow_fractional=divisible,
+                                                                dividends=st.session_state.get('dividends'),
+                                                                drip=st.session_state.get('drip', False))
+    schedule_summary = schedule_summary.drop(['Amount'], axis=1).sort_values('ROE %', ascending=False)
+    st.dataframe(
+        schedule_summary.style.format(
+            "{:.2f}", subset=['Share Balance']).format(
+            "{:,.2f}$", subset=['Cost Basis', 'Cumulative Spend', 'Unrealized PNL', 'Value',
+                                *schedule_summary.columns.intersection(['Dividend Income'])]).format(
+            "{:.2f}%", subset=['ROE %']),
+        hide_index=True, use_container_width=True
+    )
+    equity_curves.columns = [f'{weekday} {interval} ({time})' for weekday, interval, time, _ in equity_curves.columns]
+    st.line_chart(equity_curves)
@@ -1,30 +1,48 @@
 import streamlit as st 
 from logic.styling import color_negative_red, dollar_format
-from logic import plot_funcs, trade_logic
+from logic import analytics, execution, instrumentation, ledger, monte_carlo, plot_funcs, signals, timeframes, \
+    trade_logic, walk_forward
 import pandas as pd 
 import numpy as np
 
 from data.config import app_defaults
 other_params, buy_params_one, buy_params_two, sell_params_one, sell_params_two = st.columns(5)
 
-available_strategies = list(trade_logic.strategies.keys())
-available_buy_strategies = available_strategies.copy()
-available_buy_strategies.remove('Hold/None')
+available_strategies = [*signals.strategies, 'Custom Rule']
+available_buy_strategies = [name for name in available_strategies
+                            if name not in signals.strategies or signals.trades(signals.strategies[name], True)]
+
+
+# Registered strategy or rule of a side, stopping the page on a rule that doesn't compile
+def strategy_spec(strategy):
+    try:
+        return signals.strategy(strategy)
+    except ValueError as error:
+        st.error(str(error))
+        st.stop()
+
 
 with other_params:
     trade_size = st.number_input('Enter Trade Value', value=500, step=100)
     gap_days = st.number_input('Minimum Gap Days Between Buys', value=7, step=1)
+    sell_gap_days = st.number_input('Minimum Gap Days Between Sells', value=0, step=1)
+    calendar_gap = st.checkbox('Count Gaps in Calendar Days')
+    timeframe = timeframes.timeframe_names[st.selectbox('Signal Timeframe', list(timeframes.timeframe_names))]
 
 with buy_params_one:
     buy_strategy = st.selectbox('Select Buying Strategy', available_buy_strategies)
+    if buy_strategy == 'Custom Rule':
+        buy_strategy = st.text_input('Buy Rule', value='close < sma(25) * 0.975 & rsi(14) < 30',
+                                     help='ie: cross_above(sma(span_one), sma(span_two)) & rsi(14) > 50')
+    buy_parameters = signals.parameters(strategy_spec(buy_strategy), True)
     buy_scaling = st.number_input('MA Scaling (<=1.00)', value=0.975, step=0.025) \
-        if pd.Series([_ not in buy_strategy for _ in ['Crossover', 'Countdown']]).all() else None
+        if 'scaling' in buy_parameters else None
 
 with buy_params_two:
-    if 'Crossover' in buy_strategy:
+    if 'span_two' in buy_parameters:
         buy_ma_span_one = st.number_input('1st MA Span (Short Term)', value=50, step=5, key='buy_ma_1')
         buy_ma_span_two = st.number_input('2nd MA Span (Long Term)', value=150, step=10, key='buy_ma_2')
-    elif 'MA' in buy_strategy:
+    elif 'span_one' in buy_parameters:
         buy_ma_span_one = st.number_input('Buy MA Span', value=25, step=5)
         buy_ma_span_two = None
     else:
@@ -33,20 +51,24 @@ with buy_params_two:
 with sell_params_one:
     initial_strategy = available_strategies.index('TD Countdown')
     sell_strategy = st.selectbox('Select Selling Strategy', available_strategies, index=initial_strategy)
+    if sell_strategy == 'Custom Rule':
+        sell_strategy = st.text_input('Sell Rule', value='close > sma(25) * 1.05 | rsi(14) > 70',
+                                      help='ie: cross_below(close, bb_upper(20, 2))')
+    sell_parameters = signals.parameters(strategy_spec(sell_strategy), False)
     sell_scaling = st.number_input('MA Scaling (>=1.00)', value=1.05, step=0.025) \
-        if pd.Series([_ not in sell_strategy for _ in ['Crossover', 'Hold', 'Countdown']]).all() else None
+        if 'scaling' in sell_parameters else None
 
 with sell_params_two:
-    if 'Crossover' in sell_strategy:
+    if 'span_two' in sell_parameters:
         sell_ma_span_one = st.number_input('1st MA Span (Short Term)', value=50, step=5, key='sell_ma_1')
-    elif pd.Series([_ not in sell_strategy for _ in ['Hold', 'Countdown']]).all():
+    elif 'span_one' in sell_parameters:
         sell_ma_span_one = st.number_input('Sell MA Span', value=25, step=5)
     else:
         sell_ma_span_one = None
     sell_ma_span_two = st.number_input('2nd MA Span (Long Term)', value=150, step=10, key='sell_ma_2') \
-        if 'Crossover' in sell_strategy else None
+        if 'span_two' in sell_parameters else None
 
-pnl_table, buy_ma_lines, sell_ma_lines = trade_logic.process_pnl_table(buy_ma_span_one=buy_ma_span_one,
+trades, buy_ma_lines, sell_ma_lines = trade_logic.process_pnl_table(buy_ma_span_one=buy_ma_span_one,
                 buy_ma_span_two=buy_ma_span_two,
                 sell_ma_span_one=sell_ma_span_one,
                 sell_ma_span_two=sell_ma_span_two,
@@ -54,49 +76,59 @@ pnl_table, buy_ma_lines, sell_ma_lines = trade_logic.process_pnl_table(buy_ma_sp
                 sell_strategy=sell_strategy,
                 history=st.session_state['history'],
                 gap_days=gap_days,
+                sell_gap_days=sell_gap_days,
+                calendar_gap=calendar_gap,
+                timeframe=timeframe,
                     buy_scaling=buy_scaling,
                     sell_scaling=sell_scaling,
                     start_date=st.session_state['start_date'],
                         trade_size=trade_size,
                     allow_fractional=st.session_state.get('allow_fractional', app_defaults['allow_fractional']),
-                        sell_all=st.session_state.get('sell_all', app_defaults['sell_all']))
+                        sell_all=st.session_state.get('sell_all', app_defaults['sell_all']),
+                    dividends=st.session_state.get('dividends'),
+                    drip=st.session_state.get('drip', False),
+                    as_ledger=True)
 
 
 
-# Get the proper data to plot (What we actually end up trading)
-plot_buy = (pnl_table['Decision'] == 'Buy').astype(int)
-plot_buy_price = pnl_table.loc[plot_buy.index, 'Price']
-plot_sell = -(pnl_table['Decision'] == 'Sell').astype(int)
-plot_sell_price = pnl_table.loc[plot_sell.index, 'Price']
-combined_decisions = pd.concat([plot_buy, plot_sell])
-combined_prices = pd.concat([plot_buy_price, plot_sell_price])
+# Get the proper data to plot (What we actually end up trading): 1 = Buy, -1 = Sell, 0 = Closing Statement
+combined_decisions = trades.decisions()
+combined_prices = pd.Series(trades['Price'], index=combined_decisions.index)
 
 # Save and write closing position data
-shares_owned = pnl_table.iloc[-1]['Share Balance']
+closing_position = trades.last()
+shares_owned = closing_position['Share Balance']
 balance = np.round(shares_owned, 2) if st.session_state.get('allow_fractional', app_defaults['allow_fractional']) else int(shares_owned)
-spend_str = dollar_format(pnl_table.loc[pnl_table['Decision'] == 'Buy', 'Trade Value'].sum())
-cash_str = dollar_format(pnl_table.iloc[-1]['Cash Balance'])
-value_str = dollar_format(pnl_table.iloc[-1]['Balance Value'])
-rpnl_str = dollar_format(pnl_table.iloc[-1]['RPNL'])
-upnl_str = dollar_format(pnl_table.iloc[-1]['UPNL'])
-total_value = dollar_format(pnl_table.iloc[-1]['Cash Balance'] + pnl_table.iloc[-1]['Balance Value'])
+spend_str = dollar_format(trades['Trade Value'][trades.sides == ledger.BUY].sum())
+cash_str = dollar_format(closing_position['Cash Balance'])
+value_str = dollar_format(closing_position['Balance Value'])
+rpnl_str = dollar_format(closing_position['RPNL'])
+upnl_str = dollar_format(closing_position['UPNL'])
+total_value = dollar_format(closing_position['Cash Balance'] + closing_position['Balance Value'])
+performance = analytics.trade_metrics(trades, st.session_state['history'], start_date=st.session_state['start_date'],
+                                      dividends=st.session_state.get('dividends'),
+                                      drip=st.session_state.get('drip', False))
 
 # Plot our Trades and MAs along with the close data or candlesticks
-fig = plot_funcs.plot_price_data(st.session_state['history'], st.session_state.get('display_candlestick', app_defaults['display_candlestick']))
+max_points = app_defaults['max_plot_points']
+fig = plot_funcs.plot_price_data(st.session_state['history'], st.session_state.get('display_candlestick', app_defaults['display_candlestick']),
+                                 max_points=max_points, visible_start=st.session_state['start_date'])
 display_fig = fig
 display_fig.update_xaxes(range=[st.session_state['start_date'], st.session_state['history'].index[-1]])
-display_fig = plot_funcs.plot_ma(figure=display_fig, ma_dict=buy_ma_lines, long_bool=True)
-display_fig = plot_funcs.plot_ma(figure=display_fig, ma_dict=sell_ma_lines, long_bool=False)
+display_fig = plot_funcs.plot_ma(figure=display_fig, ma_dict=buy_ma_lines, long_bool=True, max_points=max_points,
+                                 visible_start=st.session_state['start_date'])
+display_fig = plot_funcs.plot_ma(figure=display_fig, ma_dict=sell_ma_lines, long_bool=False, max_points=max_points,
+                                 visible_start=st.session_state['start_date'])
 display_fig = plot_funcs.plot_decisions(figure=display_fig,
                                         decisions=combined_decisions,
                                         price_point=combined_prices,
-                                        markers=st.session_state.get('markers_bool', app_defaults['markers_bool']))
-
-st.plotly_chart(display_fig, use_container_width=True, height=1500)
+                                        markers=st.session_state.get('markers_bool', app_defaults['markers_bool']),
+                                        max_points=max_points)
 
-final_pos = dict(zip(pnl_table.columns, pnl_table.iloc[-1].values))
+with instrumentation.span('plotly_chart'):
+    st.plotly_chart(display_fig, use_container_width=True, height=1500)
 
-summary_cols = st.columns(2)
+summary_cols = st.columns(3)
 with summary_cols[0]:
     st.markdown(
         f"""
@@ -116,8 +148,17 @@ with summary_cols[1]:
         - **Cash on Hand:** {cash_str}
     """)    
 
+with summary_cols[2]:
+    st.markdown(f"""
+        ## Risk & Performance 📈
+        - **CAGR:** {performance['CAGR']:.2%} (Sharpe {performance['Sharpe']:.2f}, Sortino {performance['Sortino']:.2f})
+        - **Max Drawdown:** {performance['Max Drawdown']:.2%} over {performance['Max Drawdown Days']:.0f} days
+        - **Exposure:** {performance['Exposure']:.0%}, **Win Rate:** {performance['Win Rate']:.0%}
+        - **Turnover:** {performance['Turnover']:.2f}x / year
+    """)
+
 with st.expander('View Trade History'):
-    trades_table = pnl_table.copy().drop(['Decision'], axis=1)
+    trades_table = trades.to_frame().drop(['Decision'], axis=1)
     trades_table.index = trades_table.index.strftime('%Y/%m/%d')
     trades_table = trades_table.loc[~trades_table.duplicated(keep='last')]
     share_columns = ['Share Diff', 'Share Balance']
@@ -127,3 +168,92 @@ with st.expander('View Trade History'):
         '{:,.2f}$', subset=float_columns).map(
         color_negative_red, subset=pd.IndexSlice[:, 'Share Diff']
     ))
+
+# Walk-forward & Monte Carlo run the strategy on daily bars without dividends, so they only match the one above then
+daily_signals = not timeframes.resampled(timeframe) and st.session_state.get('dividends') is None
+daily_only = 'Runs on daily bars without dividends: select the Daily timeframe & Dividends Not Included to run it.'
+
+with st.expander('Walk-Forward Optimization'):
+    st.caption('Picks the 1st MA span of each side (and the MA scaling) on each in-sample window, '
+               'then trades them on the following out-of-sample window only.')
+    window_cols = st.columns(4)
+    in_sample_bars = window_cols[0].number_input('In-Sample Bars', value=756, step=21)
+    out_of_sample_bars = window_cols[1].number_input('Out-of-Sample Bars', value=126, step=21)
+    span_range = window_cols[2].slider('MA Spans to Optimize', min_value=5, max_value=250, value=(10, 100))
+    span_step = window_cols[3].number_input('Span Step', value=5, step=1, min_value=1)
+
+    param_ranges = {'gap_days': [gap_days], 'sell_gap_days': [sell_gap_days]}
+    spans = list(range(span_range[0], span_range[1] + 1, span_step))
+    for side, strategy, span_one, span_two, scaling in [('buy', buy_strategy, buy_ma_span_one, buy_ma_span_two, buy_scaling),
+                                                        ('sell', sell_strategy, sell_ma_span_one, sell_ma_span_two, sell_scaling)]:
+        if span_one is not None:
+            param_ranges[f'{side}_ma_span_one'] = spans
+            param_ranges[f'{side}_ma_span_two'] = [span_two]
+        if scaling is not None:
+            param_ranges[f'{side}_scaling'] = sorted({round(scaling - 0.025, 3), scaling, round(scaling + 0.025, 3)})
+
+    if not daily_signals:
+        st.warning(daily_only)
+    if st.button('Run Walk-Forward', disabled=not daily_signals):
+        windows, oos_pnl = walk_forward.walk_forward(st.session_state['history'], buy_strategy, sell_strategy,
+                                                     param_ranges, in_sample=in_sample_bars,
+                                                     out_of_sample=out_of_sample_bars,
+                                                     start_date=st.session_state['start_date'], trade_size=trade_size,
+                                                     allow_fractional=st.session_state.get('allow_fractional', app_defaults['allow_fractional']),
+                                                     sell_all=st.session_state.get('sell_all', app_defaults['sell_all']),
+                                                     calendar_gap=calendar_gap, processes=1)
+        if windows.empty:
+            st.warning('The history after the start date is shorter than the in-sample window.')
+        else:
+            st.line_chart(oos_pnl)
+            st.dataframe(windows)
+
+with st.expander('Monte Carlo Robustness'):
+    st.caption('Trades the strategy above on price paths resampled from the history in blocks of daily moves.')
+    simulation_cols = st.columns(3)
+    n_paths = simulation_cols[0].number_input('Simulated Paths', value=1000, step=500, min_value=100)
+    block_size = simulation_cols[1].number_input('Block Size (Bars)', value=20, step=5, min_value=1)
+    simulation_seed = simulation_cols[2].number_input('Seed', value=0, step=1)
+
+    if not daily_signals:
+        st.warning(daily_only)
+    if st.button('Run Simulation', disabled=not daily_signals):
+        simulated = monte_carlo.monte_carlo(st.session_state['history'], buy_strategy, sell_strategy, n_paths=n_paths,
+                                            block_size=block_size, seed=simulation_seed, processes=1,
+                                            buy_ma_span_one=buy_ma_span_one, buy_ma_span_two=buy_ma_span_two,
+                                            sell_ma_span_one=sell_ma_span_one, sell_ma_span_two=sell_ma_span_two,
+                                            gap_days=gap_days, sell_gap_days=sell_gap_days, buy_scaling=buy_scaling,
+                                            sell_scaling=sell_scaling, start_date=st.session_state['start_date'],
+                                            trade_size=trade_size, calendar_gap=calendar_gap,
+                                            allow_fractional=st.session_state.get('allow_fractional', app_defaults['allow_fractional']),
+                                            sell_all=st.session_state.get('sell_all', app_defaults['sell_all']))
+        st.plotly_chart(plot_funcs.distribution_plot(simulated['PNL'],
+                                                     historical=closing_position['RPNL'] + closing_position['UPNL']),
+                        use_container_width=True)
+        st.dataframe(monte_carlo.summarize(simulated))
+
+with st.expander('Execution Costs'):
+    st.caption('How much of the PNL above survives realistic fills (at the touched level, the next open or the next '
+               "bar's typical price) along with commissions, half the bid/ask spread & slippage on every trade.")
+    cost_cols = st.columns(4)
+    commission = cost_cols[0].number_input('Commission per Trade ($)', value=1.0, step=0.5, min_value=0.0)
+    commission_bps = cost_cols[1].number_input('Commission (bps)', value=0.0, step=1.0, min_value=0.0)
+    spread_bps = cost_cols[2].number_input('Bid/Ask Spread (bps)', value=5.0, step=1.0, min_value=0.0)
+    slippage_bps = cost_cols[3].number_input('Slippage (bps)', value=5.0, step=1.0, min_value=0.0)
+
+    if st.button('Compare Fill Models'):
+        models = [execution.ExecutionModel(fill, commission, commission_bps, spread_bps, slippage_bps)
+                  for fill in execution.fill_models]
+        report = trade_logic.execution_report(st.session_state['history'], models,
+                                              buy_ma_span_one=buy_ma_span_one, buy_ma_span_two=buy_ma_span_two,
+                                              sell_ma_span_one=sell_ma_span_one, sell_ma_span_two=sell_ma_span_two,
+                                              buy_strategy=buy_strategy, sell_strategy=sell_strategy,
+                                              gap_days=gap_days, sell_gap_days=sell_gap_days,
+                                              calendar_gap=calendar_gap, buy_scaling=buy_scaling,
+                                              sell_scaling=sell_scaling, start_date=st.session_state['start_date'],
+                                              trade_size=trade_size, timeframe=timeframe,
+                                              allow_fractional=st.session_state.get('allow_fractional', app_defaults['allow_fractional']),
+                                              sell_all=st.session_state.get('sell_all', app_defaults['sell_all']),
+                                              dividends=st.session_state.get('dividends'),
+                                              drip=st.session_state.get('drip', False))
+        st.dataframe(report.style.format('{:.1%}', subset=['Edge Retained']))
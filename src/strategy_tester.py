@@ -3,16 +3,28 @@ import numpy as np
 import yfinance as yf
 import streamlit as st
 import datetime
-from data.config import app_defaults
+from data.config import app_defaults, metrics_port
+from logic import instrumentation
 
 # Initial App Setup
 st.set_page_config(page_title='Strategy Tester', layout='wide', page_icon="📈")
 st.session_state['config'] = app_defaults
+if metrics_port:
+    instrumentation.serve_metrics(int(metrics_port))
+instrumentation.start_trace()  # Stage timings of this rerun
 
 # Import other packages within strat_test
-from data.fetch_data import load_ticker
+from data.fetch_data import load_adjusted_history, load_price_history
 selected_ticker = st.sidebar.text_input('Input Your Ticker', 'VOO').upper()
-st.session_state['history'], st.session_state['info'] = load_ticker(selected_ticker) 
+# Not Included trades the source's dividend adjusted prices, the others the prices as traded plus the dividends
+dividend_mode = st.sidebar.selectbox('Dividends', ['Not Included', 'Paid Out', 'Reinvested (DRIP)'])
+if dividend_mode == 'Not Included':
+    st.session_state['history'], st.session_state['info'] = load_price_history(selected_ticker, app_defaults['float32_prices'])
+    st.session_state['dividends'] = None
+else:
+    st.session_state['history'], st.session_state['dividends'], st.session_state['info'] = \
+        load_adjusted_history(selected_ticker, app_defaults['float32_prices'])
+st.session_state['drip'] = dividend_mode == 'Reinvested (DRIP)'
 st.session_state['history'].name = selected_ticker
 min_date, max_date = (st.session_state['history'].index[0].date(), st.session_state['history'].index[-1].date())
 historical_span = (max_date - min_date).days
@@ -36,10 +48,20 @@ st.session_state['config']['allow_fractional'] = st.sidebar.checkbox('Allow Frac
 if page.title == "Rule Based Trading":
     st.session_state['config']['sell_all'] = st.sidebar.checkbox('Sell All Shares on Sell Decision')
     st.session_state['config']['markers_bool'] = st.sidebar.checkbox('Use Markers for Decisions')
+show_timings = st.sidebar.checkbox('Show Stage Timings', value=app_defaults['debug_panel'])
 
 
 page.run()
 
+stage_timings = instrumentation.stop_trace()
+if show_timings:
+    with st.sidebar.expander('Stage Timings', expanded=True):
+        timings = pd.DataFrame(stage_timings)
+        if not timings.empty:
+            timings['Stage'] = ['  ' * depth + stage for depth, stage in zip(timings.pop('Depth'), timings['Stage'])]
+            timings['Seconds'] = timings['Seconds'].round(4)
+        st.dataframe(timings, hide_index=True)
+
 if st.session_state['history'] is None and st.session_state['info'] is None:
     st.warning('The Selected Ticker is Invalid. Please select a ticker supported by Yahoo Finance.')
     st.stop()
@@ -0,0 +1,59 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from data import ohlc_cache
+
+
+# Source bars of a 2:1 split on bar 8: the first 6 bars before the split, all 12 (back-adjusted, as yfinance) after
+def source_bars(split=True):
+    n_bars = 12 if split else 6
+    index = pd.bdate_range('2024-01-01', periods=n_bars, name='Date')
+    close = np.full(n_bars, 50.0 if split else 100.0)
+    return pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close, 'Volume': 1000.0,
+                         'Dividends': 0.0, 'Stock Splits': np.where(np.arange(n_bars) == 8, 2.0, 0.0)}, index=index)
+
+
+def test_refresh_with_a_split_keeps_the_stored_closes_continuous(tmp_path):
+    calls = []
+
+    def fetch(ticker, start=None):
+        calls.append(start)
+        bars = source_bars(split=len(calls) > 1)
+        return (bars if start is None else bars.loc[start:]), {}
+
+    ohlc_cache.load_history('X', fetch=fetch, cache_dir=str(tmp_path))
+    path = ohlc_cache.cache_path('X', str(tmp_path))
+    os.utime(path, (time.time() - 10 ** 6, time.time() - 10 ** 6))
+    history, _ = ohlc_cache.load_history('X', fetch=fetch, cache_dir=str(tmp_path))
+
+    assert calls[-1] is None  # The split restated the cached bars, so all of them were downloaded again
+    assert len(history) == 12
+    np.testing.assert_allclose(history['Close'].to_numpy(), 50.0)
+    pd.testing.assert_frame_equal(pd.read_parquet(path), history, check_freq=False)
+
+
+# Adjusted bars of a store refreshed across a dividend are the prices as traded, as if downloaded in one go
+def test_adjusted_bars_after_a_refresh_with_a_dividend(tmp_path):
+    index = pd.bdate_range('2024-01-01', periods=12, name='Date')
+    traded = 100 + np.arange(12.0)
+    dividends = np.where(np.arange(12) == 8, 2.0, 0.0)
+    calls = []
+
+    def fetch(ticker, start=None):
+        calls.append(start)
+        n_bars = 6 if len(calls) == 1 else 12
+        close = traded[:n_bars].copy()
+        if n_bars > 8:  # Back-adjusted for the dividend once the source knows of it
+            close[:8] *= 1 - dividends[8] / traded[7]
+        bars = pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close, 'Volume': 1000.0,
+                             'Dividends': dividends[:n_bars], 'Stock Splits': 0.0}, index=index[:n_bars])
+        return (bars if start is None else bars.loc[start:]), {}
+
+    ohlc_cache.load_adjusted('X', fetch=fetch, cache_dir=str(tmp_path))
+    path = ohlc_cache.cache_path('X', str(tmp_path))
+    os.utime(path, (time.time() - 10 ** 6, time.time() - 10 ** 6))
+    adjusted, _ = ohlc_cache.load_adjusted('X', fetch=fetch, cache_dir=str(tmp_path))
+
+    np.testing.assert_allclose(adjusted['Close'].to_numpy(), traded)
+    np.testing.assert_allclose(adjusted['Dividends'].to_numpy(), dividends)
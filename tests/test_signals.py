@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+from logic import indicators, trade_logic
+
+
+def history(high_scale=1.0):
+    index = pd.bdate_range('2020-01-01', periods=60, name='Date')
+    close = 100 + np.sin(np.arange(60) / 3) * 5
+    return pd.DataFrame({'Open': close, 'High': close * 1.01 * high_scale, 'Low': close * 0.99, 'Close': close},
+                        index=index)
+
+
+# Histories sharing their closes mustn't share the indicators of their other columns
+def test_indicators_of_other_columns_are_keyed_on_them():
+    indicators.ma_cache.clear()
+    rule = 'close > highest(high, 10) * 0.9'
+    first, _, _ = trade_logic.get_trades(history(), True, rule)
+    second, _, _ = trade_logic.get_trades(history(high_scale=2.0), True, rule)
+    indicators.ma_cache.clear()
+    fresh, _, _ = trade_logic.get_trades(history(high_scale=2.0), True, rule)
+    assert first.any()
+    assert not fresh.any()
+    pd.testing.assert_series_equal(second, fresh)
@@ -0,0 +1,8 @@
+import pytest
+from data.synthetic import synthetic_history
+
+
+def test_business_days_past_the_last_timestamp_raise():
+    assert synthetic_history(100000, start='1800-01-01').index.is_monotonic_increasing
+    with pytest.raises(ValueError):
+        synthetic_history(100000)